@@ -0,0 +1,131 @@
+from array import array
+from datetime import date, timedelta
+from typing import List, Sequence, Tuple
+
+GRANULARITIES = ("day", "week", "month")
+MAX_BUCKETS = 120
+_EPOCH = date(1970, 1, 1).toordinal()
+
+
+# Номер дня в daily_totals — число дней от 1970-01-01 в локальной зоне
+def day_number(d: date) -> int:
+    return d.toordinal() - _EPOCH
+
+
+def day_date(n: int) -> date:
+    return date.fromordinal(n + _EPOCH)
+
+
+def auto_granularity(start: date, end: date) -> str:
+    span = (end - start).days
+    if span <= 31:
+        return "day"
+    if span <= 26 * 7:
+        return "week"
+    return "month"
+
+
+# Начала корзин в [start, end); первая корзина выровнена по неделе/месяцу
+# и может начинаться раньше start — лишние дни просто не попадают в выборку.
+def bucket_starts(start: date, end: date, granularity: str) -> List[date]:
+    if granularity == "day":
+        first, step = start, None
+    elif granularity == "week":
+        first, step = start - timedelta(days=start.weekday()), None
+    else:
+        first, step = start.replace(day=1), "month"
+    starts = []
+    cur = first
+    while cur < end:
+        starts.append(cur)
+        if step == "month":
+            cur = date(cur.year + cur.month // 12, cur.month % 12 + 1, 1)
+        else:
+            cur += timedelta(days=1 if granularity == "day" else 7)
+    return starts
+
+
+# ---------- Ряды по категориям ----------
+# Вход — окно daily_totals пользователя в виде колонок (array): день,
+# индекс категории, сумма. Один проход раскладывает строки в плоский
+# массив values[категория * n_buckets + корзина] через таблицу
+# «смещение дня -> корзина», без запроса на каждую корзину. Дни до start
+# (окно сравнения) копятся в отдельный массив previous по категориям.
+class Series:
+    def __init__(
+        self,
+        categories: List[str],
+        starts: List[date],
+        values: array,
+        previous: array,
+    ):
+        self.categories = categories
+        self.starts = starts
+        self.values = values
+        self.previous = previous
+
+    @property
+    def n_buckets(self) -> int:
+        return len(self.starts)
+
+    def row(self, cat: int) -> Sequence[float]:
+        n = self.n_buckets
+        return self.values[cat * n:(cat + 1) * n]
+
+    def bucket_totals(self) -> List[float]:
+        n = self.n_buckets
+        totals = [0.0] * n
+        for cat in range(len(self.categories)):
+            for i, v in enumerate(self.values[cat * n:(cat + 1) * n]):
+                totals[i] += v
+        return totals
+
+    # (категория, сумма за период, сумма за предыдущий такой же период),
+    # по убыванию суммы
+    def category_totals(self) -> List[Tuple[str, float, float]]:
+        out = [
+            (name, float(sum(self.row(i))), self.previous[i])
+            for i, name in enumerate(self.categories)
+        ]
+        out = [r for r in out if r[1] or r[2]]
+        out.sort(key=lambda r: -r[1])
+        return out
+
+    # категории с наибольшим изменением к предыдущему периоду
+    def movers(self, limit: int = 3) -> Tuple[List[Tuple[str, float]], List[Tuple[str, float]]]:
+        deltas = [(name, cur - prev) for name, cur, prev in self.category_totals()]
+        up = sorted((d for d in deltas if d[1] > 0), key=lambda d: -d[1])[:limit]
+        down = sorted((d for d in deltas if d[1] < 0), key=lambda d: d[1])[:limit]
+        return up, down
+
+
+def build_series(
+    days: array,
+    cats: array,
+    sums: array,
+    categories: List[str],
+    start: date,
+    end: date,
+    granularity: str,
+) -> Series:
+    starts = bucket_starts(start, end, granularity)
+    n = len(starts)
+    start_day, end_day = day_number(start), day_number(end)
+    # смещение дня от start -> номер корзины
+    lookup = array("H", bytes(2 * (end_day - start_day)))
+    bucket = 0
+    bounds = [day_number(s) for s in starts[1:]] + [end_day]
+    for off in range(end_day - start_day):
+        while start_day + off >= bounds[bucket]:
+            bucket += 1
+        lookup[off] = bucket
+    values = array("d", bytes(8 * n * len(categories)))
+    previous = array("d", bytes(8 * len(categories)))
+    for day, cat, s in zip(days, cats, sums):
+        off = day - start_day
+        if off < 0:
+            previous[cat] += s
+        elif off < len(lookup):
+            values[cat * n + lookup[off]] += s
+    return Series(categories, starts, values, previous)
+
@@ -0,0 +1,263 @@
+import collections
+import json
+import os
+import sqlite3
+import time
+import zlib
+from datetime import date
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from analytics import day_date, day_number
+
+# Сколько пользователей архивировать в одной транзакции по умолчанию
+USERS_PER_SLICE = 100
+
+
+# ---------- Месяцы ----------
+# Месяц — число year*12 + (month-1) по локальному календарю
+def month_of(day: int) -> int:
+    d = day_date(day)
+    return d.year * 12 + d.month - 1
+
+
+def month_start(month: int) -> int:
+    return day_number(date(month // 12, month % 12 + 1, 1))
+
+
+def month_days(month: int, mask: int) -> List[int]:
+    first = month_start(month)
+    return [first + i for i in range(31) if mask >> i & 1]
+
+
+# Месяцы, целиком лежащие в [start_day, end_day) по первому дню: (с, по) включительно
+def months_within(start_day: int, end_day: int) -> Tuple[int, int]:
+    first = month_of(start_day)
+    if month_start(first) < start_day:
+        first += 1
+    return first, month_of(end_day - 1)
+
+
+# Граница хранения: первое число месяца, в который попадает today - keep_days.
+# Месяц целиком либо горячий, либо в архиве.
+def cutoff_day(today: int, keep_days: int) -> int:
+    return month_start(month_of(today - keep_days))
+
+
+# ---------- Схема архива ----------
+# Отдельный файл, подключённый как схема archive: сжатые пачки сырых трат
+# (user_id, месяц, seq). Пишется только добавлением; видимы лишь пачки,
+# записанные в archive_index основной базы — если между коммитами архива и
+# основной базы процесс упал, пачка-сирота просто игнорируется.
+def init(conn: sqlite3.Connection):
+    with conn:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS archive.chunks("
+            "user_id INTEGER NOT NULL, month INTEGER NOT NULL, seq INTEGER NOT NULL, "
+            "rows INTEGER NOT NULL, data BLOB NOT NULL, created_ts INTEGER NOT NULL, "
+            "PRIMARY KEY(user_id, month, seq))"
+        )
+
+
+def _pack(rows: List[Tuple[float, str, str, int]]) -> bytes:
+    return zlib.compress(json.dumps(rows, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 6)
+
+
+def _unpack(data: bytes) -> List[List[Any]]:
+    return json.loads(zlib.decompress(data))
+
+
+# ---------- Перенос в архив ----------
+# Следующие limit пользователей после after_user, у которых есть дни до
+# cutoff. Для них: сырые траты -> пачки в архив (первая транзакция),
+# затем в основной базе дневные агрегаты сворачиваются в monthly_totals,
+# дни месяца — в битовую маску monthly_days, пачки регистрируются в
+# archive_index, а сами строки удаляются (вторая транзакция). Суммы, число
+# дней и серии при этом не меняются. Возвращает (последний user_id, перенесено
+# трат) или None, если пользователей не осталось.
+def archive_slice(
+    conn: sqlite3.Connection, tz_offset: int, cutoff: int, after_user: int, limit: int = USERS_PER_SLICE
+) -> Optional[Tuple[int, int]]:
+    users = [r[0] for r in conn.execute(
+        "SELECT DISTINCT user_id FROM daily_totals WHERE user_id>? AND day<? ORDER BY user_id LIMIT ?",
+        (after_user, cutoff, limit),
+    )]
+    if not users:
+        return None
+    marks = ",".join("?" * len(users))
+    cutoff_ts = cutoff * 86400 - tz_offset
+
+    chunks: Dict[Tuple[int, int], List[Tuple[float, str, str, int]]] = {}
+    cur = conn.cursor()
+    cur.row_factory = None
+    for user_id, amount, category, created_at, ts in cur.execute(
+        "SELECT user_id, amount, category, created_at, created_ts FROM expenses "
+        f"WHERE user_id IN ({marks}) AND created_ts<? ORDER BY user_id, created_ts DESC, id DESC",
+        (*users, cutoff_ts),
+    ):
+        chunks.setdefault((user_id, month_of((ts + tz_offset) // 86400)), []).append(
+            (amount, category, created_at, ts)
+        )
+
+    index = []
+    now = int(time.time())
+    with conn:
+        for (user_id, month), rows in chunks.items():
+            seq = conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) + 1 FROM archive.chunks WHERE user_id=? AND month=?",
+                (user_id, month),
+            ).fetchone()[0]
+            conn.execute(
+                "INSERT INTO archive.chunks(user_id, month, seq, rows, data, created_ts) VALUES (?,?,?,?,?,?)",
+                (user_id, month, seq, len(rows), _pack(rows), now),
+            )
+            index.append((user_id, month, seq, len(rows)))
+
+    totals: Dict[Tuple[int, int, str], Tuple[float, int]] = {}
+    masks: Dict[Tuple[int, int], int] = {}
+    for user_id, day, category, s, n in cur.execute(
+        f"SELECT user_id, day, category, sum, count FROM daily_totals WHERE user_id IN ({marks}) AND day<?",
+        (*users, cutoff),
+    ):
+        month = month_of(day)
+        ps, pn = totals.get((user_id, month, category), (0.0, 0))
+        totals[(user_id, month, category)] = (ps + s, pn + n)
+        masks[(user_id, month)] = masks.get((user_id, month), 0) | 1 << (day - month_start(month))
+
+    with conn:
+        conn.executemany(
+            "INSERT INTO monthly_totals(user_id, month, category, sum, count) VALUES (?,?,?,?,?) "
+            "ON CONFLICT(user_id, month, category) DO UPDATE "
+            "SET sum=sum+excluded.sum, count=count+excluded.count",
+            [(*k, s, n) for k, (s, n) in totals.items()],
+        )
+        conn.executemany(
+            "INSERT INTO monthly_days(user_id, month, mask) VALUES (?,?,?) "
+            "ON CONFLICT(user_id, month) DO UPDATE SET mask=mask|excluded.mask",
+            [(*k, m) for k, m in masks.items()],
+        )
+        conn.executemany("INSERT INTO archive_index(user_id, month, seq, rows) VALUES (?,?,?,?)", index)
+        moved = conn.execute(
+            f"DELETE FROM expenses WHERE user_id IN ({marks}) AND created_ts<?", (*users, cutoff_ts)
+        ).rowcount
+        conn.execute(f"DELETE FROM daily_totals WHERE user_id IN ({marks}) AND day<?", (*users, cutoff))
+    return users[-1], moved
+
+
+def clear_user(conn: sqlite3.Connection, user_id: int):
+    conn.execute("DELETE FROM monthly_totals WHERE user_id=?", (user_id,))
+    conn.execute("DELETE FROM monthly_days WHERE user_id=?", (user_id,))
+    conn.execute("DELETE FROM archive_index WHERE user_id=?", (user_id,))
+    conn.execute("DELETE FROM archive.chunks WHERE user_id=?", (user_id,))
+
+
+# ---------- Чтение ----------
+# Бэкфиллы 006/008 на старых базах вызывают rollup раньше миграции 011 —
+# тогда monthly_days ещё нет, и архив считается пустым
+def _monthly_days(conn: sqlite3.Connection, sql: str, args: Tuple) -> List[Tuple]:
+    try:
+        return conn.execute(sql, args).fetchall()
+    except sqlite3.OperationalError as e:
+        if "no such table" in str(e):
+            return []
+        raise
+
+
+def archived_users(conn: sqlite3.Connection) -> List[int]:
+    return [r[0] for r in _monthly_days(conn, "SELECT DISTINCT user_id FROM monthly_days", ())]
+
+
+def archived_days(conn: sqlite3.Connection, user_id: int) -> List[int]:
+    days: List[int] = []
+    for month, mask in _monthly_days(conn, "SELECT month, mask FROM monthly_days WHERE user_id=?", (user_id,)):
+        days.extend(month_days(month, mask))
+    return days
+
+
+def has_archived_day(conn: sqlite3.Connection, user_id: int, day: int) -> bool:
+    month = month_of(day)
+    rows = _monthly_days(conn, "SELECT mask FROM monthly_days WHERE user_id=? AND month=?", (user_id, month))
+    return bool(rows) and bool(rows[0][0] >> (day - month_start(month)) & 1)
+
+
+# Начало (unix) первого месяца после архива пользователя или None, если архива нет
+def archive_boundary_ts(conn: sqlite3.Connection, user_id: int, tz_offset: int) -> Optional[int]:
+    row = conn.execute("SELECT MAX(month) FROM archive_index WHERE user_id=?", (user_id,)).fetchone()
+    if row[0] is None:
+        return None
+    return month_start(row[0] + 1) * 86400 - tz_offset
+
+
+def archived_months(conn: sqlite3.Connection, user_id: int) -> List[int]:
+    return [r[0] for r in conn.execute("SELECT DISTINCT month FROM archive_index WHERE user_id=?", (user_id,))]
+
+
+# Число архивных трат пользователя в месяцах months по ключу
+# (created_ts, category, amount) — для отсева дубликатов при импорте
+def row_counts(conn: sqlite3.Connection, user_id: int, months: List[int]) -> "collections.Counter[Tuple[int, str, float]]":
+    counts: "collections.Counter[Tuple[int, str, float]]" = collections.Counter()
+    for month in months:
+        for (data,) in conn.execute(
+            "SELECT c.data FROM archive_index i JOIN archive.chunks c "
+            "ON c.user_id=i.user_id AND c.month=i.month AND c.seq=i.seq "
+            "WHERE i.user_id=? AND i.month=?",
+            (user_id, month),
+        ):
+            counts.update((ts, cat, amount) for amount, cat, _, ts in _unpack(data))
+    return counts
+
+
+# Архивные траты пользователя по убыванию времени: месяцы от новых к старым,
+# пачки месяца распаковываются и сортируются вместе (дозаписанные позже
+# пачки того же месяца могут содержать более ранние траты)
+def iter_rows(
+    conn: sqlite3.Connection,
+    user_id: int,
+    tz_offset: int,
+    start_ts: Optional[int],
+    end_ts: Optional[int],
+    category: Optional[str],
+) -> Iterator[Dict[str, Any]]:
+    months = [r[0] for r in conn.execute(
+        "SELECT DISTINCT month FROM archive_index WHERE user_id=? ORDER BY month DESC", (user_id,)
+    )]
+    for month in months:
+        first_ts = month_start(month) * 86400 - tz_offset
+        next_ts = month_start(month + 1) * 86400 - tz_offset
+        if (end_ts is not None and first_ts >= end_ts) or (start_ts is not None and next_ts <= start_ts):
+            continue
+        rows = []
+        for (data,) in conn.execute(
+            "SELECT c.data FROM archive_index i JOIN archive.chunks c "
+            "ON c.user_id=i.user_id AND c.month=i.month AND c.seq=i.seq "
+            "WHERE i.user_id=? AND i.month=?",
+            (user_id, month),
+        ):
+            for amount, cat, created_at, ts in _unpack(data):
+                if start_ts is not None and ts < start_ts or end_ts is not None and ts >= end_ts:
+                    continue
+                if category is not None and cat != category:
+                    continue
+                rows.append({"amount": amount, "category": cat, "created_at": created_at, "created_ts": ts})
+        rows.sort(key=lambda r: r["created_ts"], reverse=True)
+        yield from rows
+
+
+# ---------- Обслуживание ----------
+# Освободить до pages страниц (нужен auto_vacuum=INCREMENTAL).
+# Возвращает число освобождённых страниц.
+def incremental_vacuum(conn: sqlite3.Connection, pages: int) -> int:
+    before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    if not before:
+        return 0
+    conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+    return before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+def auto_vacuum_incremental(conn: sqlite3.Connection) -> bool:
+    return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+
+# finances.db -> finances.archive.db (у шардов — свой архив рядом с каждым)
+def archive_path(path: str) -> str:
+    root, ext = os.path.splitext(path)
+    return f"{root}.archive{ext}"
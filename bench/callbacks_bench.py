@@ -0,0 +1,107 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+
+os.environ.setdefault("BOT_TOKEN", "1:bench")
+
+from aiogram import Bot, Dispatcher, F, Router
+from aiogram.fsm.context import FSMContext
+from aiogram.types import CallbackQuery, Update, User
+
+import callbacks
+import main as bot
+
+
+# ---------- Бенчмарк callback-диспетчеризации ----------
+# Полный путь Dispatcher.feed_update для N действий: router с N фильтрами
+# F.data == … (как было) против одного входа с CallbackTable. Меряется
+# нажатие на последнюю кнопку (фильтры перебираются все) и битый payload.
+# Отдельно — размер данных кнопок бота в старом и новом формате.
+#   python -m bench.callbacks_bench --actions 6,25,100,400 --iterations 2000
+async def _noop(cb: CallbackQuery, *args):
+    pass
+
+
+def filters_dispatcher(n: int) -> Dispatcher:
+    router = Router()
+    for i in range(n):
+        router.callback_query(F.data == f"action{i}:go")(_noop)
+    dp = Dispatcher()
+    dp.include_router(router)
+    return dp
+
+
+def table_dispatcher(n: int) -> Dispatcher:
+    codec = callbacks.CallbackCodec({f"action{i}": (format(i, "x"), None) for i in range(n)})
+    table = callbacks.CallbackTable(codec)
+    for i in range(n):
+        table.on(f"action{i}")(_noop)
+    router = Router()
+
+    @router.callback_query()
+    async def entry(cb: CallbackQuery, state: FSMContext):
+        found = table.resolve(cb.data)
+        if found is not None:
+            fn, arg = found
+            await fn(cb, state, arg)
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    return dp
+
+
+def update(data: str) -> Update:
+    user = User(id=1, is_bot=False, first_name="u")
+    return Update(update_id=1, callback_query=CallbackQuery(id="1", from_user=user, chat_instance="1", data=data))
+
+
+async def measure(dp: Dispatcher, tg: Bot, data: str, iterations: int) -> float:
+    upd = update(data)
+    for _ in range(min(iterations, 500)):
+        await dp.feed_update(tg, upd)
+    started = time.perf_counter()
+    for _ in range(iterations):
+        await dp.feed_update(tg, upd)
+    return round((time.perf_counter() - started) / iterations * 1e6, 1)
+
+
+def payload_sizes() -> dict:
+    legacy = ["pick:12", "page:1", "stats:month", "menu:export", "myreset:confirm", "noop"]
+    result = {}
+    for old in legacy:
+        action, arg = bot.CODEC.decode(old)
+        new = bot.CODEC.encode(action, arg)
+        assert bot.CODEC.decode(new) == (action, arg)
+        result[old] = new
+    return result
+
+
+async def run(actions, iterations: int) -> dict:
+    tg = Bot("1:bench")
+    result = {"payloads": payload_sizes()}
+    for n in actions:
+        old, new = filters_dispatcher(n), table_dispatcher(n)
+        last_code = format(n - 1, "x")
+        result[n] = {
+            "filters_last_us": await measure(old, tg, f"action{n - 1}:go", iterations),
+            "table_last_us": await measure(new, tg, f"1{last_code}", iterations),
+            "filters_malformed_us": await measure(old, tg, "x" * 64, iterations),
+            "table_malformed_us": await measure(new, tg, "x" * 64, iterations),
+        }
+    await tg.session.close()
+    return result
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--actions", default="6,25,100,400", help="comma-separated action counts")
+    p.add_argument("--iterations", type=int, default=2000)
+    args = p.parse_args()
+    actions = [int(x) for x in args.actions.split(",")]
+    print(json.dumps(asyncio.run(run(actions, args.iterations)), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
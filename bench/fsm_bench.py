@@ -0,0 +1,64 @@
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from datetime import timezone
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from fsm_storage import SQLiteStorage
+from storage import Storage
+
+
+# ---------- Бенчмарк FSM-хранилищ ----------
+# Прогоняет типичную для бота последовательность FSM-операций на апдейт
+# (сумма -> выбор категории) и сравнивает MemoryStorage с SQLiteStorage
+# при тёплом кэше и без кэша.
+#   python -m bench.fsm_bench --users 2000 --rounds 5
+async def one_update(storage, key: StorageKey, amount: float):
+    # got_amount: фильтр по состоянию, update_data, set_state
+    await storage.get_state(key)
+    data = await storage.get_data(key)
+    data["amount"] = amount
+    await storage.set_data(key, data)
+    await storage.set_state(key, "AddFlow:waiting_category")
+    # picked_category: фильтр, get_data, clear, set_state
+    await storage.get_state(key)
+    await storage.get_data(key)
+    await storage.set_state(key, None)
+    await storage.set_data(key, {})
+    await storage.set_state(key, "AddFlow:waiting_amount")
+
+
+async def run(storage, users: int, rounds: int) -> float:
+    keys = [StorageKey(bot_id=1, chat_id=u, user_id=u) for u in range(users)]
+    started = time.perf_counter()
+    for r in range(rounds):
+        await asyncio.gather(*(one_update(storage, k, float(r)) for k in keys))
+    return (time.perf_counter() - started) / (users * rounds)
+
+
+async def main(args):
+    results = {"users": args.users, "rounds": args.rounds}
+    results["memory_us"] = await run(MemoryStorage(), args.users, args.rounds) * 1e6
+
+    for name, cache_size in (("sqlite_cached_us", args.users * 2), ("sqlite_uncached_us", 0)):
+        path = os.path.join(tempfile.mkdtemp(), "fsm.db")
+        store = Storage(path, timezone.utc)
+        await store.open()
+        fsm = SQLiteStorage(store, cache_size=cache_size)
+        results[name] = await run(fsm, args.users, args.rounds) * 1e6
+        await fsm.close()
+        await store.close()
+
+    print(json.dumps({k: round(v, 2) if isinstance(v, float) else v for k, v in results.items()}, indent=2))
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument("--users", type=int, default=2000)
+    p.add_argument("--rounds", type=int, default=5)
+    asyncio.run(main(p.parse_args()))
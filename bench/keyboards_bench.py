@@ -0,0 +1,91 @@
+import argparse
+import json
+import os
+import time
+import tracemalloc
+
+os.environ.setdefault("BOT_TOKEN", "1:bench")
+
+from aiogram.methods import SendMessage
+
+import main as bot
+
+
+# ---------- Бенчмарк клавиатур ----------
+# Путь picked_category -> answer: текст подтверждения + главное меню.
+# Сравнивает сборку разметки на каждый ответ с общей разметкой из реестра
+# (CPU на вызов и аллокации по tracemalloc). Заодно — got_amount с первой
+# страницей категорий.
+#   python -m bench.keyboards_bench --iterations 20000
+def reply_fresh():
+    return SendMessage(
+        chat_id=1,
+        text=f"✅ <b>Записала трату</b>\n\n{390:g} • Еда\n\n{bot.NEXT_STEPS}",
+        parse_mode="HTML",
+        reply_markup=bot.build_main_menu(),
+    )
+
+
+def reply_cached():
+    return SendMessage(
+        chat_id=1,
+        text=f"✅ <b>Записала трату</b>\n\n{390:g} • Еда\n\n{bot.NEXT_STEPS}",
+        parse_mode="HTML",
+        reply_markup=bot.inline_main_menu(),
+    )
+
+
+def categories_fresh():
+    return SendMessage(chat_id=1, text="Ок", reply_markup=bot.build_categories_kb(0))
+
+
+def categories_cached():
+    return SendMessage(chat_id=1, text="Ок", reply_markup=bot.categories_kb(0))
+
+
+def measure(fn, iterations: int) -> dict:
+    for _ in range(min(iterations, 1000)):
+        fn()
+    started = time.process_time()
+    for _ in range(iterations):
+        fn()
+    cpu = time.process_time() - started
+
+    tracemalloc.start()
+    sample = min(iterations, 2000)
+    before = tracemalloc.take_snapshot()
+    keep = [fn() for _ in range(sample)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(s.size_diff for s in after.compare_to(before, "filename"))
+    blocks = sum(s.count_diff for s in after.compare_to(before, "filename"))
+    del keep
+    return {
+        "us_per_call": round(cpu / iterations * 1e6, 2),
+        "retained_bytes_per_call": round(allocated / sample),
+        "retained_blocks_per_call": round(blocks / sample, 1),
+    }
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--iterations", type=int, default=20000)
+    args = p.parse_args()
+    result = {}
+    for name, fresh, cached in (
+        ("picked_category", reply_fresh, reply_cached),
+        ("got_amount", categories_fresh, categories_cached),
+    ):
+        f = measure(fresh, args.iterations)
+        c = measure(cached, args.iterations)
+        result[name] = {
+            "fresh": f,
+            "cached": c,
+            "cpu_saved_us": round(f["us_per_call"] - c["us_per_call"], 2),
+            "bytes_saved": f["retained_bytes_per_call"] - c["retained_bytes_per_call"],
+        }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
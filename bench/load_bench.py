@@ -0,0 +1,274 @@
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import closing, redirect_stdout
+from typing import Any, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Chat, Message, Update
+
+import rollup
+from migrations import migrate
+
+
+# ---------- Нагрузочный прогон настоящего роутера ----------
+# Собирает Dispatcher из main.py и гоняет через feed_update синтетический
+# трафик тысяч пользователей: сумма -> категория, вперемешку со
+# статистикой, /me, /export и /undo. Вместо Telegram — FakeSession,
+# которая только считает вызовы API. База предварительно заполняется
+# до --rows строк (повторный запуск с тем же --db дольёт недостающее).
+#   python -m bench.load_bench --rows 1000000 --users 5000 --actions 20 --db /tmp/load.db
+# Результат — JSON: пропускная способность и p50/p95/p99 на хэндлер.
+class FakeSession(BaseSession):
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls: "collections.Counter[str]" = collections.Counter()
+        self._ids = itertools.count(1)
+
+    async def make_request(self, bot: Bot, method, timeout: Optional[int] = None) -> Any:
+        name = method.__api_method__
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if name.startswith("send"):
+            chat_id = getattr(method, "chat_id", 0) or 0
+            return Message(
+                message_id=next(self._ids),
+                date=int(time.time()),
+                chat=Chat(id=chat_id, type="private"),
+                text=getattr(method, "text", None),
+            )
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+def seed(path: str, rows: int, users: int, days: int, categories: List[str], tz_offset: int = 0) -> int:
+    with closing(sqlite3.connect(path)) as conn:
+        migrate(conn, tz_offset)
+        have = conn.execute("SELECT COUNT(*) FROM expenses").fetchone()[0]
+        missing = rows - have
+        if missing <= 0:
+            return 0
+        rnd = random.Random(have)
+        now = int(time.time())
+        batch = []
+        for _ in range(missing):
+            ts = now - rnd.randrange(days * 86400)
+            batch.append((
+                1000 + rnd.randrange(users),
+                float(rnd.randint(50, 3000)),
+                rnd.choice(categories),
+                time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(ts)),
+                ts,
+            ))
+            if len(batch) >= 50000:
+                with conn:
+                    conn.executemany(
+                        "INSERT INTO expenses(user_id,amount,category,created_at,created_ts) VALUES (?,?,?,?,?)",
+                        batch,
+                    )
+                batch.clear()
+        if batch:
+            with conn:
+                conn.executemany(
+                    "INSERT INTO expenses(user_id,amount,category,created_at,created_ts) VALUES (?,?,?,?,?)",
+                    batch,
+                )
+        rollup.rebuild(conn, tz_offset)
+        return missing
+
+
+# ---------- Апдейты ----------
+_update_ids = itertools.count(1)
+
+
+def message_update(user_id: int, text: str) -> Dict[str, Any]:
+    msg: Dict[str, Any] = {
+        "message_id": next(_update_ids),
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "U"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": next(_update_ids), "message": msg}
+
+
+def callback_update(user_id: int, data: str) -> Dict[str, Any]:
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "from": {"id": user_id, "is_bot": False, "first_name": "U"},
+            "chat_instance": "bench",
+            "data": data,
+            "message": {
+                "message_id": next(_update_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "?",
+            },
+        },
+    }
+
+
+# одно действие пользователя -> список (хэндлер, апдейт)
+def user_action(rnd: random.Random, user_id: int, mix: Dict[str, float], categories: int):
+    roll = rnd.random()
+    for name, share in mix.items():
+        if roll < share:
+            break
+        roll -= share
+    else:
+        name = "add"
+    if name == "stats":
+        return [("stats_cb", callback_update(user_id, f"stats:{rnd.choice(['today', '7d', 'month'])}"))]
+    if name == "me":
+        return [("me_cmd", message_update(user_id, "/me"))]
+    if name == "export":
+        return [("export_csv", message_update(user_id, "/export"))]
+    if name == "undo":
+        return [("undo_cmd", message_update(user_id, "/undo"))]
+    return [
+        ("got_amount", message_update(user_id, str(rnd.randint(50, 3000)))),
+        ("picked_category", callback_update(user_id, f"pick:{rnd.randrange(categories)}")),
+    ]
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    s = sorted(samples)
+
+    def q(p: float) -> float:
+        return round(s[min(len(s) - 1, int(p * len(s)))] * 1000, 3)
+
+    return {"count": len(s), "p50_ms": q(0.50), "p95_ms": q(0.95), "p99_ms": q(0.99), "max_ms": round(s[-1] * 1000, 3)}
+
+
+async def run(bot_module, args) -> Dict[str, Any]:
+    session = FakeSession(args.api_latency_ms / 1000)
+    bot = Bot(bot_module.BOT_TOKEN, session=session)
+    if bot_module.metrics.ENABLED:
+        session.middleware(bot_module.metrics.RequestTimer())
+    dp = bot_module.build_dispatcher()
+    with redirect_stdout(sys.stderr):
+        await bot_module.store.open()
+    bot_module.sender.start(bot)
+    latencies: Dict[str, List[float]] = collections.defaultdict(list)
+    errors: "collections.Counter[str]" = collections.Counter()
+    mix = {"stats": args.stats, "me": args.me, "export": args.export, "undo": args.undo}
+    categories = len(bot_module.CATEGORY_OPTIONS)
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async def feed(handler: str, raw: Dict[str, Any]):
+        update = Update.model_validate(raw, context={"bot": bot})
+        started = time.perf_counter()
+        try:
+            await dp.feed_update(bot, update)
+        except Exception:
+            errors[handler] += 1
+        latencies[handler].append(time.perf_counter() - started)
+
+    # апдейты одного пользователя идут строго по очереди, как в живом чате
+    async def user_session(user_id: int):
+        rnd = random.Random(user_id)
+        async with sem:
+            await feed("start_cmd", message_update(user_id, "/start"))
+            for _ in range(args.actions):
+                for handler, raw in user_action(rnd, user_id, mix, categories):
+                    await feed(handler, raw)
+
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(user_session(1000 + i) for i in range(args.users)))
+        elapsed = time.perf_counter() - started
+        # хэндлеры не ждут отправку — дожидаемся хвоста планировщика
+        await bot_module.sender.stop(timeout=600)
+        drained = time.perf_counter() - started
+    finally:
+        await bot_module.fsm_storage.close()
+        await bot_module.store.close()
+
+    updates = sum(len(v) for v in latencies.values())
+    expenses = len(latencies.get("picked_category", ()))
+    return {
+        "updates": updates,
+        "seconds": round(elapsed, 3),
+        "updates_per_sec": round(updates / elapsed, 1) if elapsed else None,
+        "expenses_per_sec": round(expenses / elapsed, 1) if elapsed else None,
+        "handlers": {name: percentiles(v) for name, v in sorted(latencies.items())},
+        "errors": dict(errors),
+        "send_drain_seconds": round(drained - elapsed, 3),
+        "merged_messages": bot_module.sender.merged,
+        "api_calls": dict(session.calls),
+    }
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--db", help="SQLite file to reuse between runs (default: temp file)")
+    p.add_argument("--rows", type=int, default=100000, help="pre-seeded expenses")
+    p.add_argument("--seed-days", type=int, default=365)
+    p.add_argument("--users", type=int, default=2000)
+    p.add_argument("--actions", type=int, default=10, help="actions per user")
+    p.add_argument("--concurrency", type=int, default=500, help="users active at once")
+    p.add_argument("--api-latency-ms", type=float, default=0.0)
+    p.add_argument("--stats", type=float, default=0.15, help="share of stats actions")
+    p.add_argument("--me", type=float, default=0.10)
+    p.add_argument("--export", type=float, default=0.02)
+    p.add_argument("--undo", type=float, default=0.05)
+    p.add_argument("--send-rate", type=float, default=0.0,
+                   help="global send limit per second (default: no pacing, measure the bot alone)")
+    p.add_argument("--metrics", action="store_true", help="run with metrics collection on (overhead check)")
+    args = p.parse_args()
+
+    tmp = None
+    if args.db is None:
+        tmp = tempfile.TemporaryDirectory()
+        args.db = os.path.join(tmp.name, "load.db")
+    os.environ["DB_PATH"] = args.db
+    os.environ.setdefault("BOT_TOKEN", "1:bench")
+    # порт не слушается: бенчмарк не поднимает HTTP, нужен только сбор
+    os.environ["METRICS_PORT"] = "1" if args.metrics else "0"
+    if args.send_rate:
+        os.environ["SEND_GLOBAL_RATE"] = str(args.send_rate)
+    else:
+        os.environ["SEND_GLOBAL_RATE"] = os.environ["SEND_CHAT_RATE"] = "1000000"
+        os.environ["SEND_CHAT_BURST"] = "1000000"
+    import main as bot_module
+
+    # лог миграций уходит в stderr, чтобы stdout остался чистым JSON
+    started = time.perf_counter()
+    with redirect_stdout(sys.stderr):
+        seeded = seed(args.db, args.rows, args.users, args.seed_days, bot_module.RAW_CATEGORIES)
+    seed_seconds = time.perf_counter() - started
+
+    result = asyncio.run(run(bot_module, args))
+    config = {k: v for k, v in vars(args).items() if k != "db"}
+    print(json.dumps({
+        "config": config,
+        "seeded_rows": seeded,
+        "seed_seconds": round(seed_seconds, 2),
+        **result,
+    }, indent=2))
+    if tmp is not None:
+        tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
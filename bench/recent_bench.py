@@ -0,0 +1,129 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from storage import Storage
+
+CATEGORIES = ["Кофе", "Еда", "Транспорт", "Дом", "Подписки", "Иное"]
+
+
+# ---------- Бенчмарк кэша недавних трат ----------
+# users пользователей с history днями трат (per_day в день). Меряется
+# fetch_stats за «Сегодня» и «7 дней»: с выключенным кэшем (дневные агрегаты
+# в SQLite) и с прогретым кэшем, плюс память на пользователя. Затем
+# случайные add/undo/redo/reset/import и сверка кэша с базой — drift
+# должен быть пустым.
+#   python -m bench.recent_bench --users 2000 --history 30 --per-day 5 --ops 5000
+async def populate(store: Storage, args):
+    now = datetime.now(timezone.utc)
+    rng = random.Random(1)
+    for user_id in range(args.users):
+        items = [
+            (round(rng.uniform(1, 500), 2), rng.choice(CATEGORIES), now - timedelta(days=d, minutes=rng.randrange(600)))
+            for d in range(args.history, -1, -1)
+            for _ in range(args.per_day)
+        ]
+        await store.add_expenses(user_id, items)
+
+
+def bounds(days: int):
+    now = datetime.now(timezone.utc)
+    end = datetime(now.year, now.month, now.day, tzinfo=timezone.utc) + timedelta(days=1)
+    return end - timedelta(days=days), end
+
+
+async def measure(store: Storage, users: int, days: int, iterations: int) -> float:
+    start, end = bounds(days)
+    rng = random.Random(2)
+    started = time.perf_counter()
+    for _ in range(iterations):
+        await store.fetch_stats(rng.randrange(users), start, end)
+    return round((time.perf_counter() - started) / iterations * 1e6, 1)
+
+
+async def churn(store: Storage, args) -> dict:
+    rng = random.Random(3)
+    now = datetime.now(timezone.utc)
+    counts = dict.fromkeys(("add", "backdated", "undo", "redo", "reset", "restore"), 0)
+    for _ in range(args.ops):
+        user_id = rng.randrange(args.users)
+        op = rng.choices(list(counts), weights=(50, 10, 20, 15, 1, 1))[0]
+        counts[op] += 1
+        if op == "add":
+            await store.add_expense(user_id, round(rng.uniform(1, 500), 2), rng.choice(CATEGORIES), now)
+        elif op == "backdated":
+            await store.add_expense(user_id, 7.0, rng.choice(CATEGORIES), now - timedelta(days=rng.randrange(10)))
+        elif op == "undo":
+            await store.undo_last(user_id)
+        elif op == "redo":
+            await store.redo_last(user_id)
+        elif op == "reset":
+            await store.reset_user(user_id)
+        else:
+            await store.restore_reset(user_id)
+        # чтения между записями держат пользователя в кэше
+        if rng.random() < 0.5:
+            await store.fetch_stats(user_id, *bounds(rng.choice((1, 7))))
+        if rng.random() < 0.2:
+            await store.last_expense(user_id)
+    return counts
+
+
+async def run(args) -> dict:
+    path = os.path.join(tempfile.mkdtemp(), "finances.db")
+    store = Storage(path, timezone.utc, recent_cache_bytes=args.cache_mb << 20)
+    with contextlib.redirect_stdout(sys.stderr):
+        await store.open()
+    await populate(store, args)
+    result = {"users": args.users, "expenses": args.users * (args.history + 1) * args.per_day}
+
+    # без кэша: окно никогда не попадает в RecentCache
+    window_days = store.recent.window_days
+    store.recent.window_days = 0
+    result["db_today_us"] = await measure(store, args.users, 1, args.iterations)
+    result["db_7d_us"] = await measure(store, args.users, 7, args.iterations)
+    store.recent.window_days = window_days
+
+    # прогрев, затем чтение из памяти
+    start, end = bounds(7)
+    for user_id in range(args.users):
+        await store.fetch_stats(user_id, start, end)
+    result["cache_today_us"] = await measure(store, args.users, 1, args.iterations)
+    result["cache_7d_us"] = await measure(store, args.users, 7, args.iterations)
+    result["cached_users"] = store.cached_recent_users
+    result["bytes_per_user"] = round(store.recent_cache_bytes / max(store.cached_recent_users, 1))
+
+    # совпадение с базой до и после случайных записей
+    result["stats_mismatch"] = 0
+    for user_id in range(args.users):
+        cached = await store.fetch_stats(user_id, start, end)
+        exact = await store._read(store._fetch_stats, user_id, start, end)
+        if abs(cached[0] - exact[0]) > 1e-6:
+            result["stats_mismatch"] += 1
+    result["churn"] = await churn(store, args)
+    result["drift"] = await store.verify_recent()
+    await store.close()
+    return result
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--users", type=int, default=2000)
+    p.add_argument("--history", type=int, default=30, help="days of history per user")
+    p.add_argument("--per-day", type=int, default=5)
+    p.add_argument("--iterations", type=int, default=2000)
+    p.add_argument("--ops", type=int, default=5000, help="random writes before the drift check")
+    p.add_argument("--cache-mb", type=int, default=32)
+    args = p.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import argparse
+import asyncio
+import collections
+import json
+import random
+import time
+from typing import Any, Dict, Iterator, List
+
+from aiohttp import ClientSession, web
+
+from webhook import SECRET_HEADER, route_key
+
+
+# ---------- Локальная проверка режима webhook без сети ----------
+# 1) заглушка Bot API:   python -m bench.replay_webhook fake-api --port 8099
+# 2) бот:                BOT_MODE=webhook WEBHOOK_SECRET=s BOT_API_SERVER=http://127.0.0.1:8099 \
+#                        WEBHOOK_WORKERS=2 python main.py
+# 3) прогон апдейтов:    python -m bench.replay_webhook replay --secret s --file updates.jsonl
+#                        (или --synthetic 1000 вместо --file)
+def fake_message(chat_id: int, text: str = "") -> Dict[str, Any]:
+    return {
+        "message_id": random.randint(1, 2**31),
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "text": text,
+    }
+
+
+def fake_api_app() -> web.Application:
+    calls: "collections.Counter[str]" = collections.Counter()
+
+    async def handle(request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        calls[method] += 1
+        form = await request.post()
+        chat_id = int(form.get("chat_id") or 0)
+        if method.lower().startswith(("send", "edit")):
+            result: Any = fake_message(chat_id, str(form.get("text", "")))
+        elif method.lower() == "getme":
+            result = {"id": 1, "is_bot": True, "first_name": "Flamingo"}
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def stats(request: web.Request) -> web.Response:
+        return web.json_response(dict(calls))
+
+    app = web.Application()
+    app.router.add_get("/stats", stats)
+    app.router.add_post("/bot{token}/{method}", handle)
+    return app
+
+
+# на каждого пользователя: /start, затем пары «сумма -> категория»
+def synthetic_updates(count: int, users: int) -> Iterator[Dict[str, Any]]:
+    for i in range(count):
+        user = {"id": 1000 + i % users, "is_bot": False, "first_name": "U"}
+        chat = {"id": user["id"], "type": "private"}
+        step = i // users
+        if step == 0 or step % 2 == 1:
+            text = "/start" if step == 0 else str(random.randint(50, 3000))
+            yield {
+                "update_id": i,
+                "message": {
+                    "message_id": i, "date": int(time.time()), "chat": chat, "from": user,
+                    "text": text,
+                    **({"entities": [{"type": "bot_command", "offset": 0, "length": 6}]} if step == 0 else {}),
+                },
+            }
+        else:
+            yield {
+                "update_id": i,
+                "callback_query": {
+                    "id": str(i), "from": user, "chat_instance": "x",
+                    "data": f"pick:{random.randint(0, 14)}",
+                    "message": {"message_id": i, "date": int(time.time()), "chat": chat, "text": "?"},
+                },
+            }
+
+
+# Апдейты одного чата отправляются строго по очереди, разные чаты — параллельно
+async def replay(url: str, secret: str, updates: List[Dict[str, Any]], concurrency: int):
+    statuses: "collections.Counter[int]" = collections.Counter()
+    by_chat: Dict[int, List[Dict[str, Any]]] = collections.defaultdict(list)
+    for u in updates:
+        by_chat[route_key(u)].append(u)
+    sem = asyncio.Semaphore(concurrency)
+    async with ClientSession() as session:
+        async def post_chat(chat_updates):
+            async with sem:
+                for update in chat_updates:
+                    async with session.post(url, json=update, headers={SECRET_HEADER: secret}) as resp:
+                        statuses[resp.status] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(post_chat(u) for u in by_chat.values()))
+        elapsed = time.perf_counter() - started
+    print(json.dumps({
+        "updates": len(updates),
+        "seconds": round(elapsed, 3),
+        "updates_per_sec": round(len(updates) / elapsed, 1) if elapsed else None,
+        "statuses": dict(statuses),
+    }, indent=2))
+
+
+def main():
+    p = argparse.ArgumentParser()
+    sub = p.add_subparsers(dest="command", required=True)
+    f = sub.add_parser("fake-api")
+    f.add_argument("--host", default="127.0.0.1")
+    f.add_argument("--port", type=int, default=8099)
+    r = sub.add_parser("replay")
+    r.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    r.add_argument("--secret", required=True)
+    r.add_argument("--file", help="JSONL with recorded Telegram updates")
+    r.add_argument("--synthetic", type=int, default=0)
+    r.add_argument("--users", type=int, default=100)
+    r.add_argument("--concurrency", type=int, default=20)
+    args = p.parse_args()
+
+    if args.command == "fake-api":
+        web.run_app(fake_api_app(), host=args.host, port=args.port)
+        return
+    if args.file:
+        with open(args.file, encoding="utf-8") as fh:
+            updates = [json.loads(line) for line in fh if line.strip()]
+    else:
+        updates = list(synthetic_updates(args.synthetic, args.users))
+    asyncio.run(replay(args.url, args.secret, updates, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
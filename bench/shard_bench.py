@@ -0,0 +1,97 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from sharding import ShardedStorage
+from storage import Storage
+
+
+# ---------- Бенчмарк шардирования ----------
+# Пропускная способность записи трат в зависимости от числа шардов.
+# users пользователей одновременно пишут по rounds трат каждый (как
+# got_amount -> picked_category, по одной трате с ожиданием коммита).
+# --processes P делит пользователей между P процессами над одними и теми
+# же файлами — так работают воркеры вебхука, и именно там процессы ждут
+# общий lock писателя SQLite. --batch 1 выключает групповой коммит.
+#   python -m bench.shard_bench --users 2000 --rounds 5 --processes 4 --shards 1 2 4 8
+def make_store(path: str, shards: int, args):
+    opts = dict(write_max_batch=args.batch, write_max_pending=args.users * 2)
+    if shards > 1:
+        return ShardedStorage(path, timezone.utc, shards, **opts)
+    return Storage(path, timezone.utc, **opts)
+
+
+async def user_writes(store, user_id: int, rounds: int):
+    for r in range(rounds):
+        await store.add_expense(user_id, 100.0 + r, "Кофе", datetime.now(timezone.utc))
+
+
+async def worker(path: str, shards: int, users: range, args, barrier, results) -> None:
+    store = make_store(path, shards, args)
+    with contextlib.redirect_stdout(sys.stderr):
+        await store.open()
+    # разогрев соединений потоков, затем общий старт всех процессов
+    await store.add_expense(users[0], 1.0, "Кофе", datetime.now(timezone.utc))
+    await asyncio.to_thread(barrier.wait)
+    started = time.time()
+    await asyncio.gather(*(user_writes(store, u, args.rounds) for u in users))
+    results.put((started, time.time()))
+    await store.close()
+
+
+def worker_process(path: str, shards: int, users: range, args, barrier, results):
+    asyncio.run(worker(path, shards, users, args, barrier, results))
+
+
+async def run(shards: int, args) -> dict:
+    path = os.path.join(tempfile.mkdtemp(), "finances.db")
+    # схема создаётся заранее, чтобы процессы не гонялись на миграциях
+    store = make_store(path, shards, args)
+    with contextlib.redirect_stdout(sys.stderr):
+        await store.open()
+    await store.close()
+    per_process = -(-args.users // args.processes)
+    parts = [range(i, min(i + per_process, args.users)) for i in range(0, args.users, per_process)]
+    ctx = multiprocessing.get_context("spawn")
+    barrier, results = ctx.Barrier(len(parts)), ctx.Queue()
+    procs = [ctx.Process(target=worker_process, args=(path, shards, part, args, barrier, results)) for part in parts]
+    for p in procs:
+        p.start()
+    spans = [await asyncio.to_thread(results.get) for _ in procs]
+    for p in procs:
+        await asyncio.to_thread(p.join)
+    if any(p.exitcode for p in procs):
+        raise RuntimeError(f"worker failed with {shards} shards")
+    elapsed = max(s[1] for s in spans) - min(s[0] for s in spans)
+    return {"shards": shards, "rows_per_s": args.users * args.rounds / elapsed, "seconds": elapsed}
+
+
+async def main(args):
+    results = []
+    for shards in args.shards:
+        results.append(await run(shards, args))
+    base = results[0]["rows_per_s"]
+    for r in results:
+        r["speedup"] = r["rows_per_s"] / base
+    print(json.dumps(
+        {"users": args.users, "rounds": args.rounds, "processes": args.processes, "batch": args.batch,
+         "results": [{k: round(v, 2) if isinstance(v, float) else v for k, v in r.items()} for r in results]},
+        indent=2,
+    ))
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument("--users", type=int, default=2000)
+    p.add_argument("--rounds", type=int, default=5)
+    p.add_argument("--processes", type=int, default=1)
+    p.add_argument("--batch", type=int, default=500, help="write_max_batch (1 = no group commit)")
+    p.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    asyncio.run(main(p.parse_args()))
@@ -0,0 +1,107 @@
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Union
+
+# Тип аргумента действия: None — без аргумента, int — неотрицательное
+# число, кортеж — одно из перечисленных значений
+ArgSpec = Union[None, type, Tuple[str, ...]]
+
+MAX_INT_DIGITS = 6
+
+
+# ---------- Кодек callback_data ----------
+# Формат: версия (одна цифра) + код действия + ".аргумент", например
+# "1p.12" — выбрать категорию 12, "1m.0" — первый пункт меню, "1n" — пустая
+# кнопка. Значения перечислений кодируются номером в кортеже, так что
+# данные кнопки — несколько байт вместо "myreset:confirm". Старые кнопки
+# ("pick:3", "menu:add"…) остаются в уже отправленных сообщениях, поэтому
+# их формат тоже разбирается — по таблице legacy (префикс -> действие).
+# decode ничего не бросает: любой неизвестный или битый payload -> None.
+class CallbackCodec:
+    def __init__(
+        self,
+        actions: Dict[str, Tuple[str, ArgSpec]],
+        legacy: Optional[Dict[str, str]] = None,
+        version: str = "1",
+    ):
+        self.version = version
+        self.actions = actions
+        self._by_code = {code: (name, spec) for name, (code, spec) in actions.items()}
+        self._legacy = {prefix: (name, actions[name][1]) for prefix, name in (legacy or {}).items()}
+
+    def encode(self, action: str, arg: Any = None) -> str:
+        code, spec = self.actions[action]
+        if spec is None:
+            return self.version + code
+        if spec is int:
+            return f"{self.version}{code}.{int(arg)}"
+        return f"{self.version}{code}.{spec.index(arg)}"
+
+    def decode(self, data: Optional[str]) -> Optional[Tuple[str, Any]]:
+        if not data:
+            return None
+        if data[0] == self.version:
+            code, dot, raw = data[1:].partition(".")
+            found = self._by_code.get(code)
+            if found is None:
+                return None
+            name, spec = found
+            if isinstance(spec, tuple):
+                index = _parse_int(raw) if dot else None
+                if index is None or index >= len(spec):
+                    return None
+                return name, spec[index]
+            return _parse_arg(name, spec, raw, dot)
+        prefix, dot, raw = data.partition(":")
+        found = self._legacy.get(prefix)
+        if found is None:
+            return None
+        name, spec = found
+        if isinstance(spec, tuple):
+            return (name, raw) if raw in spec else None
+        return _parse_arg(name, spec, raw, dot)
+
+
+def _parse_int(raw: str) -> Optional[int]:
+    # isdigit пропустил бы "²" и прочие не-ASCII цифры, int() — пробелы и знак
+    if not raw or len(raw) > MAX_INT_DIGITS or not raw.isascii() or not raw.isdigit():
+        return None
+    return int(raw)
+
+
+def _parse_arg(name: str, spec: ArgSpec, raw: str, dot: str) -> Optional[Tuple[str, Any]]:
+    if spec is None:
+        return None if dot else (name, None)
+    value = _parse_int(raw)
+    return None if value is None else (name, value)
+
+
+# ---------- Таблица обработчиков ----------
+# Один вход для всех callback-запросов: decode и поиск в словаре по
+# (действие, значение), затем по (действие, None) — стоимость не зависит
+# от числа действий. Обработчик вызывается как fn(cb, state, arg).
+Handler = Callable[..., Awaitable[Any]]
+
+
+class CallbackTable:
+    def __init__(self, codec: CallbackCodec):
+        self.codec = codec
+        self._handlers: Dict[Tuple[str, Any], Handler] = {}
+
+    # @table.on("pick") — для любого аргумента, @table.on("menu", "add") — для одного значения
+    def on(self, action: str, value: Any = None) -> Callable[[Handler], Handler]:
+        if action not in self.codec.actions:
+            raise KeyError(f"unknown callback action {action!r}")
+
+        def register(fn: Handler) -> Handler:
+            self._handlers[(action, value)] = fn
+            return fn
+
+        return register
+
+    # (обработчик, аргумент) или None, если payload битый или никем не обрабатывается
+    def resolve(self, data: Optional[str]) -> Optional[Tuple[Handler, Any]]:
+        decoded = self.codec.decode(data)
+        if decoded is None:
+            return None
+        action, arg = decoded
+        fn = self._handlers.get(decoded) or self._handlers.get((action, None))
+        return None if fn is None else (fn, arg)
@@ -0,0 +1,134 @@
+import asyncio
+from datetime import date, datetime, timedelta, tzinfo
+from typing import Callable, List, Optional, Tuple
+
+from aiogram.exceptions import TelegramForbiddenError
+
+import analytics
+from sender import SendScheduler
+from storage import Storage
+
+PERIODS = ("daily", "weekly")
+
+
+# ---------- Дайджесты ----------
+# Раз в день (и по понедельникам для weekly) в DIGEST_HOUR по локальному
+# времени подписчики получают сводку за вчера / прошлую неделю. Данные
+# берутся страницами по page_size подписчиков — один агрегатный запрос на
+# страницу, а не fetch_stats на каждого. Тексты уходят через общий
+# планировщик отправки, но не быстрее rate в секунду, чтобы рассылка
+# оставляла запас под ответы живым пользователям.
+#
+# Доставка — не больше одного раза. Перед тем как поставить сводку в очередь
+# отправки, в digest_runs пишется чекпоинт с её user_id, и рестарт продолжает
+# со следующего подписчика. Сводки, которые при падении ещё стояли в очереди,
+# пропадают, но повторно не уходит ни одна. Счётчики sent/failed считаются
+# по итогам отправки и сохраняются в конце страницы, поэтому после падения
+# отправленная часть страницы в них не попадает. Завершённый запуск за
+# сегодня повторно не стартует.
+class DigestScheduler:
+    def __init__(
+        self,
+        store: Storage,
+        sender: SendScheduler,
+        render: Callable[[str, date, date, List[Tuple[str, float, float]]], Optional[str]],
+        tz: tzinfo,
+        hour: int = 9,
+        rate: float = 20.0,
+        page_size: int = 500,
+        check_interval: float = 60.0,
+    ):
+        self.store = store
+        self.sender = sender
+        self.render = render
+        self.tz = tz
+        self.hour = hour
+        self.rate = rate
+        self.page_size = page_size
+        self.check_interval = check_interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop(), name="digests")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    # [начало, конец) окна сводки для запуска в день today
+    @staticmethod
+    def window(period: str, today: date) -> Tuple[date, date]:
+        if period == "weekly":
+            end = today - timedelta(days=today.weekday())
+            return end - timedelta(days=7), end
+        return today - timedelta(days=1), today
+
+    def due(self, period: str, now: datetime) -> bool:
+        if now.hour < self.hour:
+            return False
+        return period == "daily" or now.weekday() == 0
+
+    async def _loop(self):
+        while True:
+            now = datetime.now(tz=self.tz)
+            for period in PERIODS:
+                if not self.due(period, now):
+                    continue
+                try:
+                    await self.run(period, now.date())
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"[digest] {period} run failed: {e!r}")
+            await asyncio.sleep(self.check_interval)
+
+    async def run(self, period: str, today: date) -> Tuple[int, int]:
+        run_id = f"{period}:{today.isoformat()}"
+        after, sent, failed, finished = await self.store.digest_run(run_id, period)
+        if finished:
+            return sent, failed
+        start, end = self.window(period, today)
+        span = (end - start).days
+        cur_from, cur_to = analytics.day_number(start), analytics.day_number(end)
+        if after:
+            print(f"[digest] resuming {run_id} after user {after}")
+        loop = asyncio.get_running_loop()
+        interval = 1.0 / self.rate
+        while True:
+            page = await self.store.digest_page(period, cur_from - span, cur_from, cur_to, after, self.page_size)
+            if not page:
+                break
+            pending = []
+            next_slot = loop.time()
+            for user_id, chat_id, rows in page:
+                text = self.render(period, start, end, rows)
+                if text is None:
+                    continue
+                delay = next_slot - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                next_slot = max(next_slot, loop.time()) + interval
+                await self.store.digest_checkpoint(run_id, user_id, sent, failed)
+                pending.append((user_id, chat_id, self.sender.send(chat_id, text, parse_mode="HTML")))
+            for user_id, chat_id, fut in pending:
+                try:
+                    await fut
+                    sent += 1
+                except TelegramForbiddenError:
+                    # бот заблокирован — больше не пытаемся
+                    failed += 1
+                    await self.store.set_subscription(user_id, chat_id, None)
+                except Exception:
+                    failed += 1
+            after = page[-1][0]
+            await self.store.digest_checkpoint(run_id, after, sent, failed)
+        await self.store.digest_checkpoint(run_id, after, sent, failed, finished=True)
+        print(f"[digest] {run_id}: sent {sent}, failed {failed}")
+        return sent, failed
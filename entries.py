@@ -0,0 +1,146 @@
+import re
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+MAX_ENTRIES = 50
+# слишком короткий префикс почти всегда неоднозначен («к» — кофе, квартира…)
+MIN_PREFIX = 2
+
+# дополнительные слова, по которым узнаётся категория (ключ — raw)
+CATEGORY_SYNONYMS: Dict[str, Tuple[str, ...]] = {
+    "Сигареты": ("сиги", "табак", "стики"),
+    "Кофе": ("coffee", "кофейня", "капучино", "латте"),
+    "Продукты": ("магазин", "супермаркет", "пятерочка", "перекресток"),
+    "Ozon": ("озон",),
+    "WB": ("вб", "wildberries", "вайлдберриз"),
+    "Жрала не дома": ("кафе", "ресторан", "доставка", "обед", "ужин", "еда", "лень"),
+    "Beauty": ("бьюти", "косметика", "маникюр", "салон"),
+    "Бытовая химия": ("химия", "бытовая"),
+    "Такси": ("taxi", "убер"),
+    "Квартира": ("аренда", "коммуналка", "жкх"),
+    "Бензин": ("заправка", "азс", "топливо"),
+    "Мойка": ("автомойка",),
+    "Офис": ("работа",),
+    "Спортзал": ("зал", "фитнес", "спорт"),
+    "Иное": ("другое", "прочее"),
+}
+
+_WORD = re.compile(r"[^\W\d_]+")
+
+
+def normalize(text: str) -> str:
+    return " ".join(_WORD.findall(text.casefold().replace("ё", "е")))
+
+
+def _one_edit(a: str, b: str) -> bool:
+    if abs(len(a) - len(b)) > 1 or a == b:
+        return a == b
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        return a[i + 1:] == b[i + 1:]
+    return a[i:] == b[i + 1:]
+
+
+# ---------- Индекс алиасов категорий ----------
+# Строится один раз из CATEGORY_OPTIONS: raw-имя, подпись без эмодзи, их
+# отдельные слова и синонимы. Поиск — точное совпадение, затем префикс
+# (бинарный поиск по отсортированному списку), затем одна опечатка.
+# Категория находится, только если все совпадения указывают на одну raw.
+class AliasIndex:
+    def __init__(self, options: Iterable[Tuple[str, str]], synonyms: Dict[str, Tuple[str, ...]] = CATEGORY_SYNONYMS):
+        aliases: Dict[str, Set[str]] = {}
+        for label, raw in options:
+            names = {normalize(label), normalize(raw), *(normalize(s) for s in synonyms.get(raw, ()))}
+            for name in list(names):
+                names.update(name.split())
+            for name in names:
+                if name:
+                    aliases.setdefault(name, set()).add(raw)
+        self._exact = aliases
+        self._sorted = sorted(aliases)
+
+    def _prefix(self, word: str) -> Set[str]:
+        found: Set[str] = set()
+        i = bisect_left(self._sorted, word)
+        while i < len(self._sorted) and self._sorted[i].startswith(word):
+            found |= self._exact[self._sorted[i]]
+            i += 1
+        return found
+
+    def _candidates(self, word: str) -> Set[str]:
+        if word in self._exact:
+            return self._exact[word]
+        if len(word) >= MIN_PREFIX:
+            found = self._prefix(word)
+            if found:
+                return found
+        if len(word) >= 4:
+            found = set()
+            for alias in self._sorted:
+                if _one_edit(word, alias):
+                    found |= self._exact[alias]
+            return found
+        return set()
+
+    # raw-категория для фразы или None, если не нашлась или неоднозначна
+    def resolve(self, phrase: str) -> Optional[str]:
+        phrase = normalize(phrase)
+        if not phrase:
+            return None
+        found = self._candidates(phrase)
+        if not found and " " in phrase:
+            for word in phrase.split():
+                found |= self._candidates(word)
+        return next(iter(found)) if len(found) == 1 else None
+
+
+# ---------- Разбор сообщения ----------
+# «390 кофе, 1200 продукты; 250 такси» -> три траты. Разделители — «;»,
+# перевод строки и запятая, если это не десятичная запятая («12,5 кофе»).
+# Сумма может стоять и перед, и после слов категории. Кусок, где кроме суммы
+# есть ещё число («2 кофе 390», «15 мин назад 200 такси», «1 200 такси»),
+# неоднозначен — тогда сообщение целиком не разбирается, а не пишется
+# первое попавшееся число.
+class Entry:
+    __slots__ = ("amount", "word", "category")
+
+    def __init__(self, amount: float, word: str, category: Optional[str]):
+        self.amount = amount
+        self.word = word
+        self.category = category
+
+
+_SPLIT = re.compile(r"[;\n]|(?<!\d),|,(?!\d)")
+_NUMBER = r"(\d+(?:[.,]\d+)?)\s*(?:₽|р\.?|руб\.?)?"
+_AMOUNT_FIRST = re.compile(rf"^{_NUMBER}(?:\s+(.*))?$", re.I)
+_AMOUNT_LAST = re.compile(rf"^(.*?)\s+{_NUMBER}$", re.I)
+_DIGIT = re.compile(r"\d")
+
+
+def parse_entries(text: str, index: AliasIndex) -> Optional[List[Entry]]:
+    chunks = [c.strip() for c in _SPLIT.split(text)]
+    chunks = [c for c in chunks if c]
+    if not chunks or len(chunks) > MAX_ENTRIES:
+        return None
+    entries = []
+    for chunk in chunks:
+        m = _AMOUNT_FIRST.match(chunk)
+        if m:
+            number, word = m.group(1), m.group(2) or ""
+        else:
+            m = _AMOUNT_LAST.match(chunk)
+            if not m:
+                return None
+            word, number = m.group(1), m.group(2)
+        amount = float(number.replace(",", "."))
+        if amount <= 0:
+            return None
+        word = word.strip()
+        if _DIGIT.search(word):
+            return None
+        entries.append(Entry(amount, word, index.resolve(word) if word else None))
+    return entries
@@ -0,0 +1,152 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from storage import Storage
+
+
+# ---------- FSM в SQLite ----------
+# Состояние и данные FSM лежат в таблице fsm той же базы, поэтому сумма,
+# введённая до рестарта, переживает деплой. Перед базой — write-through LRU:
+# чтения горячих ключей не ходят в SQLite, запись сначала меняет кэш, затем
+# базу. Записи, пришедшие почти одновременно, коммитятся одной пачкой
+# (последнее значение ключа побеждает). Кэш локален для процесса, а ключ
+# содержит chat_id: воркеры webhook-режима делят апдейты по чатам, так что
+# ключ всегда живёт в одном процессе и кэш не устаревает.
+class SQLiteStorage(BaseStorage):
+    def __init__(
+        self,
+        store: Storage,
+        cache_size: int = 50000,
+        ttl: float = 7 * 86400,
+        sweep_interval: float = 600,
+        sweep_batch: int = 500,
+    ):
+        self.store = store
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.sweep_batch = sweep_batch
+        # ключ -> (state, data, updated_ts)
+        self._cache: "OrderedDict[str, Tuple[Optional[str], Dict[str, Any], float]]" = OrderedDict()
+        self._sweeper: Optional[asyncio.Task] = None
+        # ключ -> (state, data_json, updated_ts) или None для удаления
+        self._dirty: Dict[str, Optional[Tuple[Optional[str], Optional[str], int]]] = {}
+        self._flush: Optional[asyncio.Future] = None
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+    def start(self):
+        if self._sweeper is None and self.ttl > 0:
+            self._sweeper = asyncio.create_task(self._sweep_loop(), name="fsm-sweeper")
+
+    async def close(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+        self._cache.clear()
+
+    # ---------- Кэш ----------
+    async def _load(self, key: str) -> Tuple[Optional[str], Dict[str, Any]]:
+        now = time.time()
+        hit = self._cache.get(key)
+        if hit is not None:
+            if now - hit[2] < self.ttl:
+                self._cache.move_to_end(key)
+                return hit[0], hit[1]
+            self._cache.pop(key, None)
+        row = await self.store.fsm_load(key)
+        if row is None or now - row[2] >= self.ttl:
+            record = (None, {})
+        else:
+            record = (row[0], json.loads(row[1]) if row[1] else {})
+        self._remember(key, record[0], record[1], row[2] if row else now)
+        return record
+
+    def _remember(self, key: str, state: Optional[str], data: Dict[str, Any], ts: float):
+        self._cache[key] = (state, data, ts)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _save(self, key: str, state: Optional[str], data: Dict[str, Any]):
+        now = time.time()
+        self._remember(key, state, data, now)
+        if state is None and not data:
+            self._dirty[key] = None
+        else:
+            self._dirty[key] = (state, json.dumps(data, ensure_ascii=False) if data else None, int(now))
+        if self._flush is None:
+            self._flush = asyncio.get_running_loop().create_future()
+            asyncio.create_task(self._flush_dirty(self._flush))
+        await asyncio.shield(self._flush)
+
+    async def _flush_dirty(self, fut: asyncio.Future):
+        # один проход цикла событий, чтобы собрать записи соседних апдейтов
+        await asyncio.sleep(0)
+        dirty, self._dirty, self._flush = self._dirty, {}, None
+        try:
+            await self.store.fsm_write(dirty)
+        except Exception as e:
+            fut.set_exception(e)
+        else:
+            fut.set_result(None)
+
+    # ---------- BaseStorage ----------
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        k = self._key(key)
+        new_state = state.state if isinstance(state, State) else state
+        cur_state, data = await self._load(k)
+        if cur_state == new_state:
+            return
+        await self._save(k, new_state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._load(self._key(key)))[0]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        k = self._key(key)
+        cur_state, cur_data = await self._load(k)
+        if cur_data == data:
+            return
+        await self._save(k, cur_state, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._load(self._key(key)))[1].copy()
+
+    # ---------- Очистка по TTL ----------
+    async def sweep(self) -> int:
+        before = int(time.time() - self.ttl)
+        removed = 0
+        while True:
+            n = await self.store.fsm_expire(before, self.sweep_batch)
+            removed += n
+            if n < self.sweep_batch:
+                break
+            # отдаём писателя остальным между пачками
+            await asyncio.sleep(0)
+        stale = [k for k, v in self._cache.items() if v[2] < before]
+        for k in stale:
+            del self._cache[k]
+        return removed
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                removed = await self.sweep()
+                if removed:
+                    print(f"[fsm] expired {removed} stale states")
+            except Exception as e:
+                print(f"[fsm] sweep failed: {e!r}")
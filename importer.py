@@ -0,0 +1,111 @@
+import asyncio
+import collections
+import csv
+import gzip
+import io
+import math
+from datetime import datetime, tzinfo
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from storage import Storage
+
+IMPORT_BATCH = 5000
+HEADER = ["amount", "category", "created_at"]
+
+
+# ---------- Импорт CSV ----------
+# Формат тот же, что у /export: amount;category;created_at. Файл читается
+# потоково: пачка в IMPORT_BATCH строк разбирается в отдельном потоке и
+# откладывается во временную таблицу базы, затем берётся следующая — в памяти
+# не больше одной пачки. Одинаковые строки — разные траты (два кофе по 100 в
+# один день); их нумерацию и отсев уже записанного делает
+# Storage.import_expenses после чтения всего файла, порциями по IMPORT_BATCH,
+# так что между порциями писатель успевает обслужить обычные траты.
+class ImportReport:
+    def __init__(self):
+        self.added = 0
+        self.duplicates = 0
+        self.rejected: "collections.Counter[str]" = collections.Counter()
+        # первые несколько отклонённых строк: (номер строки, причина)
+        self.examples: List[Tuple[int, str]] = []
+
+    def reject(self, line: int, reason: str):
+        self.rejected[reason] += 1
+        if len(self.examples) < 5:
+            self.examples.append((line, reason))
+
+
+def parse_row(row: List[str], categories: Dict[str, str], tz: tzinfo) -> Tuple[float, str, str, int]:
+    if len(row) != 3:
+        raise ValueError("format")
+    amount_s, category_s, created_s = (c.strip() for c in row)
+    try:
+        amount = float(amount_s.replace(",", "."))
+    except ValueError:
+        raise ValueError("amount") from None
+    if not math.isfinite(amount) or amount <= 0:
+        raise ValueError("amount")
+    category = categories.get(category_s.casefold())
+    if category is None:
+        raise ValueError("category")
+    try:
+        created_at = datetime.fromisoformat(created_s)
+    except ValueError:
+        raise ValueError("date") from None
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=tz)
+    return amount, category, created_at.isoformat(), int(created_at.timestamp())
+
+
+def _next_batch(
+    rows: Iterator[Tuple[int, List[str]]],
+    categories: Dict[str, str],
+    tz: tzinfo,
+    report: ImportReport,
+) -> Optional[List[Tuple[float, str, str, int]]]:
+    batch = []
+    for line, row in rows:
+        if not row or not any(c.strip() for c in row):
+            continue
+        if line == 1 and [c.strip().lower() for c in row] == HEADER:
+            continue
+        try:
+            batch.append(parse_row(row, categories, tz))
+        except ValueError as e:
+            report.reject(line, str(e))
+            continue
+        if len(batch) >= IMPORT_BATCH:
+            break
+    return batch or None
+
+
+async def import_csv(
+    store: Storage,
+    user_id: int,
+    fileobj: BinaryIO,
+    categories: Dict[str, str],
+    tz: tzinfo,
+    compressed: bool = False,
+) -> ImportReport:
+    raw = gzip.GzipFile(fileobj=fileobj, mode="rb") if compressed else fileobj
+    text = io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+    rows = enumerate(csv.reader(text, delimiter=";"), start=1)
+    report = ImportReport()
+    token = store.begin_import(user_id)
+    try:
+        while True:
+            batch = await asyncio.to_thread(_next_batch, rows, categories, tz, report)
+            if batch is None:
+                break
+            await store.stage_import(user_id, token, batch)
+    except (UnicodeDecodeError, OSError, csv.Error) as e:
+        # файл оборвался или это не текст: то, что успели прочитать, записывается
+        report.reject(0, "format")
+        print(f"[import] user {user_id}: stopped on unreadable file: {e!r}")
+    except BaseException:
+        await store.discard_import(user_id, token)
+        raise
+    finally:
+        text.detach()
+    report.added, report.duplicates = await store.import_expenses(user_id, token, IMPORT_BATCH)
+    return report
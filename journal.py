@@ -0,0 +1,165 @@
+import json
+import sqlite3
+import zlib
+from typing import List, Optional, Tuple
+
+import rollup
+
+# Сколько записей журнала удалять за одну транзакцию очистки
+PRUNE_BATCH = 500
+
+_ROW = "id, amount, category, created_at, created_ts"
+
+
+# ---------- Журнал операций ----------
+# journal(id, user_id, op, ts, payload) — отменённые траты ('undo') и сбросы
+# ('reset'). Сами удалённые строки переезжают в expenses_deleted с номером
+# записи журнала, так что expenses и все запросы к ней видят только живые
+# траты. Вставки в журнал не пишутся: id у expenses — AUTOINCREMENT и не
+# переиспользуются, поэтому порядок даёт индекс (user_id, id), а повтор
+# отменённой траты допустим, только пока её id больше любого живого id
+# пользователя (после новой траты стек повтора сбрасывается).
+# Агрегаты меняются в той же транзакции, что и строки.
+def _journal(conn: sqlite3.Connection, user_id: int, op: str, now: int, payload: Optional[bytes] = None) -> int:
+    return conn.execute(
+        "INSERT INTO journal(user_id, op, ts, payload) VALUES (?,?,?,?)", (user_id, op, now, payload)
+    ).lastrowid
+
+
+def _stash(conn: sqlite3.Connection, journal_id: int, user_id: int, rows: List[Tuple]):
+    conn.executemany(
+        f"INSERT INTO expenses_deleted(journal_id, user_id, {_ROW}) VALUES (?,?,?,?,?,?,?)",
+        [(journal_id, user_id, *r) for r in rows],
+    )
+
+
+def _drop_entries(conn: sqlite3.Connection, ids: List[int]):
+    marks = ",".join("?" * len(ids))
+    conn.execute(f"DELETE FROM expenses_deleted WHERE journal_id IN ({marks})", ids)
+    conn.execute(f"DELETE FROM journal WHERE id IN ({marks})", ids)
+
+
+# Последняя живая трата -> в журнал; строка (id, amount, category, created_at,
+# created_ts) или None
+def undo(conn: sqlite3.Connection, user_id: int, tz_offset: int, now: int) -> Optional[sqlite3.Row]:
+    with conn:
+        row = conn.execute(
+            "DELETE FROM expenses WHERE id=(SELECT id FROM expenses WHERE user_id=? ORDER BY id DESC LIMIT 1) "
+            f"RETURNING {_ROW}",
+            (user_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        _stash(conn, _journal(conn, user_id, "undo", now), user_id, [tuple(row)])
+        rollup.record_remove(conn, user_id, (row["created_ts"] + tz_offset) // 86400, row["category"], row["amount"])
+        return row
+
+
+# Вернуть последнюю отменённую трату с тем же id
+def redo(conn: sqlite3.Connection, user_id: int, tz_offset: int) -> Optional[sqlite3.Row]:
+    with conn:
+        entry = conn.execute(
+            "SELECT j.id, d.id AS expense_id FROM journal j JOIN expenses_deleted d ON d.journal_id=j.id "
+            "WHERE j.user_id=? AND j.op='undo' ORDER BY j.id DESC LIMIT 1",
+            (user_id,),
+        ).fetchone()
+        if entry is None:
+            return None
+        newest = conn.execute(
+            "SELECT id FROM expenses WHERE user_id=? ORDER BY id DESC LIMIT 1", (user_id,)
+        ).fetchone()
+        if newest is not None and newest[0] > entry["expense_id"]:
+            # после отмены была новая трата — повторять уже нечего
+            stale = [r[0] for r in conn.execute("SELECT id FROM journal WHERE user_id=? AND op='undo'", (user_id,))]
+            _drop_entries(conn, stale)
+            return None
+        row = conn.execute(
+            f"INSERT INTO expenses(user_id, {_ROW}) SELECT user_id, {_ROW} FROM expenses_deleted "
+            f"WHERE journal_id=? RETURNING {_ROW}",
+            (entry["id"],),
+        ).fetchone()
+        _drop_entries(conn, [entry["id"]])
+        rollup.record_add(conn, user_id, (row["created_ts"] + tz_offset) // 86400, row["category"], row["amount"])
+        return row
+
+
+# Сброс: живые траты -> expenses_deleted, архивный слой пользователя
+# (monthly_totals, monthly_days, archive_index) — сжатым payload записи.
+# Пачки в архивном файле остаются на месте, но без archive_index не видны.
+# Стек отмен при этом закрывается.
+def reset(conn: sqlite3.Connection, user_id: int, now: int):
+    with conn:
+        stale = [r[0] for r in conn.execute("SELECT id FROM journal WHERE user_id=? AND op='undo'", (user_id,))]
+        if stale:
+            _drop_entries(conn, stale)
+        tier = {
+            table: [list(r) for r in conn.execute(f"SELECT * FROM {table} WHERE user_id=?", (user_id,))]
+            for table in ("monthly_totals", "monthly_days", "archive_index")
+        }
+        payload = zlib.compress(json.dumps(tier, ensure_ascii=False).encode("utf-8"))
+        journal_id = _journal(conn, user_id, "reset", now, payload)
+        conn.execute(
+            f"INSERT INTO expenses_deleted(journal_id, user_id, {_ROW}) "
+            f"SELECT ?, user_id, {_ROW} FROM expenses WHERE user_id=?",
+            (journal_id, user_id),
+        )
+        conn.execute("DELETE FROM expenses WHERE user_id=?", (user_id,))
+        conn.execute("DELETE FROM daily_totals WHERE user_id=?", (user_id,))
+        conn.execute("DELETE FROM user_stats WHERE user_id=?", (user_id,))
+        for table in tier:
+            conn.execute(f"DELETE FROM {table} WHERE user_id=?", (user_id,))
+
+
+# Отменить последний сброс, если он не старше since. Траты, записанные после
+# сброса, остаются; агрегаты пересобираются. Возвращает число возвращённых
+# трат (включая архивные) или None, если возвращать нечего.
+def restore(conn: sqlite3.Connection, user_id: int, tz_offset: int, since: int) -> Optional[int]:
+    with conn:
+        entry = conn.execute(
+            "SELECT id, payload FROM journal WHERE user_id=? AND op='reset' AND ts>=? ORDER BY id DESC LIMIT 1",
+            (user_id, since),
+        ).fetchone()
+        if entry is None:
+            return None
+        restored = conn.execute(
+            f"INSERT INTO expenses(user_id, {_ROW}) SELECT user_id, {_ROW} FROM expenses_deleted "
+            "WHERE journal_id=?",
+            (entry["id"],),
+        ).rowcount
+        tier = json.loads(zlib.decompress(entry["payload"]))
+        conn.executemany(
+            "INSERT INTO monthly_totals(user_id, month, category, sum, count) VALUES (?,?,?,?,?) "
+            "ON CONFLICT(user_id, month, category) DO UPDATE "
+            "SET sum=sum+excluded.sum, count=count+excluded.count",
+            tier["monthly_totals"],
+        )
+        conn.executemany(
+            "INSERT INTO monthly_days(user_id, month, mask) VALUES (?,?,?) "
+            "ON CONFLICT(user_id, month) DO UPDATE SET mask=mask|excluded.mask",
+            tier["monthly_days"],
+        )
+        conn.executemany("INSERT OR IGNORE INTO archive_index VALUES (?,?,?,?)", tier["archive_index"])
+        _drop_entries(conn, [entry["id"]])
+        rollup.rebuild_users(conn, tz_offset, [user_id])
+        return restored + sum(r[3] for r in tier["archive_index"])
+
+
+# Удалить записи старше before (вместе со строками и архивными пачками
+# сбросов). Возвращает число удалённых записей; < PRUNE_BATCH — всё.
+def prune(conn: sqlite3.Connection, before: int, limit: int = PRUNE_BATCH) -> int:
+    with conn:
+        entries = conn.execute(
+            "SELECT id, user_id, op, payload FROM journal WHERE ts<? ORDER BY ts LIMIT ?", (before, limit)
+        ).fetchall()
+        if not entries:
+            return 0
+        for entry in entries:
+            if entry["op"] == "reset" and entry["payload"]:
+                index = json.loads(zlib.decompress(entry["payload"]))["archive_index"]
+                conn.executemany(
+                    "DELETE FROM archive.chunks WHERE user_id=? AND month=? AND seq=?",
+                    [r[:3] for r in index],
+                )
+        _drop_entries(conn, [e["id"] for e in entries])
+        return len(entries)
+
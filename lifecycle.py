@@ -0,0 +1,111 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from aiogram import BaseMiddleware
+
+
+# ---------- Жизненный цикл процесса ----------
+# Апдейты начинают приниматься, как только открыта база; всё остальное
+# (регистрация команд, соединения читателей, кэши, клавиатуры) греется
+# фоновыми задачами через background(). Внешняя мидлварь диспетчера
+# считает апдейты в обработке: при остановке вызывающий сначала перестаёт
+# брать новые апдейты, затем drain() ждёт текущие хэндлеры не дольше
+# drain_timeout, и только после этого закрываются отправка и база.
+# Время до первого апдейта и время дренажа отдаются метриками.
+class Lifecycle:
+    def __init__(self, drain_timeout: float = 25.0):
+        self.drain_timeout = drain_timeout
+        self.started = time.perf_counter()
+        self.ready_seconds: Optional[float] = None
+        self.first_update_seconds: Optional[float] = None
+        self.drain_seconds: Optional[float] = None
+        self.in_flight = 0
+        self.stopping = False
+        self._deadline: Optional[float] = None
+        self._idle: Optional[asyncio.Event] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    # база открыта, диспетчер вот-вот начнёт принимать апдейты
+    def ready(self):
+        self.ready_seconds = time.perf_counter() - self.started
+        print(f"[lifecycle] accepting updates after {self.ready_seconds:.2f}s")
+
+    def background(self, coro: Awaitable[Any], name: str) -> asyncio.Task:
+        task = asyncio.create_task(self._guard(coro, name), name=name)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    @staticmethod
+    async def _guard(coro: Awaitable[Any], name: str):
+        try:
+            await coro
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[lifecycle] {name} failed: {e!r}")
+
+    def middleware(self) -> "InFlight":
+        return InFlight(self)
+
+    def _enter(self):
+        if self.first_update_seconds is None:
+            self.first_update_seconds = time.perf_counter() - self.started
+            print(f"[lifecycle] first update after {self.first_update_seconds:.2f}s")
+        if self._idle is None:
+            self._idle = asyncio.Event()
+        self.in_flight += 1
+        self._idle.clear()
+
+    def _leave(self):
+        self.in_flight -= 1
+        if not self.in_flight:
+            self._idle.set()
+
+    # сколько осталось до дедлайна остановки (до drain() — весь drain_timeout)
+    def remaining(self) -> float:
+        if self._deadline is None:
+            return self.drain_timeout
+        return max(0.0, self._deadline - time.perf_counter())
+
+    # Новые апдейты уже не приходят: снять прогрев и дождаться хэндлеров.
+    # Возвращает True, если все успели завершиться до дедлайна.
+    async def drain(self) -> bool:
+        self.stopping = True
+        started = time.perf_counter()
+        self._deadline = started + self.drain_timeout
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        # апдейты, принятые вебхуком перед остановкой, ещё могут не дойти до мидлвари
+        await asyncio.sleep(0)
+        drained = True
+        if self.in_flight:
+            print(f"[lifecycle] draining {self.in_flight} in-flight updates…")
+            try:
+                await asyncio.wait_for(self._idle.wait(), self.remaining())
+            except asyncio.TimeoutError:
+                drained = False
+                print(f"[lifecycle] drain timeout, {self.in_flight} updates still running")
+        self.drain_seconds = time.perf_counter() - started
+        print(f"[lifecycle] drained in {self.drain_seconds:.2f}s")
+        return drained
+
+
+# Внешняя мидлварь на dp.update: видит каждый апдейт до фильтров и роутеров
+class InFlight(BaseMiddleware):
+    def __init__(self, lifecycle: Lifecycle):
+        self.lifecycle = lifecycle
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        self.lifecycle._enter()
+        try:
+            return await handler(event, data)
+        finally:
+            self.lifecycle._leave()
@@ -1,26 +1,123 @@
 import os
+import io
+import secrets
+import gzip
 import asyncio
-import sqlite3
-from datetime import datetime, timedelta, timezone
-from contextlib import closing
-from typing import List, Tuple
+import html
+import time
+import tempfile
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Optional, Tuple
 import random
 
 from aiogram import Bot, Dispatcher, F, Router
-from aiogram.filters import Command, CommandStart
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.filters import Command, CommandObject, CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import Message, CallbackQuery, FSInputFile, BotCommand
+from aiogram.fsm.storage.memory import SimpleEventIsolation
+from aiogram.types import Message, CallbackQuery, BufferedInputFile, BotCommand
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.exceptions import TelegramNetworkError
 
+import analytics
+import callbacks
+from digest import DigestScheduler
+from entries import AliasIndex, parse_entries
+from fsm_storage import SQLiteStorage
+import importer
+from lifecycle import Lifecycle
+import metrics
+from retention import RetentionJob
+from sender import SendScheduler
+from sharding import ShardedStorage
+import snapshot
+from storage import Storage
+import webhook
+
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 if not BOT_TOKEN:
     raise RuntimeError("BOT_TOKEN is not set")
 
 LOCAL_TZ = timezone(timedelta(hours=0))
 DB_PATH = os.getenv("DB_PATH", "finances.db")
+# >1 — пользователи раскладываются по DB_SHARDS файлам рядом с DB_PATH
+# (переход со старой раскладки: python manage.py reshard --to N)
+DB_SHARDS = int(os.getenv("DB_SHARDS", "1"))
+# групповой коммит: пачка пишется раз в WRITE_MAX_LATENCY_MS или по WRITE_MAX_BATCH строк
+WRITE_MAX_LATENCY_MS = float(os.getenv("WRITE_MAX_LATENCY_MS", "5"))
+WRITE_MAX_BATCH = int(os.getenv("WRITE_MAX_BATCH", "500"))
+WRITE_QUEUE_SIZE = int(os.getenv("WRITE_QUEUE_SIZE", "10000"))
+# траты старше RETENTION_DAYS (с точностью до месяца) сворачиваются в помесячные
+# итоги и сжатый архив рядом с базой; 0 — хранить всё в основной базе.
+# Не меньше 62 дней: профиль и отчёты за последние 30 дней читают дневные агрегаты.
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "0"))
+if RETENTION_DAYS:
+    RETENTION_DAYS = max(RETENTION_DAYS, 62)
+# отменённые траты можно вернуть через /redo, а сброс — кнопкой, пока им
+# не больше UNDO_WINDOW_HOURS; потом журнал очищается
+UNDO_WINDOW_HOURS = float(os.getenv("UNDO_WINDOW_HOURS", "24"))
+# траты последних 7 дней активных пользователей держатся в памяти (не больше
+# RECENT_CACHE_MB на файл базы): «Сегодня», «7 дней» и подсказка к /undo без
+# запроса. При нескольких webhook-воркерах выключен (см. MULTI_WORKER)
+RECENT_CACHE_MB = float(os.getenv("RECENT_CACHE_MB", "32"))
+# при SIGTERM хэндлеры, исходящие сообщения и очередь записи дописываются
+# не дольше SHUTDOWN_TIMEOUT секунд
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "25"))
+# сколько профилей недавно активных пользователей прогреть после старта
+WARMUP_PROFILES = int(os.getenv("WARMUP_PROFILES", "1000"))
+# /admin_stats — отчёт по всем пользователям для этих user_id (через запятую).
+# Считается по копии базы (backup API), не старше SNAPSHOT_MAX_AGE_MIN минут;
+# SNAPSHOT_DIR — держать копию файлом в этом каталоге, а не в памяти
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if x}
+SNAPSHOT_MAX_AGE_MIN = float(os.getenv("SNAPSHOT_MAX_AGE_MIN", "60"))
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR") or None
+# незавершённые FSM-состояния старше этого срока удаляются
+FSM_TTL_HOURS = float(os.getenv("FSM_TTL_HOURS", "168"))
+
+# ---------- Режим работы ----------
+# BOT_MODE=polling (по умолчанию) или webhook. В режиме webhook локальный
+# aiohttp-сервер принимает апдейты; при WEBHOOK_WORKERS>1 он раздаёт их
+# воркер-процессам, апдейты одного чата всегда идут в один воркер.
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # публичный адрес для setWebhook; пусто — не регистрировать
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "1"))
+# Воркеры делят апдейты по чатам, а кэши профилей /me и недавних трат — по
+# user_id: трата из группового чата обрабатывается другим воркером, чем
+# личный чат, и кэш воркера личного чата устарел бы. Поэтому при нескольких
+# воркерах кэши по user_id выключены (FSM ключуется по чату и пользователю —
+# ему это не грозит).
+MULTI_WORKER = BOT_MODE == "webhook" and WEBHOOK_WORKERS > 1
+# свой Bot API сервер (например, заглушка для локальной проверки)
+BOT_API_SERVER = os.getenv("BOT_API_SERVER", "")
+
+# ---------- Метрики ----------
+# METRICS_PORT задан — хэндлеры, SQL и Bot API замеряются, а гистограммы
+# отдаются на http://METRICS_HOST:METRICS_PORT/metrics (воркер i webhook-режима
+# слушает METRICS_PORT+i). Запросы дольше SLOW_QUERY_MS пишутся в лог всегда;
+# 0 — отключить.
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "250"))
+metrics.configure(bool(METRICS_PORT), SLOW_QUERY_MS)
+
+# лимиты Telegram: ~30 сообщений/с на бота и ~1/с в один чат (с короткими всплесками)
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+SEND_CHAT_BURST = float(os.getenv("SEND_CHAT_BURST", "3"))
+# дайджесты: час отправки по LOCAL_TZ и темп рассылки (сообщений/с) —
+# ниже SEND_GLOBAL_RATE, чтобы ответам оставался запас
+DIGEST_HOUR = int(os.getenv("DIGEST_HOUR", "9"))
+DIGEST_RATE = float(os.getenv("DIGEST_RATE", "20"))
+# планировщик отправки у каждого процесса свой, поэтому общий лимит бота и
+# темп рассылки делятся поровну между webhook-воркерами (чат живёт в одном
+# воркере — лимиты на чат не делятся)
+SEND_PROCESSES = WEBHOOK_WORKERS if MULTI_WORKER else 1
 
 # ---------- Категории ----------
 CATEGORY_OPTIONS: List[Tuple[str, str]] = [
@@ -138,75 +235,174 @@ CATEGORY_QUOTES = {
 }
 
 # ---------- База данных ----------
-def db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def init_db():
-    with closing(db()) as conn, conn:
-        conn.execute(
-            "CREATE TABLE IF NOT EXISTS expenses("
-            "id INTEGER PRIMARY KEY AUTOINCREMENT,"
-            "user_id INTEGER, amount REAL, category TEXT, created_at TEXT)"
-        )
+STORE_OPTS = dict(
+    profile_cache_size=0 if MULTI_WORKER else 10000,
+    write_max_batch=WRITE_MAX_BATCH,
+    write_max_latency=WRITE_MAX_LATENCY_MS / 1000,
+    write_max_pending=WRITE_QUEUE_SIZE,
+    undo_window=UNDO_WINDOW_HOURS * 3600,
+    recent_cache_bytes=0 if MULTI_WORKER else int(RECENT_CACHE_MB * (1 << 20)),
+)
+if DB_SHARDS > 1:
+    store = ShardedStorage(DB_PATH, LOCAL_TZ, DB_SHARDS, **STORE_OPTS)
+else:
+    store = Storage(DB_PATH, LOCAL_TZ, **STORE_OPTS)
+fsm_storage = SQLiteStorage(store, ttl=FSM_TTL_HOURS * 3600)
+metrics.register(metrics.Gauge("finbot_write_queue_depth", "Expense groups waiting for commit", lambda: store.write_queue_depth))
+metrics.register(metrics.Gauge("finbot_profile_cache_entries", "Cached /me profiles", lambda: store.cached_profiles))
+metrics.register(metrics.Gauge("finbot_recent_cache_users", "Users with cached recent expenses", lambda: store.cached_recent_users))
+metrics.register(metrics.Gauge("finbot_recent_cache_bytes", "Memory held by the recent expenses cache", lambda: store.recent_cache_bytes))
+metrics.register(metrics.Gauge("finbot_recent_cache_drift", "Stale recent cache entries found by the last check", lambda: store.recent_drift))
+retention = RetentionJob(getattr(store, "shards", [store]), RETENTION_DAYS)
+snapshots = snapshot.Snapshots(
+    getattr(store, "paths", [DB_PATH]), int(LOCAL_TZ.utcoffset(None).total_seconds()),
+    max_age=SNAPSHOT_MAX_AGE_MIN * 60, target_dir=SNAPSHOT_DIR,
+)
+metrics.register(metrics.Gauge("finbot_snapshot_age_seconds", "Age of the analytics snapshot", lambda: snapshots.age))
+metrics.register(metrics.Gauge("finbot_snapshot_duration_seconds", "Time to copy the database and build the report", lambda: snapshots.duration))
+
+# ---------- Отправка ----------
+sender = SendScheduler(SEND_GLOBAL_RATE / SEND_PROCESSES, SEND_CHAT_RATE, SEND_CHAT_BURST)
+lifecycle = Lifecycle(SHUTDOWN_TIMEOUT)
+metrics.register(metrics.Gauge("finbot_ready_seconds", "Process start to accepting updates", lambda: lifecycle.ready_seconds))
+metrics.register(metrics.Gauge("finbot_first_update_seconds", "Process start to the first handled update", lambda: lifecycle.first_update_seconds))
+metrics.register(metrics.Gauge("finbot_in_flight_updates", "Updates being handled right now", lambda: lifecycle.in_flight))
+metrics.register(metrics.Gauge("finbot_shutdown_drain_seconds", "Time spent draining in-flight updates on shutdown", lambda: lifecycle.drain_seconds))
+metrics.register(metrics.Gauge("finbot_send_queue_depth", "Messages waiting to be sent", lambda: sender.depth))
+metrics.register(metrics.Gauge("finbot_send_merged_messages", "Messages merged into a previous one since start", lambda: sender.merged))
+
+# Ответы уходят через планировщик: хэндлер только ставит метод в очередь
+# чата и не ждёт Telegram. Возвращается future с результатом отправки.
+def reply(message: Message, text: str, **kwargs):
+    return sender.submit(message.answer(text, **kwargs), message.chat.id)
 
-# ---------- UNDO ----------
-def undo_last_expense(user_id: int):
-    with closing(db()) as conn, conn:
-        row = conn.execute(
-            "SELECT id, amount, category, created_at "
-            "FROM expenses WHERE user_id=? "
-            "ORDER BY id DESC LIMIT 1",
-            (user_id,),
-        ).fetchone()
-        if not row:
-            return None
-        conn.execute("DELETE FROM expenses WHERE id=?", (row["id"],))
-        return row
+def ack(cb: CallbackQuery, text: Optional[str] = None):
+    return sender.submit(cb.answer(text))
 
 # ---------- Клавиатуры ----------
-def categories_kb(page: int = 0, per_row: int = 2, page_size: int = 10):
+# Данные всех inline-кнопок — через CODEC (см. callbacks.py); legacy —
+# префиксы кнопок старого формата в уже отправленных сообщениях
+STATS_KINDS = ("today", "7d", "month")
+CODEC = callbacks.CallbackCodec(
+    {
+        "pick": ("p", int),
+        "page": ("g", int),
+        "stats": ("s", STATS_KINDS),
+        "menu": ("m", ("add", "stats", "export", "help", "undo", "reset")),
+        "reset": ("r", ("confirm", "cancel", "restore")),
+        "noop": ("n", None),
+    },
+    legacy={"pick": "pick", "page": "page", "stats": "stats", "menu": "menu", "myreset": "reset", "noop": "noop"},
+)
+CALLBACKS = callbacks.CallbackTable(CODEC)
+
+CATEGORIES_PAGE_SIZE = 10
+CATEGORIES_PER_ROW = 2
+
+def build_categories_kb(page: int = 0, per_row: int = CATEGORIES_PER_ROW, page_size: int = CATEGORIES_PAGE_SIZE):
     start = page * page_size
     end = start + page_size
     slice_ = CATEGORY_OPTIONS[start:end]
 
     kb = InlineKeyboardBuilder()
     for idx, (label, _) in enumerate(slice_, start=start):
-        kb.button(text=label, callback_data=f"pick:{idx}")
+        kb.button(text=label, callback_data=CODEC.encode("pick", idx))
     kb.adjust(per_row)
 
     pages = (len(CATEGORY_OPTIONS) + page_size - 1) // page_size
     if pages > 1:
         nav = InlineKeyboardBuilder()
         if page > 0:
-            nav.button(text="⬅️ Назад", callback_data=f"page:{page-1}")
-        nav.button(text=f"Стр. {page+1}/{pages}", callback_data="noop")
+            nav.button(text="⬅️ Назад", callback_data=CODEC.encode("page", page - 1))
+        nav.button(text=f"Стр. {page+1}/{pages}", callback_data=CODEC.encode("noop"))
         if page < pages - 1:
-            nav.button(text="Вперёд ➡️", callback_data=f"page:{page+1}")
+            nav.button(text="Вперёд ➡️", callback_data=CODEC.encode("page", page + 1))
         nav.adjust(3)
         kb.row(*nav.buttons)
 
     return kb.as_markup()
 
-def inline_main_menu():
+def build_main_menu():
     kb = InlineKeyboardBuilder()
-    kb.button(text="➕ Добавить", callback_data="menu:add")
-    kb.button(text="📊 Статистика", callback_data="menu:stats")
-    kb.button(text="📁 Экспорт CSV", callback_data="menu:export")
-    kb.button(text="ℹ️ Помощь", callback_data="menu:help")
-    kb.button(text="↩️ Отменить", callback_data="menu:undo")
-    kb.button(text="🧹 Сбросить мои данные", callback_data="menu:reset")
+    kb.button(text="➕ Добавить", callback_data=CODEC.encode("menu", "add"))
+    kb.button(text="📊 Статистика", callback_data=CODEC.encode("menu", "stats"))
+    kb.button(text="📁 Экспорт CSV", callback_data=CODEC.encode("menu", "export"))
+    kb.button(text="ℹ️ Помощь", callback_data=CODEC.encode("menu", "help"))
+    kb.button(text="↩️ Отменить", callback_data=CODEC.encode("menu", "undo"))
+    kb.button(text="🧹 Сбросить мои данные", callback_data=CODEC.encode("menu", "reset"))
     kb.adjust(2, 2, 2)
     return kb.as_markup()
 
-def stats_inline_kb():
+def build_stats_kb():
     kb = InlineKeyboardBuilder()
     for t, d in [("Сегодня", "today"), ("7 дней", "7d"), ("Месяц", "month")]:
-        kb.button(text=t, callback_data=f"stats:{d}")
+        kb.button(text=t, callback_data=CODEC.encode("stats", d))
     kb.adjust(3)
     return kb.as_markup()
 
+def build_reset_confirm_kb():
+    kb = InlineKeyboardBuilder()
+    kb.button(text="❌ Да, удалить только мои траты", callback_data=CODEC.encode("reset", "confirm"))
+    kb.button(text="Отмена", callback_data=CODEC.encode("reset", "cancel"))
+    kb.adjust(1)
+    return kb.as_markup()
+
+def build_reset_restore_kb():
+    kb = InlineKeyboardBuilder()
+    kb.button(text="↩️ Вернуть траты", callback_data=CODEC.encode("reset", "restore"))
+    return kb.as_markup()
+
+# Все разметки неизменны во время работы, поэтому собираются один раз
+# (категории — на каждую страницу), а хэндлеры отдают общие frozen-объекты.
+# Смена списка категорий — только через set_categories: он обновляет
+# CATEGORY_OPTIONS/RAW_CATEGORIES/LABEL_BY_RAW на месте и пересобирает кэш.
+# Сборка не задерживает старт: её делает прогрев, а если апдейт пришёл
+# раньше — первое обращение к любой разметке (__getattr__ вызывается,
+# только пока атрибутов ещё нет).
+class Keyboards:
+    def __getattr__(self, name: str):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        self.rebuild()
+        return object.__getattribute__(self, name)
+
+    @property
+    def built(self) -> bool:
+        return "aliases" in self.__dict__
+
+    def rebuild(self):
+        self.main_menu = build_main_menu()
+        self.stats = build_stats_kb()
+        self.reset_confirm = build_reset_confirm_kb()
+        self.reset_restore = build_reset_restore_kb()
+        pages = max(1, (len(CATEGORY_OPTIONS) + CATEGORIES_PAGE_SIZE - 1) // CATEGORIES_PAGE_SIZE)
+        self.category_pages = tuple(build_categories_kb(p) for p in range(pages))
+        # индекс алиасов для разбора «390 кофе, 250 такси» зависит от тех же категорий
+        self.aliases = AliasIndex(CATEGORY_OPTIONS)
+
+    def categories(self, page: int = 0):
+        if 0 <= page < len(self.category_pages):
+            return self.category_pages[page]
+        return self.category_pages[0]
+
+    def set_categories(self, options: List[Tuple[str, str]]):
+        CATEGORY_OPTIONS[:] = options
+        RAW_CATEGORIES[:] = [r for _, r in options]
+        LABEL_BY_RAW.clear()
+        LABEL_BY_RAW.update({raw: label for (label, raw) in options})
+        self.rebuild()
+
+KEYBOARDS = Keyboards()
+
+def categories_kb(page: int = 0):
+    return KEYBOARDS.categories(page)
+
+def inline_main_menu():
+    return KEYBOARDS.main_menu
+
+def stats_inline_kb():
+    return KEYBOARDS.stats
+
 # ---------- FSM ----------
 class AddFlow(StatesGroup):
     waiting_amount = State()
@@ -214,6 +410,29 @@ class AddFlow(StatesGroup):
 
 router = Router()
 
+# Единственный вход для inline-кнопок: разбор payload и поиск обработчика
+# в CALLBACKS вместо перебора фильтров. Битые и устаревшие кнопки
+# отвечаются сразу, без обращения к базе.
+@router.callback_query()
+async def on_callback(cb: CallbackQuery, state: FSMContext):
+    found = CALLBACKS.resolve(cb.data)
+    if found is None:
+        ack(cb, "Кнопка устарела — открой /menu")
+        return
+    fn, arg = found
+    # время и ошибки — под именем действия, а не on_callback; HandlerTimer
+    # на callback_query поэтому не вешается (иначе каждое нажатие считалось бы дважды)
+    started = time.perf_counter()
+    try:
+        await fn(cb, state, arg)
+    except Exception:
+        if metrics.ENABLED:
+            metrics.HANDLER_ERRORS.inc((fn.__name__,))
+        raise
+    finally:
+        if metrics.ENABLED:
+            metrics.HANDLER_SECONDS.observe((fn.__name__,), time.perf_counter() - started)
+
 WELCOME = (
     "🦩 <b>Flamingo Money</b>\n"
     "Твой лёгкий учёт расходов: кидай сумму — я спрошу категорию и всё запишу.\n\n"
@@ -246,17 +465,6 @@ def period_bounds(kind: str):
         title = "Текущий месяц"
     return title, start, end
 
-def fetch_stats(user_id: int, start: datetime, end: datetime):
-    with closing(db()) as conn:
-        rows = conn.execute(
-            "SELECT category, SUM(amount) AS total FROM expenses "
-            "WHERE user_id=? AND created_at>=? AND created_at<? "
-            "GROUP BY category ORDER BY total DESC",
-            (user_id, start.isoformat(), end.isoformat()),
-        ).fetchall()
-    total = sum((r["total"] or 0) for r in rows)
-    return total, rows
-
 def bar(value: float, max_value: float, width: int = 14) -> str:
     if max_value <= 0:
         return "░" * width
@@ -265,179 +473,179 @@ def bar(value: float, max_value: float, width: int = 14) -> str:
     return "█" * filled + "░" * (width - filled)
 
 # ---------- Профиль /me ----------
-def get_user_profile(user_id: int):
-    with closing(db()) as conn:
-        row_total = conn.execute(
-            "SELECT COALESCE(SUM(amount),0) AS t FROM expenses WHERE user_id=?",
-            (user_id,),
-        ).fetchone()
-        total = float(row_total["t"] or 0)
-
-        row_top = conn.execute(
-            "SELECT category, SUM(amount) AS s FROM expenses "
-            "WHERE user_id=? GROUP BY category ORDER BY s DESC LIMIT 1",
-            (user_id,),
-        ).fetchone()
-        if row_top:
-            raw = row_top["category"]
-            top_category = LABEL_BY_RAW.get(raw, raw)
-        else:
-            top_category = "—"
-
-        row_days = conn.execute(
-            "SELECT COUNT(DISTINCT date(created_at)) AS d FROM expenses WHERE user_id=?",
-            (user_id,),
-        ).fetchone()
-        days_total = int(row_days["d"] or 0)
-
-        dates = conn.execute(
-            "SELECT DISTINCT date(created_at) AS d "
-            "FROM expenses WHERE user_id=? AND created_at>=? "
-            "ORDER BY d DESC",
-            (user_id, (datetime.now(tz=LOCAL_TZ) - timedelta(days=120)).isoformat()),
-        ).fetchall()
-
-    today = datetime.now(tz=LOCAL_TZ).date()
-    date_set = {
-        datetime.fromisoformat(r["d"]).date()
-        if "T" in r["d"]
-        else datetime.strptime(r["d"], "%Y-%m-%d").date()
-        for r in dates
-    }
-    streak = 0
-    cur = today
-    while cur in date_set:
-        streak += 1
-        cur = cur - timedelta(days=1)
-
-    avg_per_day = round(total / days_total, 2) if days_total else 0.0
-    with closing(db()) as conn:
-        row_30 = conn.execute(
-            "SELECT COALESCE(SUM(amount),0) AS t FROM expenses "
-            "WHERE user_id=? AND created_at>=?",
-            (user_id, (datetime.now(tz=LOCAL_TZ) - timedelta(days=30)).isoformat()),
-        ).fetchone()
-    last30 = float(row_30["t"] or 0)
-    avg_30 = round(last30 / 30, 2)
-
-    return {
-        "total": total,
-        "top_category": top_category,
-        "days_total": days_total,
-        "streak": streak,
-        "avg_per_day": avg_per_day,
-        "avg_30": avg_30,
-    }
+async def get_user_profile(user_id: int):
+    p = await store.user_profile(user_id)
+    raw = p["top_category"]
+    p["top_category"] = LABEL_BY_RAW.get(raw, raw) if raw else "—"
+    return p
 
 # ---------- Хэндлеры ----------
 @router.message(CommandStart())
 async def start_cmd(message: Message, state: FSMContext):
-    await message.answer(WELCOME, reply_markup=inline_main_menu(), parse_mode="HTML")
+    reply(message, WELCOME, reply_markup=inline_main_menu(), parse_mode="HTML")
     await state.set_state(AddFlow.waiting_amount)
 
 @router.message(Command("menu"))
 async def menu_cmd(message: Message, state: FSMContext):
-    await message.answer("🧭 Главное меню:", reply_markup=inline_main_menu())
+    reply(message, "🧭 Главное меню:", reply_markup=inline_main_menu())
     await state.set_state(AddFlow.waiting_amount)
 
-@router.callback_query(F.data == "menu:add")
-async def cb_add(cb: CallbackQuery, state: FSMContext):
-    await cb.message.answer("Введи сумму (например: <b>390</b>)", parse_mode="HTML")
+@CALLBACKS.on("menu", "add")
+async def cb_add(cb: CallbackQuery, state: FSMContext, arg: None):
+    reply(cb.message, "Введи сумму (например: <b>390</b>)", parse_mode="HTML")
     await state.set_state(AddFlow.waiting_amount)
-    await cb.answer()
-
-@router.callback_query(F.data == "menu:stats")
-async def cb_stats(cb: CallbackQuery):
-    await cb.message.answer("Выбери период:", reply_markup=stats_inline_kb())
-    await cb.answer()
-
-@router.callback_query(F.data == "menu:export")
-async def cb_export(cb: CallbackQuery):
-    await export_csv(cb.message)
-    await cb.answer()
-
-@router.callback_query(F.data == "menu:help")
-async def cb_help(cb: CallbackQuery):
-    text = (
-        "ℹ️ <b>Как пользоваться</b>\n\n"
-        "1) Отправь число — это сумма траты (например: <b>390</b>).\n"
-        "2) Выбери категорию из списка.\n"
-        "3) Готово! Запись попадёт в статистику и экспорт.\n\n"
-        "Команды:\n"
-        "• /menu — главное меню\n"
-        "• /stats — выбор периода статистики\n"
-        "• /export — выгрузка CSV\n"
-        "• /reset_me — удалить только свои траты\n"
-        "• /undo — отменить последнюю трату\n"
-        "• /me — мой профиль\n"
-        "• /start — перезапуск приветствия"
-    )
-    await cb.message.answer(text, parse_mode="HTML", reply_markup=inline_main_menu())
-    await cb.answer()
+    ack(cb)
 
-@router.callback_query(F.data == "menu:reset")
-async def menu_reset(cb: CallbackQuery):
-    kb = InlineKeyboardBuilder()
-    kb.button(text="❌ Да, удалить только мои траты", callback_data="myreset:confirm")
-    kb.button(text="Отмена", callback_data="myreset:cancel")
-    kb.adjust(1)
-    await cb.message.answer(
+@CALLBACKS.on("menu", "stats")
+async def cb_stats(cb: CallbackQuery, state: FSMContext, arg: None):
+    reply(cb.message, "Выбери период:", reply_markup=stats_inline_kb())
+    ack(cb)
+
+@CALLBACKS.on("menu", "export")
+async def cb_export(cb: CallbackQuery, state: FSMContext, arg: None):
+    await send_export(cb.message, cb.from_user.id)
+    ack(cb)
+
+HELP_TEXT = (
+    "ℹ️ <b>Как пользоваться</b>\n\n"
+    "1) Отправь число — это сумма траты (например: <b>390</b>).\n"
+    "2) Выбери категорию из списка.\n"
+    "3) Готово! Запись попадёт в статистику и экспорт.\n\n"
+    "Команды:\n"
+    "• /menu — главное меню\n"
+    "• /stats — выбор периода статистики (или /stats 90d week — свой период)\n"
+    "• /export — выгрузка CSV\n"
+    "• /reset_me — удалить только свои траты\n"
+    "• /undo — отменить последнюю трату (можно несколько раз подряд)\n"
+    "• /redo — вернуть отменённую трату\n"
+    "• /me — мой профиль\n"
+    "• /digest — ежедневная или еженедельная сводка\n"
+    "• пришли CSV-файл из /export — импорт истории\n"
+    "• /start — перезапуск приветствия"
+)
+
+@CALLBACKS.on("menu", "help")
+async def cb_help(cb: CallbackQuery, state: FSMContext, arg: None):
+    reply(cb.message, HELP_TEXT, parse_mode="HTML", reply_markup=inline_main_menu())
+    ack(cb)
+
+@CALLBACKS.on("menu", "reset")
+async def menu_reset(cb: CallbackQuery, state: FSMContext, arg: None):
+    reply(
+        cb.message,
         "⚠️ Уверена, что хочешь удалить все свои записи?\n"
-        "Это действие <b>нельзя отменить</b>.",
+        f"Вернуть их можно будет в течение <b>{UNDO_WINDOW_HOURS:g} ч</b>.",
         parse_mode="HTML",
-        reply_markup=kb.as_markup(),
+        reply_markup=KEYBOARDS.reset_confirm,
+    )
+    ack(cb)
+
+@CALLBACKS.on("reset", "cancel")
+async def myreset_cancel(cb: CallbackQuery, state: FSMContext, arg: None):
+    reply(cb.message, "Отменено ✅", reply_markup=inline_main_menu())
+    ack(cb)
+
+@CALLBACKS.on("reset", "confirm")
+async def myreset_confirm(cb: CallbackQuery, state: FSMContext, arg: None):
+    await store.reset_user(cb.from_user.id)
+    reply(
+        cb.message,
+        "🧹 Готово! Все твои траты удалены.\n"
+        f"Передумала — жми «Вернуть траты» в течение {UNDO_WINDOW_HOURS:g} ч.",
+        reply_markup=KEYBOARDS.reset_restore,
     )
-    await cb.answer()
+    ack(cb)
 
-@router.callback_query(F.data == "myreset:cancel")
-async def myreset_cancel(cb: CallbackQuery):
-    await cb.message.answer("Отменено ✅", reply_markup=inline_main_menu())
-    await cb.answer()
+@CALLBACKS.on("reset", "restore")
+async def myreset_restore(cb: CallbackQuery, state: FSMContext, arg: None):
+    restored = await store.restore_reset(cb.from_user.id)
+    if restored is None:
+        reply(cb.message, "⌛ Вернуть траты уже нельзя — срок возврата истёк.", reply_markup=inline_main_menu())
+    else:
+        reply(cb.message, f"↩️ Вернула траты: <b>{restored}</b>.", parse_mode="HTML", reply_markup=inline_main_menu())
+    ack(cb)
 
-@router.callback_query(F.data == "myreset:confirm")
-async def myreset_confirm(cb: CallbackQuery):
-    with closing(db()) as conn, conn:
-        conn.execute("DELETE FROM expenses WHERE user_id=?", (cb.from_user.id,))
-    await cb.message.answer("🧹 Готово! Все твои траты удалены.", reply_markup=inline_main_menu())
-    await cb.answer()
+# -------- UNDO: подсказка, что отменится следующим --------
+async def undo_preview(user_id: int) -> str:
+    last = await store.last_expense(user_id)
+    if last is None:
+        return "Больше записей нет."
+    amount, category = last
+    return f"Следующей /undo отменит: {amount:g} • {LABEL_BY_RAW.get(category, category)}"
 
 # -------- UNDO: кнопка в меню --------
-@router.callback_query(F.data == "menu:undo")
-async def menu_undo(cb: CallbackQuery):
-    row = undo_last_expense(cb.from_user.id)
+@CALLBACKS.on("menu", "undo")
+async def menu_undo(cb: CallbackQuery, state: FSMContext, arg: None):
+    row = await store.undo_last(cb.from_user.id)
     if not row:
-        await cb.message.answer("😌 У тебя пока нет записей, нечего отменять.", reply_markup=inline_main_menu())
+        reply(cb.message, "😌 У тебя пока нет записей, нечего отменять.", reply_markup=inline_main_menu())
     else:
         label = LABEL_BY_RAW.get(row["category"], row["category"])
         amount = row["amount"]
         txt = (
             "↩️ <b>Отменила последнюю запись</b>\n\n"
             f"{amount:g} • {label}\n\n"
-            "💡 Можно отправить новую сумму — запишу следующую трату."
+            "💡 Можно отправить новую сумму — запишу следующую трату.\n"
+            "Передумала — /redo вернёт запись.\n\n"
+            f"{await undo_preview(cb.from_user.id)}"
         )
-        await cb.message.answer(txt, parse_mode="HTML", reply_markup=inline_main_menu())
-    await cb.answer()
+        reply(cb.message, txt, parse_mode="HTML", reply_markup=inline_main_menu())
+    ack(cb)
 
 # -------- UNDO: команда /undo --------
 @router.message(Command("undo"))
 async def undo_cmd(message: Message):
-    row = undo_last_expense(message.from_user.id)
+    row = await store.undo_last(message.from_user.id)
     if not row:
-        await message.answer("😌 У тебя пока нет записей, нечего отменять.", reply_markup=inline_main_menu())
+        reply(message, "😌 У тебя пока нет записей, нечего отменять.", reply_markup=inline_main_menu())
     else:
         label = LABEL_BY_RAW.get(row["category"], row["category"])
         amount = row["amount"]
         txt = (
             "↩️ <b>Отменила последнюю запись</b>\n\n"
             f"{amount:g} • {label}\n\n"
-            "Можешь продолжать — отправь следующую сумму 💖"
+            "Можешь продолжать — отправь следующую сумму 💖\n"
+            "Передумала — /redo вернёт запись.\n\n"
+            f"{await undo_preview(message.from_user.id)}"
         )
-        await message.answer(txt, parse_mode="HTML", reply_markup=inline_main_menu())
+        reply(message, txt, parse_mode="HTML", reply_markup=inline_main_menu())
+
+# -------- REDO: команда /redo --------
+# Возвращает последнюю отменённую трату, пока после отмены не было новых
+@router.message(Command("redo"))
+async def redo_cmd(message: Message):
+    row = await store.redo_last(message.from_user.id)
+    if not row:
+        reply(message, "😌 Возвращать нечего — отменённых записей нет.", reply_markup=inline_main_menu())
+        return
+    label = LABEL_BY_RAW.get(row["category"], row["category"])
+    reply(
+        message,
+        f"🔁 <b>Вернула запись</b>\n\n{row['amount']:g} • {label}",
+        parse_mode="HTML",
+        reply_markup=inline_main_menu(),
+    )
+
+# -------- /admin_stats ----------
+# Только для ADMIN_IDS; остальным команда не видна (фильтр не пропускает)
+@router.message(Command("admin_stats"), F.from_user.id.in_(ADMIN_IDS))
+async def admin_stats_cmd(message: Message):
+    if snapshots.report is None or snapshots.age >= snapshots.max_age:
+        reply(message, "⏳ Снимаю копию базы…")
+    report, taken_at, duration = await snapshots.get()
+    # только счётчики: сверка с базой идёт в фоне (Storage.check_recent) и
+    # охватывает кэш этого процесса
+    drift = store.recent_drift
+    cache = (
+        f"Recent cache: {store.cached_recent_users} users, {store.recent_cache_bytes / (1 << 20):.1f} MiB, "
+        f"last check drift {'–' if drift is None else drift}"
+    )
+    reply(message, snapshot.format_report(report, taken_at, duration) + "\n\n" + cache)
 
 # -------- /me ----------
 @router.message(Command("me"))
 async def me_cmd(message: Message):
-    p = get_user_profile(message.from_user.id)
+    p = await get_user_profile(message.from_user.id)
     compliments = [
         "🦩 Ты ведёшь учёт как настоящая фламинго-икона 💖",
         "💅 Финансы под контролем — ты буквально богиня бюджета ✨",
@@ -454,71 +662,124 @@ async def me_cmd(message: Message):
         f"📆 <b>За 30 дней в среднем/день:</b> {p['avg_30']:.2f}\n\n"
         f"{random.choice(compliments)}"
     )
-    await message.answer(msg, parse_mode="HTML", reply_markup=inline_main_menu())
+    reply(message, msg, parse_mode="HTML", reply_markup=inline_main_menu())
 
 # -------- Добавление трат --------
 @router.message(AddFlow.waiting_amount, F.text.regexp(r"^\d+([.,]\d+)?$"))
 async def got_amount(message: Message, state: FSMContext):
     amount = float(message.text.replace(",", "."))
     await state.update_data(amount=amount)
-    await message.answer(
+    reply(
+        message,
         f"Ок, <b>{amount:g}</b>. Теперь выбери категорию:",
         parse_mode="HTML",
         reply_markup=categories_kb(page=0)
     )
     await state.set_state(AddFlow.waiting_category)
 
-@router.message(AddFlow.waiting_amount)
+# ---------- Несколько трат одним сообщением ----------
+# «390 кофе, 1200 продукты; 250 такси»: всё распознанное пишется одной
+# транзакцией и подтверждается одним сообщением. Суммы, для которых
+# категория не нашлась или неоднозначна, встают в очередь (queue в данных
+# FSM) и уточняются по одной через обычную клавиатуру категорий.
+def entries_filter(message: Message):
+    found = parse_entries(message.text or "", KEYBOARDS.aliases)
+    return {"entries": found} if found else False
+
+def ask_category_text(amount: float, word: str) -> str:
+    what = f"«{html.escape(word)}» " if word else ""
+    return f"Не поняла категорию {what}для <b>{amount:g}</b> — выбери:"
+
+@router.message(AddFlow.waiting_amount, F.text, ~F.text.startswith("/"), entries_filter)
+async def got_entries(message: Message, state: FSMContext, entries: list):
+    resolved = [e for e in entries if e.category]
+    pending = [[e.amount, e.word] for e in entries if not e.category]
+    parts = []
+    if resolved:
+        now = datetime.now(tz=LOCAL_TZ)
+        await store.add_expenses(message.from_user.id, [(e.amount, e.category, now) for e in resolved])
+        total = sum(e.amount for e in resolved)
+        title = "Записала трату" if len(resolved) == 1 else f"Записала траты: {len(resolved)} на {total:g}"
+        lines = "\n".join(f"{e.amount:g} • {LABEL_BY_RAW.get(e.category, e.category)}" for e in resolved)
+        parts.append(f"✅ <b>{title}</b>\n\n{lines}")
+    if not pending:
+        reply(message, "\n\n".join(parts + [NEXT_STEPS]), parse_mode="HTML", reply_markup=inline_main_menu())
+        return
+    (amount, word), rest = pending[0], pending[1:]
+    await state.update_data(amount=amount, queue=rest)
+    parts.append(ask_category_text(amount, word))
+    reply(message, "\n\n".join(parts), parse_mode="HTML", reply_markup=categories_kb(page=0))
+    await state.set_state(AddFlow.waiting_category)
+
+# команды и файлы, которые обрабатываются ниже (/export, импорт CSV), не должны тонуть здесь
+@router.message(AddFlow.waiting_amount, ~F.document, ~F.text.startswith("/"))
 async def must_number(message: Message):
-    await message.answer("Отправь число, например: 390")
+    reply(message, "Отправь число, например: 390")
 
-@router.callback_query(F.data.startswith("page:"))
-async def page_cb(cb: CallbackQuery):
-    page = int(cb.data.split(":", 1)[1])
-    await cb.message.edit_reply_markup(reply_markup=categories_kb(page=page))
-    await cb.answer()
+# номер страницы вне диапазона categories_kb сводит к первой
+@CALLBACKS.on("page")
+async def page_cb(cb: CallbackQuery, state: FSMContext, page: int):
+    sender.submit(cb.message.edit_reply_markup(reply_markup=categories_kb(page=page)), cb.message.chat.id)
+    ack(cb)
 
-@router.callback_query(F.data == "noop")
-async def noop_cb(cb: CallbackQuery):
-    await cb.answer()
+@CALLBACKS.on("noop")
+async def noop_cb(cb: CallbackQuery, state: FSMContext, arg: None):
+    ack(cb)
+
+NEXT_STEPS = (
+    "💡 Что дальше:\n"
+    "• отправь ещё сумму — добавлю следующую трату\n"
+    "• /stats — посмотреть статистику\n"
+    "• /undo — отменить последнюю запись\n"
+)
 
-@router.callback_query(AddFlow.waiting_category, F.data.startswith("pick:"))
-async def picked_category(cb: CallbackQuery, state: FSMContext):
-    idx = int(cb.data.split(":", 1)[1])
+@CALLBACKS.on("pick")
+async def picked_category(cb: CallbackQuery, state: FSMContext, idx: int):
+    if await state.get_state() != AddFlow.waiting_category.state:
+        ack(cb)
+        return
+    if idx >= len(CATEGORY_OPTIONS):
+        # клавиатура от старого списка категорий
+        ack(cb, "Кнопка устарела — выбери категорию ещё раз")
+        return
     label, raw = CATEGORY_OPTIONS[idx]
     data = await state.get_data()
     amount = data.get("amount")
-    with closing(db()) as conn, conn:
-        conn.execute(
-            "INSERT INTO expenses(user_id,amount,category,created_at) VALUES (?,?,?,?)",
-            (cb.from_user.id, amount, raw, datetime.now(tz=LOCAL_TZ).isoformat()),
+    if amount is None:
+        # повторное нажатие на старую клавиатуру: сумма уже записана
+        await state.set_state(AddFlow.waiting_amount)
+        ack(cb, "Сначала отправь сумму")
+        return
+    await store.add_expense(cb.from_user.id, amount, raw, datetime.now(tz=LOCAL_TZ))
+
+    # следующая сумма из сообщения с несколькими тратами
+    queue = data.get("queue")
+    if queue:
+        (next_amount, next_word), rest = queue[0], queue[1:]
+        await state.set_data({"amount": next_amount, "queue": rest})
+        reply(
+            cb.message,
+            f"✅ {amount:g} • {label}\n\n{ask_category_text(next_amount, next_word)}",
+            parse_mode="HTML",
+            reply_markup=categories_kb(page=0),
         )
+        ack(cb)
+        return
 
-    main_text = (
-        "✅ <b>Записала трату</b>\n\n"
-        f"{amount:g} • {label}\n\n"
-        "💡 Что дальше:\n"
-        "• отправь ещё сумму — добавлю следующую трату\n"
-        "• /stats — посмотреть статистику\n"
-        "• /undo — отменить последнюю запись\n"
-    )
-    await cb.message.answer(
+    main_text = f"✅ <b>Записала трату</b>\n\n{amount:g} • {label}\n\n{NEXT_STEPS}"
+    reply(
+        cb.message,
         main_text,
         parse_mode="HTML",
         reply_markup=inline_main_menu(),
     )
 
-    # тематическая цитата по категории
-    try:
-        quotes = CATEGORY_QUOTES.get(raw, CATEGORY_QUOTES["Иное"])
-        quote = random.choice(quotes)
-        await cb.message.answer(quote)
-    except Exception:
-        pass
+    # тематическая цитата по категории; планировщик склеит её с подтверждением
+    reply(cb.message, random.choice(CATEGORY_QUOTES.get(raw, CATEGORY_QUOTES["Иное"])))
 
     await state.clear()
     await state.set_state(AddFlow.waiting_amount)
-    await cb.answer()
+    ack(cb)
 
 def build_stats_text(title: str, total: float, rows):
     max_val = max((r["total"] or 0) for r in rows) or 1.0
@@ -530,31 +791,354 @@ def build_stats_text(title: str, total: float, rows):
         lines.append(f"{lbl} — {val:g}\n{bar(val, max_val)}")
     return "\n".join(lines)
 
-@router.callback_query(F.data.startswith("stats:"))
-async def stats_cb(cb: CallbackQuery):
-    kind = cb.data.split(":", 1)[1]
+@CALLBACKS.on("stats")
+async def stats_cb(cb: CallbackQuery, state: FSMContext, kind: str):
     title, start, end = period_bounds(kind)
-    total, rows = fetch_stats(cb.from_user.id, start, end)
+    total, rows = await store.fetch_stats(cb.from_user.id, start, end)
     if not rows:
-        await cb.message.answer(f"📊 {title}\nНет расходов", reply_markup=inline_main_menu())
+        reply(cb.message, f"📊 {title}\nНет расходов", reply_markup=inline_main_menu())
     else:
-        await cb.message.answer(build_stats_text(title, total, rows), parse_mode="HTML", reply_markup=inline_main_menu())
-    await cb.answer()
+        reply(cb.message, build_stats_text(title, total, rows), parse_mode="HTML", reply_markup=inline_main_menu())
+    ack(cb)
+
+# ---------- /stats за произвольный период ----------
+STATS_USAGE = (
+    "📊 <b>Статистика за период</b>\n\n"
+    "/stats — быстрый выбор периода\n"
+    "/stats 2024-01-01 2024-03-31 — за даты (включительно)\n"
+    "/stats 2024-01 2024-06 month — по месяцам\n"
+    "/stats 2023 — за год\n"
+    "/stats 90d week — последние 90 дней по неделям (также 8w, 12m)\n\n"
+    "Разбивка: day / week / month (день / неделя / месяц)"
+)
+GRANULARITY_WORDS = {
+    "day": "day", "days": "day", "день": "day", "дни": "day",
+    "week": "week", "weeks": "week", "неделя": "week", "недели": "week",
+    "month": "month", "months": "month", "месяц": "month", "месяцы": "month",
+}
+GRANULARITY_TITLES = {"day": "по дням", "week": "по неделям", "month": "по месяцам"}
+SPARK = "▁▂▃▄▅▆▇█"
+TREND_LINES = 12
+# границы ввода /stats: за ними арифметика дат упирается в date.min/max (OverflowError)
+STATS_YEARS = (1970, 2100)
+STATS_MAX_RELATIVE = 10000
+
+def add_months(d: date, months: int) -> date:
+    m = d.year * 12 + d.month - 1 + months
+    return date(m // 12, m % 12 + 1, 1)
+
+# токен даты -> [начало, конец): день, месяц или год
+def parse_period_token(token: str):
+    parts = token.split("-")
+    if not all(p.isdigit() for p in parts):
+        return None
+    if not STATS_YEARS[0] <= int(parts[0]) <= STATS_YEARS[1]:
+        return None
+    if len(parts) == 3:
+        d = datetime.strptime(token, "%Y-%m-%d").date()
+        return d, d + timedelta(days=1), False
+    if len(parts) == 2:
+        d = date(int(parts[0]), int(parts[1]), 1)
+        return d, add_months(d, 1), True
+    if len(parts) == 1 and len(token) == 4:
+        d = date(int(token), 1, 1)
+        return d, date(d.year + 1, 1, 1), True
+    return None
+
+def parse_stats_args(args: str, today: date):
+    granularity, periods, relative = None, [], None
+    for token in args.lower().split():
+        if token in GRANULARITY_WORDS:
+            granularity = GRANULARITY_WORDS[token]
+            continue
+        if token[:-1].isdigit() and token[-1] in "dwmднм":
+            relative = (int(token[:-1]), token[-1])
+            if relative[0] > STATS_MAX_RELATIVE:
+                raise ValueError(f"period too long {token!r}")
+            continue
+        period = parse_period_token(token)
+        if period is None:
+            raise ValueError(f"bad token {token!r}")
+        periods.append(period)
+    end = today + timedelta(days=1)
+    if relative and periods or len(periods) > 2:
+        raise ValueError("ambiguous period")
+    if relative:
+        n, unit = relative
+        if unit in "dд":
+            start = end - timedelta(days=n)
+        elif unit in "wн":
+            start = end - timedelta(weeks=n)
+        else:
+            start = add_months(today.replace(day=1), 1 - n)
+    elif len(periods) == 2:
+        start, end = periods[0][0], periods[1][1]
+    elif periods:
+        # одна дата — от неё до сегодня, месяц или год — целиком
+        start, period_end, whole = periods[0]
+        if whole:
+            end = period_end
+    else:
+        default = {"day": timedelta(days=30), "week": timedelta(weeks=12)}
+        start = end - default[granularity] if granularity in default else add_months(today.replace(day=1), -11)
+    if start >= end:
+        raise ValueError("empty period")
+    granularity = granularity or analytics.auto_granularity(start, end)
+    if len(analytics.bucket_starts(start, end, granularity)) > analytics.MAX_BUCKETS:
+        raise ValueError("too many buckets")
+    return start, end, granularity
+
+def sparkline(values) -> str:
+    top = max(values) if values else 0
+    if top <= 0:
+        return "·" * len(values)
+    return "".join("·" if v <= 0 else SPARK[min(len(SPARK) - 1, int(v / top * (len(SPARK) - 1) + 0.5))] for v in values)
+
+# 1234567.5 -> "1 234 567.5": на многолетних суммах :g уходит в экспоненту
+def money(value: float) -> str:
+    return f"{value:,.2f}".rstrip("0").rstrip(".").replace(",", " ")
+
+def pct_change(cur: float, prev: float) -> str:
+    if not prev:
+        return ""
+    return f"{(cur - prev) / prev * 100:+.0f}%"
+
+def bucket_label(d: date, granularity: str) -> str:
+    if granularity == "month":
+        return d.strftime("%m.%Y")
+    if granularity == "week":
+        return "с " + d.strftime("%d.%m")
+    return d.strftime("%d.%m")
+
+def build_range_stats_text(series: analytics.Series, start: date, end: date, granularity: str) -> str:
+    last = end - timedelta(days=1)
+    cats = series.category_totals()
+    total = sum(c[1] for c in cats)
+    prev_total = sum(c[2] for c in cats)
+    head = (
+        f"📊 <b>{start:%d.%m.%Y} — {last:%d.%m.%Y}</b> · {GRANULARITY_TITLES[granularity]}\n"
+        f"Итого: <b>{money(total)}</b>"
+    )
+    if prev_total:
+        head += f" ({pct_change(total, prev_total)} к прошлому периоду)"
+    if not total:
+        return head + "\n\nНет расходов"
+    lines = [head, "", "<b>Динамика</b>"]
+    totals = series.bucket_totals()
+    shown = range(max(0, len(totals) - TREND_LINES), len(totals))
+    if shown.start:
+        lines.append(f"… ещё {shown.start} раньше")
+    for i in shown:
+        delta = f" ({pct_change(totals[i], totals[i - 1])})" if i and totals[i - 1] else ""
+        lines.append(f"{bucket_label(series.starts[i], granularity)} — {money(totals[i])}{delta}")
+    lines += ["", "<b>Категории</b>"]
+    index = {name: i for i, name in enumerate(series.categories)}
+    for name, cur, prev in cats:
+        if not cur:
+            continue
+        change = pct_change(cur, prev)
+        lines.append(f"{LABEL_BY_RAW.get(name, name)} — {money(cur)}" + (f" ({change})" if change else ""))
+        lines.append(f"<code>{sparkline(series.row(index[name]))}</code>")
+    # движение к предыдущему периоду той же длины, если за него есть данные
+    up, down = series.movers() if prev_total else ([], [])
+    if up:
+        lines.append("\n📈 Выросли: " + ", ".join(f"{LABEL_BY_RAW.get(n, n)} +{money(d)}" for n, d in up))
+    if down:
+        lines.append(("📉" if up else "\n📉") + " Снизились: " + ", ".join(f"{LABEL_BY_RAW.get(n, n)} −{money(-d)}" for n, d in down))
+    return "\n".join(lines)
+
+# Окно грузится один раз колонками вместе с предыдущим периодом той же
+# длины (для сравнения) и раскладывается по корзинам за один проход
+async def load_series(user_id: int, start: date, end: date, granularity: str) -> analytics.Series:
+    prev_start = start - (end - start)
+    days, cats, sums, names = await store.fetch_daily_columns(
+        user_id, analytics.day_number(prev_start), analytics.day_number(end)
+    )
+    return await asyncio.to_thread(analytics.build_series, days, cats, sums, names, start, end, granularity)
+
+@router.message(Command("stats"))
+async def stats_cmd(message: Message, command: CommandObject):
+    if not command.args:
+        reply(message, "Выбери период:", reply_markup=stats_inline_kb())
+        return
+    try:
+        start, end, granularity = parse_stats_args(command.args, datetime.now(tz=LOCAL_TZ).date())
+    except ValueError:
+        reply(message, STATS_USAGE, parse_mode="HTML")
+        return
+    series = await load_series(message.from_user.id, start, end, granularity)
+    reply(message, build_range_stats_text(series, start, end, granularity), parse_mode="HTML", reply_markup=inline_main_menu())
+
+# ---------- Дайджесты ----------
+DIGEST_PERIODS = {
+    "daily": "daily", "day": "daily", "день": "daily", "ежедневно": "daily",
+    "weekly": "weekly", "week": "weekly", "неделя": "weekly", "еженедельно": "weekly",
+}
+DIGEST_OFF = ("off", "stop", "выкл", "нет")
+DIGEST_TITLES = {"daily": "ежедневная", "weekly": "еженедельная (по понедельникам)"}
+DIGEST_USAGE = (
+    "🗓 <b>Сводка по расписанию</b>\n\n"
+    f"/digest daily — каждый день в {DIGEST_HOUR}:00 за вчера\n"
+    f"/digest weekly — по понедельникам в {DIGEST_HOUR}:00 за прошлую неделю\n"
+    "/digest off — отписаться"
+)
+
+# rows — [(категория, сумма за окно, сумма за предыдущее окно)]
+def render_digest(period: str, start: date, end: date, rows) -> Optional[str]:
+    total = sum(r[1] for r in rows)
+    if not total:
+        return None
+    prev_total = sum(r[2] for r in rows)
+    if period == "weekly":
+        head = f"🗓 <b>Итоги недели</b> · {start:%d.%m}–{end - timedelta(days=1):%d.%m}"
+        prev = "к прошлой неделе"
+    else:
+        head = f"🗓 <b>Итоги дня</b> · {start:%d.%m}"
+        prev = "к позавчера"
+    spent = f"Потрачено: <b>{money(total)}</b>"
+    if prev_total:
+        spent += f" ({pct_change(total, prev_total)} {prev})"
+    top = sorted((r for r in rows if r[1]), key=lambda r: -r[1])[:3]
+    lines = [head, spent, ""]
+    lines += [f"{i}. {LABEL_BY_RAW.get(c, c)} — {money(v)}" for i, (c, v, _) in enumerate(top, start=1)]
+    lines.append("\n/digest off — отписаться")
+    return "\n".join(lines)
+
+digests = DigestScheduler(store, sender, render_digest, LOCAL_TZ, hour=DIGEST_HOUR, rate=DIGEST_RATE / SEND_PROCESSES)
+
+@router.message(Command("digest"))
+async def digest_cmd(message: Message, command: CommandObject):
+    arg = (command.args or "").strip().lower()
+    uid = message.from_user.id
+    if not arg:
+        current = await store.get_subscription(uid)
+        status = f"Сейчас: {DIGEST_TITLES[current]}." if current else "Сейчас подписки нет."
+        reply(message, f"{DIGEST_USAGE}\n\n{status}", parse_mode="HTML")
+        return
+    if arg in DIGEST_OFF:
+        await store.set_subscription(uid, message.chat.id, None)
+        reply(message, "Отписала от сводок ✅", reply_markup=inline_main_menu())
+        return
+    period = DIGEST_PERIODS.get(arg)
+    if period is None:
+        reply(message, DIGEST_USAGE, parse_mode="HTML")
+        return
+    await store.set_subscription(uid, message.chat.id, period)
+    reply(message, f"Готово! Сводка: {DIGEST_TITLES[period]}, в {DIGEST_HOUR}:00 🗓", reply_markup=inline_main_menu())
+
+# ---------- Экспорт ----------
+EXPORT_USAGE = (
+    "📁 <b>Экспорт CSV</b>\n\n"
+    "/export — вся история\n"
+    "/export 2024-01-01 — с даты\n"
+    "/export 2024-01-01 2024-01-31 — за период (включительно)\n"
+    "/export 2024-01-01 2024-01-31 Кофе gz — по категории, сжатый"
+)
+
+def parse_export_args(args: str):
+    dates, words, compress = [], [], False
+    for token in (args or "").split():
+        if token.lower() in ("gz", "gzip"):
+            compress = True
+            continue
+        try:
+            dates.append(datetime.strptime(token, "%Y-%m-%d").replace(tzinfo=LOCAL_TZ))
+        except ValueError:
+            words.append(token)
+    if len(dates) > 2:
+        raise ValueError("too many dates")
+    start = dates[0] if dates else None
+    end = dates[1] + timedelta(days=1) if len(dates) == 2 else None
+    category = None
+    if words:
+        wanted = " ".join(words).casefold()
+        matches = [r for r in RAW_CATEGORIES if r.casefold() == wanted]
+        if not matches:
+            raise ValueError(f"unknown category {wanted!r}")
+        category = matches[0]
+    return start, end, category, compress
+
+# Строки идут из курсора пачками прямо в буфер в памяти (по желанию через
+# gzip) — без fetchall и без временных файлов на диске. Пишет поток-читатель БД.
+def csv_sink(out):
+    def write(rows):
+        out.write("".join(f"{r['amount']};{r['category']};{r['created_at']}\n" for r in rows).encode("utf-8"))
+    return write
+
+async def send_export(message: Message, user_id: int, args: str = ""):
+    try:
+        start, end, category, compress = parse_export_args(args)
+    except ValueError:
+        reply(message, EXPORT_USAGE, parse_mode="HTML")
+        return
+    buf = io.BytesIO()
+    out = gzip.GzipFile(fileobj=buf, mode="wb") if compress else buf
+    out.write(b"amount;category;created_at\n")
+    await store.export_rows(user_id, csv_sink(out), start=start, end=end, category=category)
+    if compress:
+        out.close()
+    filename = f"{user_id}_export.csv" + (".gz" if compress else "")
+    sender.submit(
+        message.answer_document(BufferedInputFile(buf.getvalue(), filename=filename), caption="📁 CSV экспорт"),
+        message.chat.id,
+    )
 
 @router.message(Command("export"))
-async def export_csv(message: Message):
-    os.makedirs("exports", exist_ok=True)
-    path = f"exports/{message.from_user.id}_export.csv"
-    with closing(db()) as conn:
-        rows = conn.execute(
-            "SELECT amount, category, created_at FROM expenses WHERE user_id=? ORDER BY created_at DESC",
-            (message.from_user.id,),
-        ).fetchall()
-    with open(path, "w", encoding="utf-8") as f:
-        f.write("amount;category;created_at\n")
-        for r in rows:
-            f.write(f"{r['amount']};{r['category']};{r['created_at']}\n")
-    await message.answer_document(FSInputFile(path), caption="📁 CSV экспорт")
+async def export_csv(message: Message, command: CommandObject):
+    await send_export(message, message.from_user.id, command.args or "")
+
+# ---------- Импорт ----------
+IMPORT_MAX_BYTES = 20 * 1024 * 1024  # больше Bot API скачать не даст
+IMPORT_USAGE = (
+    "📥 <b>Импорт CSV</b>\n\n"
+    "Пришли файл .csv (или .csv.gz) в формате /export:\n"
+    "<code>amount;category;created_at</code>\n"
+    "<code>390;Кофе;2024-01-31 09:15</code>\n\n"
+    "Повторная загрузка того же файла ничего не задвоит."
+)
+IMPORT_REASONS = {"amount": "сумма", "category": "категория", "date": "дата", "format": "формат"}
+
+# принимаем и «сырое» имя категории, и подпись с кнопки, без учёта регистра
+def import_categories() -> dict:
+    lookup = {label.casefold(): raw for label, raw in CATEGORY_OPTIONS}
+    lookup.update({raw.casefold(): raw for raw in RAW_CATEGORIES})
+    return lookup
+
+def format_import_report(report: importer.ImportReport) -> str:
+    lines = [
+        "📥 <b>Импорт завершён</b>\n",
+        f"Добавлено: <b>{report.added}</b>",
+        f"Уже были записаны: {report.duplicates}",
+    ]
+    rejected = sum(report.rejected.values())
+    if rejected:
+        reasons = ", ".join(f"{IMPORT_REASONS.get(k, k)}: {n}" for k, n in report.rejected.most_common())
+        lines.append(f"Отклонено: {rejected} ({reasons})")
+        examples = ", ".join(
+            f"{line} ({IMPORT_REASONS.get(r, r)})" if line else IMPORT_REASONS.get(r, r)
+            for line, r in report.examples
+        )
+        lines.append(f"Например, строки: {examples}")
+    return "\n".join(lines)
+
+@router.message(F.document)
+async def import_document(message: Message):
+    doc = message.document
+    name = (doc.file_name or "").lower()
+    if not name.endswith((".csv", ".csv.gz")):
+        reply(message, IMPORT_USAGE, parse_mode="HTML")
+        return
+    if doc.file_size and doc.file_size > IMPORT_MAX_BYTES:
+        reply(message, "Файл больше 20 МБ — раздели его на части или сожми в .csv.gz")
+        return
+    # небольшие файлы остаются в памяти, большие уходят во временный файл
+    with tempfile.SpooledTemporaryFile(max_size=1 << 20) as tmp:
+        await message.bot.download(doc, destination=tmp)
+        report = await importer.import_csv(
+            store, message.from_user.id, tmp, import_categories(), LOCAL_TZ,
+            compressed=name.endswith(".gz"),
+        )
+    reply(message, format_import_report(report), parse_mode="HTML")
 
 # ---------- Команды с ретраями ----------
 async def set_commands_with_retry(bot: Bot):
@@ -563,7 +1147,9 @@ async def set_commands_with_retry(bot: Bot):
         BotCommand(command="stats", description="Статистика"),
         BotCommand(command="export", description="Экспорт CSV"),
         BotCommand(command="undo", description="Отменить последнюю трату"),
+        BotCommand(command="redo", description="Вернуть отменённую трату"),
         BotCommand(command="me", description="Мой профиль 🦩"),
+        BotCommand(command="digest", description="Сводка по расписанию"),
         BotCommand(command="start", description="Старт"),
     ]
     for attempt in range(3):
@@ -577,14 +1163,161 @@ async def set_commands_with_retry(bot: Bot):
     print("[set_my_commands] gave up after retries; continue without crashing")
 
 # ---------- Точка входа ----------
-async def main():
-    init_db()
-    bot = Bot(BOT_TOKEN)
-    await set_commands_with_retry(bot)
-    dp = Dispatcher(storage=MemoryStorage())
+def make_bot() -> Bot:
+    if BOT_API_SERVER:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(BOT_API_SERVER))
+        bot = Bot(BOT_TOKEN, session=session)
+    else:
+        bot = Bot(BOT_TOKEN)
+    if metrics.ENABLED:
+        bot.session.middleware(metrics.RequestTimer())
+    return bot
+
+# апдейты одного чата обрабатываются по очереди (они и так приходят
+# в один процесс), иначе двойное нажатие успевает прочитать уже очищенную сумму
+def build_dispatcher() -> Dispatcher:
+    dp = Dispatcher(storage=fsm_storage, events_isolation=SimpleEventIsolation())
+    dp.update.outer_middleware(lifecycle.middleware())
+    if metrics.ENABLED:
+        router.message.middleware(metrics.HandlerTimer())
     dp.include_router(router)
-    print("Bot is running ✨")
-    await dp.start_polling(bot)
+    return dp
+
+async def start_metrics(port: int):
+    if not metrics.ENABLED:
+        return None
+    return await metrics.serve(METRICS_HOST, port)
+
+async def register_webhook(bot: Bot, dp: Dispatcher):
+    if not WEBHOOK_URL:
+        return
+    await bot.set_webhook(
+        WEBHOOK_URL,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    print(f"[webhook] registered {WEBHOOK_URL}")
+
+# ---------- Жизненный цикл ----------
+# Всё, без чего можно принимать апдейты, греется в фоне после старта
+async def warm_up(bot: Bot, register: bool):
+    started = asyncio.get_running_loop().time()
+    if not KEYBOARDS.built:
+        KEYBOARDS.rebuild()
+    primed = await store.warm_up(WARMUP_PROFILES)
+    print(f"[lifecycle] warm-up: {primed} profiles in {asyncio.get_running_loop().time() - started:.2f}s")
+    if register:
+        await set_commands_with_retry(bot)
+
+# Апдейты уже не принимаются: дождаться хэндлеров, остановить фоновые
+# задачи (им нужна база) и отправить исходящее в пределах общего дедлайна
+async def drain():
+    await lifecycle.drain()
+    await retention.stop()
+    await digests.stop()
+    await snapshots.stop()
+    await sender.stop(timeout=lifecycle.remaining())
+
+# очередь записи дописывается в store.close(); база закрывается последней
+async def close_resources(metrics_runner):
+    await fsm_storage.close()
+    await store.close()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+
+async def run_polling():
+    await store.open()
+    fsm_storage.start()
+    metrics_runner = await start_metrics(METRICS_PORT)
+    bot = make_bot()
+    sender.start(bot)
+    digests.start()
+    if RETENTION_DAYS:
+        retention.start()
+    if ADMIN_IDS:
+        snapshots.start()
+    dp = build_dispatcher()
+    stop_on_signal = asyncio.create_task(stop_polling_on_signal(dp))
+    try:
+        lifecycle.ready()
+        lifecycle.background(warm_up(bot, register=True), "warm-up")
+        print("Bot is running ✨")
+        # сигналы ловим сами: aiogram при остановке не ждёт запущенные хэндлеры
+        await dp.start_polling(bot, handle_signals=False, close_bot_session=False)
+    finally:
+        stop_on_signal.cancel()
+        await drain()
+        await bot.session.close()
+        await close_resources(metrics_runner)
+
+async def stop_polling_on_signal(dp: Dispatcher):
+    await webhook.wait_for_signal()
+    print("[lifecycle] stop signal, no new updates")
+    await dp.stop_polling()
+
+# Один процесс: сервер сам кормит Dispatcher. secret — токен, который
+# проверяется в заголовке X-Telegram-Bot-Api-Secret-Token.
+# run_digests=False у воркеров, кроме первого: рассылку, архивацию и снимки ведёт один процесс
+async def run_webhook_server(
+    host: str, port: int, secret: str, register: bool = True,
+    metrics_port: int = METRICS_PORT, run_digests: bool = True,
+):
+    await store.open()
+    fsm_storage.start()
+    metrics_runner = await start_metrics(metrics_port)
+    bot = make_bot()
+    sender.start(bot)
+    if run_digests:
+        digests.start()
+        if RETENTION_DAYS:
+            retention.start()
+        # в остальных воркерах снимок снимается только по запросу
+        if ADMIN_IDS:
+            snapshots.start()
+    try:
+        dp = build_dispatcher()
+        if register:
+            await register_webhook(bot, dp)
+        lifecycle.ready()
+        lifecycle.background(warm_up(bot, register=register), "warm-up")
+        print("Bot is running ✨ (webhook)")
+        await webhook.serve(webhook.build_app(dp, bot, WEBHOOK_PATH, secret), host, port, on_stop=drain)
+    finally:
+        # без сигнала (ошибка старта сервера) drain ещё не выполнялся
+        if not lifecycle.stopping:
+            await drain()
+        await close_resources(metrics_runner)
+        await bot.session.close()
+
+def webhook_worker(index: int, port: int, internal_secret: str):
+    print(f"[webhook] worker {index} on port {port}")
+    asyncio.run(run_webhook_server(
+        "127.0.0.1", port, internal_secret, register=False,
+        metrics_port=METRICS_PORT + index, run_digests=index == 0,
+    ))
+
+async def run_webhook():
+    if WEBHOOK_WORKERS <= 1:
+        await run_webhook_server(WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET)
+        return
+    bot = make_bot()
+    # команды регистрируются параллельно с запуском фронта и воркеров
+    commands = asyncio.create_task(set_commands_with_retry(bot))
+    try:
+        await register_webhook(bot, build_dispatcher())
+        await webhook.serve_front(
+            WEBHOOK_WORKERS, webhook_worker, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET
+        )
+    finally:
+        commands.cancel()
+        await asyncio.gather(commands, return_exceptions=True)
+        await bot.session.close()
+
+async def main():
+    if BOT_MODE == "webhook":
+        await run_webhook()
+    else:
+        await run_polling()
 
 if __name__ == "__main__":
     asyncio.run(main())
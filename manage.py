@@ -0,0 +1,225 @@
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+import archive
+import rollup
+import snapshot
+from migrations import migrate
+from sharding import fsm_user_id, shard_index, shard_paths
+
+
+# ---------- Служебные команды ----------
+# python manage.py rollup-verify   — сверить daily_totals с сырыми тратами
+# python manage.py rollup-rebuild  — пересчитать daily_totals с нуля
+# python manage.py reshard --to N  — разложить базу по N шардам
+# python manage.py vacuum          — включить incremental auto_vacuum (полный VACUUM)
+# python manage.py report          — отчёт по всем пользователям по копии базы
+# --shards (или DB_SHARDS) — текущая раскладка, как у бота
+def connect(path: str, args) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    migrate(conn, args.tz_offset * 3600)
+    return conn
+
+
+def cmd_rollup_verify(args) -> int:
+    failed = False
+    for path in shard_paths(args.db, args.shards):
+        conn = connect(path, args)
+        drift = rollup.verify(conn, args.tz_offset * 3600)
+        for user_id, day, category, expected, actual in drift[: args.limit]:
+            print(f"user={user_id} day={day} category={category} expected={expected} rollup={actual}")
+        if len(drift) > args.limit:
+            print(f"… and {len(drift) - args.limit} more")
+        print(f"[rollup-verify] {path}: drift rows: {len(drift)}")
+        if drift and args.fix:
+            users = sorted({d[0] for d in drift})
+            rollup.rebuild(conn, args.tz_offset * 3600, users)
+            print(f"[rollup-verify] {path}: rebuilt {len(users)} users")
+        failed = failed or bool(drift and not args.fix)
+        conn.close()
+    return 1 if failed else 0
+
+
+def cmd_rollup_rebuild(args) -> int:
+    for path in shard_paths(args.db, args.shards):
+        conn = connect(path, args)
+        users = rollup.rebuild(conn, args.tz_offset * 3600)
+        print(f"[rollup-rebuild] {path}: rebuilt {users} users")
+        conn.close()
+    return 0
+
+
+# Таблицы, которые переезжают вместе с пользователем: (таблица, колонки,
+# выражение для user_id). Траты копируются без id в порядке старых id —
+# у пользователя ровно один исходный шард, так что порядок для «отмены
+# последней» сохраняется, а новые id не пересекаются внутри целевого файла.
+# Журнал отмен и сбросов (journal, expenses_deleted) не переносится: он
+# ссылается на старые id трат, так что после reshard /redo и возврат сброса
+# начинаются с чистого листа.
+RESHARD_TABLES = [
+    ("expenses", "user_id, amount, category, created_at, created_ts", "user_id"),
+    ("daily_totals", "user_id, day, category, sum, count", "user_id"),
+    ("user_stats", "*", "user_id"),
+    ("subscriptions", "*", "user_id"),
+    ("fsm", "*", "fsm_user(key)"),
+    ("monthly_totals", "*", "user_id"),
+    ("monthly_days", "*", "user_id"),
+    ("archive_index", "*", "user_id"),
+]
+
+
+# Бот должен быть остановлен. Исходные файлы не трогаются: новые шарды
+# пишутся во временные файлы и переименовываются только после сверки
+# числа строк, так что прерванный reshard можно просто запустить заново.
+def cmd_reshard(args) -> int:
+    sources = shard_paths(args.db, args.shards)
+    targets = shard_paths(args.db, args.to)
+    missing = [p for p in sources if not os.path.exists(p)]
+    if missing:
+        print(f"[reshard] source not found: {', '.join(missing)}")
+        return 1
+    if set(sources) & set(targets):
+        print("[reshard] source and target layouts are the same")
+        return 1
+    existing = [p for t in targets for p in (t, archive.archive_path(t)) if os.path.exists(p)]
+    if existing:
+        print(f"[reshard] target already exists: {', '.join(existing)}")
+        return 1
+    for path in sources:
+        connect(path, args).close()
+
+    expected = {}
+    for path in sources:
+        conn = sqlite3.connect(path)
+        for table, _, _ in RESHARD_TABLES:
+            expected[table] = expected.get(table, 0) + conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        conn.execute("ATTACH DATABASE ? AS archive", (archive.archive_path(path),))
+        archive.init(conn)
+        expected["archive.chunks"] = (
+            expected.get("archive.chunks", 0) + conn.execute("SELECT COUNT(*) FROM archive.chunks").fetchone()[0]
+        )
+        conn.close()
+
+    copied = {table: 0 for table in expected}
+    for index, target in enumerate(targets):
+        tmp, tmp_archive = target + ".tmp", archive.archive_path(target) + ".tmp"
+        for path in (tmp, tmp_archive):
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+        conn = sqlite3.connect(tmp)
+        migrate(conn, args.tz_offset * 3600)
+        conn.execute("ATTACH DATABASE ? AS archive", (tmp_archive,))
+        archive.init(conn)
+        conn.create_function("shard_of", 1, lambda uid: shard_index(uid, args.to), deterministic=True)
+        conn.create_function("fsm_user", 1, fsm_user_id, deterministic=True)
+        for source_no, source in enumerate(sources):
+            conn.execute("ATTACH DATABASE ? AS src", (source,))
+            with conn:
+                for table, cols, user_expr in RESHARD_TABLES:
+                    order = " ORDER BY id" if table == "expenses" else ""
+                    into = f"main.{table}" if cols == "*" else f"main.{table}({cols})"
+                    n = conn.execute(
+                        f"INSERT INTO {into} SELECT {cols} FROM src.{table} "
+                        f"WHERE shard_of({user_expr})=?{order}",
+                        (index,),
+                    ).rowcount
+                    copied[table] += n
+                if index == 0:
+                    conn.execute("INSERT OR IGNORE INTO main.digest_runs SELECT * FROM src.digest_runs")
+            conn.execute("DETACH DATABASE src")
+            conn.execute("ATTACH DATABASE ? AS src", (archive.archive_path(source),))
+            with conn:
+                copied["archive.chunks"] += conn.execute(
+                    "INSERT INTO archive.chunks SELECT * FROM src.chunks WHERE shard_of(user_id)=?", (index,)
+                ).rowcount
+            conn.execute("DETACH DATABASE src")
+            print(f"[reshard] {source} -> {target} ({source_no + 1}/{len(sources)})")
+        conn.close()
+
+    mismatch = {t: (expected[t], copied[t]) for t in expected if expected[t] != copied[t]}
+    if mismatch:
+        for table, (want, got) in mismatch.items():
+            print(f"[reshard] {table}: {want} rows in source, {got} copied")
+        print("[reshard] aborted, temporary files left for inspection")
+        return 1
+    for target in targets:
+        os.replace(target + ".tmp", target)
+        os.replace(archive.archive_path(target) + ".tmp", archive.archive_path(target))
+    for table, n in copied.items():
+        print(f"[reshard] {table}: {n} rows")
+    print(f"[reshard] {len(sources)} -> {len(targets)} shards done; "
+          f"set DB_SHARDS={args.to} and remove the old files once the bot is healthy")
+    return 0
+
+
+# Перевод существующей базы на auto_vacuum=INCREMENTAL требует одного полного
+# VACUUM (файл переписывается целиком, бот должен быть остановлен). Дальше
+# место после архивации возвращает фоновая задача хранения небольшими срезами.
+def cmd_vacuum(args) -> int:
+    for path in shard_paths(args.db, args.shards):
+        conn = connect(path, args)
+        if archive.auto_vacuum_incremental(conn):
+            freed = archive.incremental_vacuum(conn, 1 << 30)
+            print(f"[vacuum] {path}: already incremental, freed {freed} pages")
+        else:
+            before = os.path.getsize(path)
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+            print(f"[vacuum] {path}: {before} -> {os.path.getsize(path)} bytes, auto_vacuum=INCREMENTAL")
+        conn.close()
+    return 0
+
+
+# Можно запускать при работающем боте: читается копия (backup API), а не сам файл
+def cmd_report(args) -> int:
+    sources = shard_paths(args.db, args.shards)
+    missing = [p for p in sources if not os.path.exists(p)]
+    if missing:
+        print(f"[report] not found: {', '.join(missing)}")
+        return 1
+    started = time.time()
+    report = snapshot.build_all(sources, args.tz_offset * 3600, args.snapshot_dir)
+    print(snapshot.format_report(report, started, time.time() - started))
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description="Flamingo Money maintenance")
+    p.add_argument("--db", default=os.getenv("DB_PATH", "finances.db"))
+    # должен совпадать с LOCAL_TZ в main.py
+    p.add_argument("--tz-offset", type=int, default=0, help="UTC offset in hours")
+    p.add_argument("--shards", type=int, default=int(os.getenv("DB_SHARDS", "1")),
+                   help="current number of shards (DB_SHARDS)")
+    sub = p.add_subparsers(dest="command", required=True)
+
+    s = sub.add_parser("rollup-verify", help="compare daily_totals with raw expenses")
+    s.add_argument("--limit", type=int, default=50, help="max drift rows to print")
+    s.add_argument("--fix", action="store_true", help="rebuild users with drift")
+    s.set_defaults(func=cmd_rollup_verify)
+
+    s = sub.add_parser("rollup-rebuild", help="recompute daily_totals from raw expenses")
+    s.set_defaults(func=cmd_rollup_rebuild)
+
+    s = sub.add_parser("reshard", help="split or rebalance the database into N shard files")
+    s.add_argument("--to", type=int, required=True, help="target number of shards (1 = single file)")
+    s.set_defaults(func=cmd_reshard)
+
+    s = sub.add_parser("vacuum", help="switch to incremental auto_vacuum and compact the file")
+    s.set_defaults(func=cmd_vacuum)
+
+    s = sub.add_parser("report", help="cross-user report from a consistent snapshot")
+    s.add_argument("--snapshot-dir", default=os.getenv("SNAPSHOT_DIR") or None,
+                   help="keep the snapshot as a file here instead of in memory")
+    s.set_defaults(func=cmd_report)
+    return p
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    sys.exit(args.func(args))
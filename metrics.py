@@ -0,0 +1,308 @@
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+
+# ---------- Метрики ----------
+# Гистограммы в памяти процесса и их выдача в текстовом формате Prometheus
+# на локальном порту. Замер — два perf_counter и инкремент под мьютексом,
+# поэтому сбор можно держать включённым под полной нагрузкой. Включается
+# через configure(): без него мидлвари не ставятся, а соединения SQLite
+# открываются обычные, без обёртки.
+ENABLED = False
+SLOW_QUERY_SECONDS: Optional[float] = None
+
+# секунды; хвост до 10 с нужен для выгрузок и Bot API
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def configure(enabled: bool, slow_query_ms: Optional[float] = None):
+    global ENABLED, SLOW_QUERY_SECONDS
+    ENABLED = enabled
+    SLOW_QUERY_SECONDS = slow_query_ms / 1000 if slow_query_ms else None
+
+
+def timing_enabled() -> bool:
+    return ENABLED or SLOW_QUERY_SECONDS is not None
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    def __init__(self, name: str, doc: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # значения меток -> [счётчики по корзинам (+Inf последней), сумма, количество]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(k, list(v[0]), v[1], v[2]) for k, v in self._series.items()]
+        for labels, counts, total, count in sorted(snapshot):
+            acc = 0
+            for bound, n in zip(self.buckets, counts):
+                acc += n
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {acc}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, doc: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, labels: Tuple[str, ...] = (), value: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            snapshot = sorted(self._values.items())
+        for labels, value in snapshot:
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+# значение снимается в момент выдачи (глубина очереди, размеры кэшей);
+# None — значения ещё нет, и метрика не выдаётся
+class Gauge:
+    def __init__(self, name: str, doc: str, read: Callable[[], float]):
+        self.name = name
+        self.doc = doc
+        self.read = read
+
+    def render(self) -> List[str]:
+        try:
+            value = self.read()
+        except Exception:
+            return []
+        if value is None:
+            return []
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+
+REGISTRY: List[Any] = []
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+HANDLER_SECONDS = register(Histogram("finbot_handler_seconds", "Handler wall time", ("handler",)))
+HANDLER_ERRORS = register(Counter("finbot_handler_errors_total", "Handlers that raised", ("handler",)))
+QUERY_SECONDS = register(Histogram("finbot_db_query_seconds", "SQL statement time", ("query",)))
+SLOW_QUERIES = register(Counter("finbot_db_slow_queries_total", "Statements over the slow threshold", ("query",)))
+API_SECONDS = register(Histogram("finbot_bot_api_seconds", "Bot API request time", ("method",)))
+API_ERRORS = register(Counter("finbot_bot_api_errors_total", "Failed Bot API requests", ("method",)))
+
+
+# ---------- Хэндлеры ----------
+# Внутренняя мидлварь роутера: к моменту вызова фильтры уже прошли,
+# и в data["handler"] лежит выбранный хэндлер.
+class HandlerTimer(BaseMiddleware):
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        obj = data.get("handler")
+        name = getattr(getattr(obj, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc((name,))
+            raise
+        finally:
+            HANDLER_SECONDS.observe((name,), time.perf_counter() - started)
+
+
+# ---------- Bot API ----------
+class RequestTimer(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        name = method.__api_method__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            API_ERRORS.inc((name,))
+            raise
+        finally:
+            API_SECONDS.observe((name,), time.perf_counter() - started)
+
+
+# ---------- SQL ----------
+# Имя запроса — операция Storage, в которой он выполняется, плюс глагол и
+# таблица: "fetch_stats:select daily_totals". Так метки не зависят от
+# параметров, а разбор текста SQL кэшируется по строке запроса.
+_SQL_TABLE = re.compile(r"\b(?:from|into|update|table|on)\s+(?:if\s+not\s+exists\s+)?([A-Za-z_]\w*)", re.I)
+_sql_names: Dict[str, str] = {}
+_op = threading.local()
+
+
+def set_operation(name: str):
+    _op.name = name
+
+
+def query_name(sql: str) -> str:
+    name = _sql_names.get(sql)
+    if name is None:
+        words = sql.split(None, 1)
+        verb = words[0].lower() if words else "?"
+        table = _SQL_TABLE.search(sql)
+        name = f"{verb} {table.group(1)}" if table else verb
+        if len(_sql_names) < 10000:
+            _sql_names[sql] = name
+    return name
+
+
+def _observe_query(sql: str, elapsed: float):
+    name = f"{getattr(_op, 'name', '-')}:{query_name(sql)}"
+    if ENABLED:
+        QUERY_SECONDS.observe((name,), elapsed)
+    if SLOW_QUERY_SECONDS is not None and elapsed >= SLOW_QUERY_SECONDS:
+        SLOW_QUERIES.inc((name,))
+        print(f"[db] slow query {elapsed * 1000:.1f}ms {name}: {' '.join(sql.split())[:200]}")
+
+
+# Курсор, который замеряет запрос целиком: шаг выполнения плюс все выборки
+# строк (fetch*, итерация). Замер пишется один раз, когда запрос закончен —
+# строки кончились, курсор выполняет следующий запрос, закрыт или собран.
+class TimedCursor(sqlite3.Cursor):
+    _sql: Optional[str] = None
+    _elapsed = 0.0
+
+    def _finish(self):
+        if self._sql is not None:
+            sql, self._sql = self._sql, None
+            _observe_query(sql, self._elapsed)
+
+    def _run(self, method, sql, args):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            return method(sql, *args)
+        finally:
+            self._sql, self._elapsed = sql, time.perf_counter() - started
+            # без строк результата (INSERT, DELETE без RETURNING) запрос уже закончен
+            if self.description is None:
+                self._finish()
+
+    def execute(self, sql, *args):
+        return self._run(super().execute, sql, args)
+
+    def executemany(self, sql, *args):
+        return self._run(super().executemany, sql, args)
+
+    def _fetch(self, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self._elapsed += time.perf_counter() - started
+
+    def fetchone(self):
+        row = self._fetch(super().fetchone)
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._fetch(super().fetchmany, *args)
+        if not rows:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._fetch(super().fetchall)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        try:
+            return self._fetch(super().__next__)
+        except StopIteration:
+            self._finish()
+            raise
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        self._finish()
+
+
+# Соединение с замеряемыми курсорами. Connection.execute создаёт курсор
+# внутри C-кода, минуя cursor(), поэтому execute/executemany переопределены.
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, *args):
+        return self.cursor().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        return self.cursor().executemany(sql, *args)
+
+
+# ---------- HTTP ----------
+async def serve(host: str, port: int) -> web.AppRunner:
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"[metrics] http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,211 @@
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Tuple
+
+import rollup
+
+# Размер пачки для фоновых переносов данных: каждая пачка — отдельная
+# короткая транзакция, чтобы не держать блокировку записи на всю миграцию.
+BATCH_SIZE = 5000
+
+
+# ---------- Миграции ----------
+def m001_expenses(conn: sqlite3.Connection):
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS expenses("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        "user_id INTEGER, amount REAL, category TEXT, created_at TEXT)"
+    )
+
+
+def m002_created_ts_column(conn: sqlite3.Connection):
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(expenses)")}
+    if "created_ts" not in cols:
+        conn.execute("ALTER TABLE expenses ADD COLUMN created_ts INTEGER")
+
+
+# Наивные даты старых записей — локальное время бота (tz_offset), а не
+# часовой пояс хоста. Нечитаемые created_at пропускаются с записью в лог:
+# created_ts у них остаётся NULL, и в агрегаты они не попадают.
+def m003_backfill_created_ts(conn: sqlite3.Connection, tz_offset: int):
+    last_id = 0
+    skipped, examples = 0, []
+    while True:
+        with conn:
+            rows = conn.execute(
+                "SELECT id, created_at FROM expenses "
+                "WHERE id>? AND created_ts IS NULL ORDER BY id LIMIT ?",
+                (last_id, BATCH_SIZE),
+            ).fetchall()
+            if not rows:
+                break
+            updates = []
+            for expense_id, created_at in rows:
+                try:
+                    updates.append((iso_to_ts(created_at, tz_offset), expense_id))
+                except (TypeError, ValueError):
+                    skipped += 1
+                    if len(examples) < 10:
+                        examples.append(expense_id)
+            conn.executemany("UPDATE expenses SET created_ts=? WHERE id=?", updates)
+        last_id = rows[-1][0]
+    if skipped:
+        print(f"[migrate] 003: skipped {skipped} rows with unreadable created_at, e.g. ids {examples}")
+
+
+def m004_user_ts_index(conn: sqlite3.Connection):
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_expenses_user_ts "
+        "ON expenses(user_id, created_ts, category, amount)"
+    )
+
+
+def m005_daily_totals(conn: sqlite3.Connection):
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS daily_totals("
+        "user_id INTEGER NOT NULL, day INTEGER NOT NULL, category TEXT NOT NULL,"
+        "sum REAL NOT NULL, count INTEGER NOT NULL,"
+        "PRIMARY KEY(user_id, day, category)) WITHOUT ROWID"
+    )
+
+
+def m006_backfill_daily_totals(conn: sqlite3.Connection, tz_offset: int):
+    rollup.rebuild(conn, tz_offset, with_user_stats=False)
+
+
+def m007_user_stats(conn: sqlite3.Connection):
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS user_stats("
+        "user_id INTEGER PRIMARY KEY, days_total INTEGER NOT NULL,"
+        "last_day INTEGER NOT NULL, streak INTEGER NOT NULL)"
+    )
+
+
+def m008_backfill_user_stats(conn: sqlite3.Connection, tz_offset: int):
+    rollup.rebuild_user_stats(conn)
+
+
+def m009_fsm(conn: sqlite3.Connection):
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS fsm("
+        "key TEXT PRIMARY KEY, state TEXT, data TEXT, updated_ts INTEGER NOT NULL)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_fsm_updated ON fsm(updated_ts)")
+
+
+def m010_digests(conn: sqlite3.Connection):
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS subscriptions("
+        "user_id INTEGER PRIMARY KEY, chat_id INTEGER NOT NULL, "
+        "period TEXT NOT NULL, created_ts INTEGER NOT NULL)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_subscriptions_period ON subscriptions(period, user_id)")
+    # чекпоинт рассылки: до какого user_id всё уже отправлено
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS digest_runs("
+        "run_id TEXT PRIMARY KEY, period TEXT NOT NULL, started_ts INTEGER NOT NULL, "
+        "last_user_id INTEGER NOT NULL DEFAULT 0, sent INTEGER NOT NULL DEFAULT 0, "
+        "failed INTEGER NOT NULL DEFAULT 0, finished_ts INTEGER)"
+    )
+
+
+# Старые месяцы: суммы по категориям, битовая маска дней с тратами
+# (для счётчиков дней и серий) и список пачек сырых трат в архивном файле
+def m011_retention(conn: sqlite3.Connection):
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS monthly_totals("
+        "user_id INTEGER NOT NULL, month INTEGER NOT NULL, category TEXT NOT NULL,"
+        "sum REAL NOT NULL, count INTEGER NOT NULL,"
+        "PRIMARY KEY(user_id, month, category)) WITHOUT ROWID"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS monthly_days("
+        "user_id INTEGER NOT NULL, month INTEGER NOT NULL, mask INTEGER NOT NULL,"
+        "PRIMARY KEY(user_id, month)) WITHOUT ROWID"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS archive_index("
+        "user_id INTEGER NOT NULL, month INTEGER NOT NULL, seq INTEGER NOT NULL, rows INTEGER NOT NULL,"
+        "PRIMARY KEY(user_id, month, seq)) WITHOUT ROWID"
+    )
+
+
+# Журнал отмен и сбросов (см. journal.py): удалённые траты лежат в
+# expenses_deleted до истечения окна; индекс (user_id, id) — последняя трата
+def m012_journal(conn: sqlite3.Connection):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_expenses_user_id ON expenses(user_id, id)")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS journal("
+        "id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, op TEXT NOT NULL,"
+        "ts INTEGER NOT NULL, payload BLOB)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_journal_user ON journal(user_id, op, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_journal_ts ON journal(ts)")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS expenses_deleted("
+        "journal_id INTEGER NOT NULL, id INTEGER NOT NULL, user_id INTEGER NOT NULL,"
+        "amount REAL, category TEXT, created_at TEXT, created_ts INTEGER,"
+        "PRIMARY KEY(journal_id, id)) WITHOUT ROWID"
+    )
+
+
+# (версия, название, функция, пачечная ли). Пачечные миграции сами управляют
+# транзакциями и получают сдвиг часового пояса (нужен для номера дня).
+MIGRATIONS: List[Tuple[int, str, Callable, bool]] = [
+    (1, "expenses table", m001_expenses, False),
+    (2, "expenses.created_ts column", m002_created_ts_column, False),
+    (3, "backfill expenses.created_ts", m003_backfill_created_ts, True),
+    (4, "index expenses(user_id, created_ts, category, amount)", m004_user_ts_index, False),
+    (5, "daily_totals rollup table", m005_daily_totals, False),
+    (6, "backfill daily_totals", m006_backfill_daily_totals, True),
+    (7, "user_stats day counters", m007_user_stats, False),
+    (8, "backfill user_stats", m008_backfill_user_stats, True),
+    (9, "fsm state table", m009_fsm, False),
+    (10, "digest subscriptions and runs", m010_digests, False),
+    (11, "monthly rollup and archive index", m011_retention, False),
+    (12, "undo/reset journal", m012_journal, False),
+]
+
+
+def iso_to_ts(value: str, tz_offset: int = 0) -> int:
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone(timedelta(seconds=tz_offset)))
+    return int(dt.timestamp())
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def migrate(conn: sqlite3.Connection, tz_offset: int = 0):
+    with conn:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS schema_version("
+            "version INTEGER PRIMARY KEY, name TEXT, applied_at INTEGER)"
+        )
+    version = current_version(conn)
+    for num, name, fn, batched in MIGRATIONS:
+        if num <= version:
+            continue
+        started = time.monotonic()
+        if batched:
+            # пачечные миграции идемпотентны и коммитят сами, а версия
+            # фиксируется только после полного прохода — рестарт посередине
+            # просто продолжит с того места, где остановились
+            fn(conn, tz_offset)
+            with conn:
+                conn.execute(
+                    "INSERT INTO schema_version(version, name, applied_at) VALUES (?,?,?)",
+                    (num, name, int(time.time())),
+                )
+        else:
+            with conn:
+                fn(conn)
+                conn.execute(
+                    "INSERT INTO schema_version(version, name, applied_at) VALUES (?,?,?)",
+                    (num, name, int(time.time())),
+                )
+        print(f"[migrate] {num:03d} {name} ({time.monotonic() - started:.2f}s)")
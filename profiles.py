@@ -0,0 +1,103 @@
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+
+# ---------- Кэш профилей /me ----------
+# Профиль собирается из daily_totals и user_stats одним запросом и кладётся
+# в ограниченный LRU. Запись на вставке обновляется на месте, отмена и сброс
+# просто выкидывают её. Повторный /me в тот же день — поиск в словаре.
+class ProfileEntry:
+    __slots__ = ("day", "by_category", "last30", "days_total", "last_day", "streak")
+
+    def __init__(self, day: int, by_category: Dict[str, float], last30: float,
+                 stats: Optional[Tuple[int, int, int]]):
+        self.day = day
+        self.by_category = by_category
+        self.last30 = last30
+        self.days_total, self.last_day, self.streak = stats or (0, 0, 0)
+
+    def as_dict(self) -> dict:
+        total = float(sum(self.by_category.values()))
+        top_category = max(self.by_category, key=self.by_category.get) if self.by_category else None
+        return {
+            "total": total,
+            "top_category": top_category,
+            "days_total": self.days_total,
+            # серия считается только если сегодня уже есть трата
+            "streak": self.streak if self.last_day == self.day else 0,
+            "avg_per_day": round(total / self.days_total, 2) if self.days_total else 0.0,
+            "avg_30": round(self.last30 / 30, 2),
+        }
+
+
+# maxsize=0 — кэш выключен: каждое чтение идёт в базу
+class ProfileCache:
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[int, ProfileEntry]" = OrderedDict()
+        # чтения, начатые до записи, не должны положить в кэш устаревший снимок:
+        # _pending — метка текущего чтения, _writing — число записей в полёте
+        self._pending: Dict[int, object] = {}
+        self._writing: Dict[int, int] = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, user_id: int, today: int) -> Optional[ProfileEntry]:
+        entry = self._entries.get(user_id)
+        if entry is None or entry.day != today:
+            return None
+        self._entries.move_to_end(user_id)
+        return entry
+
+    def begin_load(self, user_id: int) -> object:
+        token = object()
+        self._pending[user_id] = token
+        return token
+
+    def finish_load(self, user_id: int, token: object, entry: ProfileEntry):
+        if self._pending.get(user_id) is not token:
+            return
+        del self._pending[user_id]
+        if self._writing.get(user_id):
+            return
+        self._entries[user_id] = entry
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def write_started(self, user_id: int):
+        self._writing[user_id] = self._writing.get(user_id, 0) + 1
+        self._pending.pop(user_id, None)
+
+    def _write_finished(self, user_id: int):
+        self._pending.pop(user_id, None)
+        left = self._writing.get(user_id, 0) - 1
+        if left > 0:
+            self._writing[user_id] = left
+        else:
+            self._writing.pop(user_id, None)
+
+    # items — (day, category, amount) одной закоммиченной группы,
+    # stats — состояние user_stats после коммита
+    def added(self, user_id: int, items: Iterable[Tuple[int, str, float]],
+              stats: Optional[Tuple[int, int, int]]):
+        self._write_finished(user_id)
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return
+        if stats is None:
+            self._entries.pop(user_id, None)
+            return
+        for day, category, amount in items:
+            if day > entry.day:
+                self._entries.pop(user_id, None)
+                return
+            entry.by_category[category] = entry.by_category.get(category, 0.0) + amount
+            if day > entry.day - 30:
+                entry.last30 += amount
+        entry.days_total, entry.last_day, entry.streak = stats
+
+    def invalidate(self, user_id: int):
+        self._write_finished(user_id)
+        self._entries.pop(user_id, None)
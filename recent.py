@@ -0,0 +1,216 @@
+import sys
+from array import array
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# (id, day, category, amount) одной траты
+Item = Tuple[int, int, str, float]
+
+
+# ---------- Кэш недавних трат ----------
+# Для «Сегодня», «7 дней» и подсказки к /undo нужны только траты последних
+# дней. У активного пользователя они лежат в памяти: четыре параллельных
+# массива (id, день, сумма, код категории) — ~22 байта на трату вместо
+# кортежа из объектов. Инвариант записи: в ней есть все траты пользователя
+# с днём >= since_day (могут быть и более старые — они не мешают). Новые
+# траты дописываются в конец; сверх capacity старейшие выталкиваются, и
+# since_day сдвигается за их день — как в кольцевом буфере. Записи
+# вытесняются по LRU, когда сумма их размеров превышает max_bytes.
+# Загрузка и запись разводятся так же, как в ProfileCache. max_bytes=0 —
+# кэш выключен (enabled), и Storage читает базу напрямую.
+class RecentEntry:
+    __slots__ = ("since_day", "ids", "days", "amounts", "cats", "last", "nbytes")
+
+    def __init__(self, since_day: int):
+        self.since_day = since_day
+        self.ids = array("q")
+        self.days = array("l")
+        self.amounts = array("d")
+        self.cats = array("H")
+        # (id, amount, category) последней по id траты пользователя или None, если неизвестна
+        self.last: Optional[Tuple[int, float, str]] = None
+        self.nbytes = 0
+
+    def size(self) -> int:
+        return sys.getsizeof(self) + sum(sys.getsizeof(a) for a in (self.ids, self.days, self.amounts, self.cats))
+
+    def _keep(self, mask: List[bool]):
+        for name in ("ids", "days", "amounts", "cats"):
+            old = getattr(self, name)
+            setattr(self, name, array(old.typecode, (v for v, keep in zip(old, mask) if keep)))
+
+
+class RecentCache:
+    def __init__(self, max_bytes: int = 32 << 20, window_days: int = 7, capacity: int = 512):
+        self.max_bytes = max_bytes
+        self.window_days = window_days
+        self.capacity = capacity
+        self.nbytes = 0
+        self._entries: "OrderedDict[int, RecentEntry]" = OrderedDict()
+        self._pending: Dict[int, object] = {}
+        self._writing: Dict[int, int] = {}
+        # категории хранятся кодами: имя <-> номер
+        self._codes: Dict[str, int] = {}
+        self._names: List[str] = []
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _code(self, category: str) -> int:
+        code = self._codes.get(category)
+        if code is None:
+            code = self._codes[category] = len(self._names)
+            self._names.append(category)
+        return code
+
+    # первый день, который должен покрываться для today
+    def window_start(self, today: int) -> int:
+        return today - self.window_days + 1
+
+    # ---------- Чтение ----------
+    # Запись пользователя или None (тогда — загрузка из базы). Покрытие
+    # (since_day <= start_day) проверяет вызывающий: у пользователя с
+    # переполненной записью загрузка дала бы то же покрытие, так что такие
+    # окна идут в базу без перезагрузки. Раз в день запись подрезается под окно.
+    def get(self, user_id: int, start_day: int, today: int) -> Optional[RecentEntry]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        self._entries.move_to_end(user_id)
+        first = self.window_start(today)
+        if entry.since_day < first <= start_day:
+            entry._keep([d >= first for d in entry.days])
+            entry.since_day = first
+            self._resize(entry)
+        return entry
+
+    def totals(self, entry: RecentEntry, start_day: int, end_day: int) -> Dict[str, float]:
+        sums: Dict[int, float] = {}
+        for day, code, amount in zip(entry.days, entry.cats, entry.amounts):
+            if start_day <= day < end_day:
+                sums[code] = sums.get(code, 0.0) + amount
+        return {self._names[code]: s for code, s in sums.items()}
+
+    def items(self, entry: RecentEntry) -> List[Item]:
+        return [
+            (i, d, self._names[c], a) for i, d, c, a in zip(entry.ids, entry.days, entry.cats, entry.amounts)
+        ]
+
+    # ---------- Загрузка ----------
+    def begin_load(self, user_id: int) -> object:
+        token = object()
+        self._pending[user_id] = token
+        return token
+
+    # items — траты с днём >= since_day по возрастанию id; last — последняя трата вообще
+    def finish_load(self, user_id: int, token: object, since_day: int, items: Iterable[Item],
+                    last: Optional[Tuple[int, float, str]]) -> Optional[RecentEntry]:
+        entry = RecentEntry(since_day)
+        entry.last = last
+        for expense_id, day, category, amount in items:
+            self._append(entry, expense_id, day, category, amount)
+        if self._pending.get(user_id) is not token:
+            return entry
+        del self._pending[user_id]
+        if not self.enabled:
+            return entry
+        if self._writing.get(user_id):
+            return entry
+        self._drop(user_id)
+        self._entries[user_id] = entry
+        self._resize(entry)
+        return entry
+
+    # ---------- Запись ----------
+    def write_started(self, user_id: int):
+        self._writing[user_id] = self._writing.get(user_id, 0) + 1
+        self._pending.pop(user_id, None)
+
+    def _write_finished(self, user_id: int):
+        self._pending.pop(user_id, None)
+        left = self._writing.get(user_id, 0) - 1
+        if left > 0:
+            self._writing[user_id] = left
+        else:
+            self._writing.pop(user_id, None)
+
+    # закоммиченные траты; их id больше любого живого (AUTOINCREMENT, а /redo
+    # возвращает трату, только пока новее неё ничего нет), так что последняя
+    # из них — последняя трата пользователя
+    def added(self, user_id: int, items: Iterable[Item]):
+        self._write_finished(user_id)
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return
+        for expense_id, day, category, amount in items:
+            if entry.last is None or expense_id > entry.last[0]:
+                entry.last = (expense_id, amount, category)
+            if day >= entry.since_day:
+                self._append(entry, expense_id, day, category, amount)
+        self._resize(entry)
+
+    # трата удалена (отмена); None — удалять было нечего
+    def removed(self, user_id: int, expense_id: Optional[int]):
+        self._write_finished(user_id)
+        entry = self._entries.get(user_id)
+        if entry is None or expense_id is None:
+            return
+        for i in range(len(entry.ids) - 1, -1, -1):
+            if entry.ids[i] == expense_id:
+                for a in (entry.ids, entry.days, entry.amounts, entry.cats):
+                    del a[i]
+                break
+        # предыдущая трата могла быть задним числом и не попасть в запись
+        entry.last = None
+        self._resize(entry)
+
+    # все траты пользователя удалены
+    def cleared(self, user_id: int):
+        self._write_finished(user_id)
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return
+        fresh = RecentEntry(entry.since_day)
+        self._drop(user_id)
+        self._entries[user_id] = fresh
+        self._resize(fresh)
+
+    def invalidate(self, user_id: int):
+        self._write_finished(user_id)
+        self._drop(user_id)
+
+    # выбросить запись вне записи в базу (сверка нашла расхождение)
+    def discard(self, user_id: int):
+        self._drop(user_id)
+
+    # ---------- Память ----------
+    def _append(self, entry: RecentEntry, expense_id: int, day: int, category: str, amount: float):
+        entry.ids.append(expense_id)
+        entry.days.append(day)
+        entry.amounts.append(amount)
+        entry.cats.append(self._code(category))
+        if len(entry.ids) > self.capacity:
+            # как в кольце: вытолкнуть старейшую запись, покрытие начинается после её дня
+            entry.since_day = max(entry.since_day, entry.days[0] + 1)
+            for a in (entry.ids, entry.days, entry.amounts, entry.cats):
+                del a[0]
+
+    def _resize(self, entry: RecentEntry):
+        size = entry.size()
+        self.nbytes += size - entry.nbytes
+        entry.nbytes = size
+        while self.nbytes > self.max_bytes and len(self._entries) > 1:
+            _, old = self._entries.popitem(last=False)
+            self.nbytes -= old.nbytes
+
+    def _drop(self, user_id: int):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self.nbytes -= entry.nbytes
+
+    def user_ids(self) -> List[int]:
+        return list(self._entries)
@@ -0,0 +1,89 @@
+import asyncio
+from typing import List, Optional, Tuple
+
+from storage import Storage
+
+
+# ---------- Хранение и архив ----------
+# Фоновая задача: раз в interval переносит дни старше keep_days (с точностью
+# до месяца) в помесячные агрегаты и сжатый архив, затем возвращает
+# освободившиеся страницы файлу через incremental_vacuum. Работа идёт
+# срезами по users_per_slice пользователей и vacuum_pages страниц — каждый
+# срез одна короткая транзакция в потоке-писателе, между срезами пауза,
+# так что обычные траты ждут не дольше одного среза.
+class RetentionJob:
+    def __init__(
+        self,
+        stores: List[Storage],
+        keep_days: int,
+        users_per_slice: int = 100,
+        vacuum_pages: int = 1000,
+        pause: float = 0.05,
+        interval: float = 6 * 3600,
+    ):
+        self.stores = stores
+        self.keep_days = keep_days
+        self.users_per_slice = users_per_slice
+        self.vacuum_pages = vacuum_pages
+        self.pause = pause
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self._warned = False
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop(), name="retention")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[retention] run failed: {e!r}")
+            await asyncio.sleep(self.interval)
+
+    # Возвращает (перенесено трат, освобождено страниц) по всем базам
+    async def run(self) -> Tuple[int, int]:
+        moved = freed = 0
+        for store in self.stores:
+            cutoff = store.retention_cutoff(self.keep_days)
+            after, rows = 0, 0
+            while True:
+                res = await store.archive_slice(cutoff, after, self.users_per_slice)
+                if res is None:
+                    break
+                after, n = res
+                rows += n
+                await asyncio.sleep(self.pause)
+            pages = await self._vacuum(store)
+            if rows or pages:
+                print(f"[retention] {store.path}: archived {rows} expenses, freed {pages} pages")
+            moved += rows
+            freed += pages
+        return moved, freed
+
+    async def _vacuum(self, store: Storage) -> int:
+        if not await store.auto_vacuum_incremental():
+            if not self._warned:
+                self._warned = True
+                print(f"[retention] {store.path} has no incremental auto_vacuum; run `python manage.py vacuum` once")
+            return 0
+        freed = 0
+        while True:
+            n = await store.incremental_vacuum(self.vacuum_pages)
+            if not n:
+                return freed
+            freed += n
+            await asyncio.sleep(self.pause)
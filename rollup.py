@@ -0,0 +1,237 @@
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import archive
+
+# Сколько пользователей пересчитывать в одной транзакции
+USERS_PER_BATCH = 200
+# Допуск на накопленную ошибку float при инкрементальных +/- amount
+EPSILON = 1e-6
+
+
+# ---------- Дневные агрегаты daily_totals ----------
+# daily_totals(user_id, day, category, sum, count) — сумма и число трат
+# пользователя за локальный день (day = (created_ts + сдвиг TZ) // 86400).
+# Обновляется в той же транзакции, что и изменения в expenses.
+def add(conn: sqlite3.Connection, user_id: int, day: int, category: str, amount: float, count: int = 1):
+    conn.execute(
+        "INSERT INTO daily_totals(user_id, day, category, sum, count) VALUES (?,?,?,?,?) "
+        "ON CONFLICT(user_id, day, category) DO UPDATE "
+        "SET sum=sum+excluded.sum, count=count+excluded.count",
+        (user_id, day, category, amount, count),
+    )
+
+
+def subtract(conn: sqlite3.Connection, user_id: int, day: int, category: str, amount: float, count: int = 1):
+    conn.execute(
+        "UPDATE daily_totals SET sum=sum-?, count=count-? "
+        "WHERE user_id=? AND day=? AND category=?",
+        (amount, count, user_id, day, category),
+    )
+    conn.execute(
+        "DELETE FROM daily_totals WHERE user_id=? AND day=? AND category=? AND count<=0",
+        (user_id, day, category),
+    )
+
+
+def clear_user(conn: sqlite3.Connection, user_id: int):
+    conn.execute("DELETE FROM daily_totals WHERE user_id=?", (user_id,))
+    conn.execute("DELETE FROM user_stats WHERE user_id=?", (user_id,))
+    archive.clear_user(conn, user_id)
+
+
+# ---------- Счётчики дней user_stats ----------
+# user_stats(user_id, days_total, last_day, streak): число дней с тратами,
+# последний такой день и длина серии подряд идущих дней, заканчивающейся
+# на last_day. Поддерживаются инкрементально, без сканирования дат.
+# Дни, ушедшие в архив, учитываются по маскам monthly_days.
+def _has_day(conn: sqlite3.Connection, user_id: int, day: int) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM daily_totals WHERE user_id=? AND day=? LIMIT 1", (user_id, day)
+    ).fetchone() is not None or archive.has_archived_day(conn, user_id, day)
+
+
+def _user_stats(conn: sqlite3.Connection, user_id: int) -> Optional[Tuple[int, int, int]]:
+    row = conn.execute(
+        "SELECT days_total, last_day, streak FROM user_stats WHERE user_id=?", (user_id,)
+    ).fetchone()
+    return tuple(row) if row else None
+
+
+def _put_user_stats(conn: sqlite3.Connection, user_id: int, stats: Tuple[int, int, int]):
+    conn.execute(
+        "INSERT OR REPLACE INTO user_stats(user_id, days_total, last_day, streak) VALUES (?,?,?,?)",
+        (user_id, *stats),
+    )
+
+
+def recompute_user_stats(conn: sqlite3.Connection, user_ids: Iterable[int]) -> Dict[int, Optional[Tuple]]:
+    result = {}
+    for user_id in user_ids:
+        days = {
+            r[0] for r in conn.execute("SELECT DISTINCT day FROM daily_totals WHERE user_id=?", (user_id,))
+        }
+        days = sorted(days.union(archive.archived_days(conn, user_id)), reverse=True)
+        if not days:
+            conn.execute("DELETE FROM user_stats WHERE user_id=?", (user_id,))
+            result[user_id] = None
+            continue
+        streak = 1
+        for newer, older in zip(days, days[1:]):
+            if newer - older != 1:
+                break
+            streak += 1
+        stats = (len(days), days[0], streak)
+        _put_user_stats(conn, user_id, stats)
+        result[user_id] = stats
+    return result
+
+
+# Трата добавлена: обновить дневной агрегат и счётчики дней.
+# Возвращает новое состояние user_stats.
+def record_add(conn: sqlite3.Connection, user_id: int, day: int, category: str, amount: float, count: int = 1):
+    stats = _user_stats(conn, user_id)
+    backdated = stats is not None and day < stats[1]
+    new_day = backdated and not _has_day(conn, user_id, day)
+    add(conn, user_id, day, category, amount, count)
+    if stats is None:
+        stats = (1, day, 1)
+    elif day == stats[1]:
+        return stats
+    elif day == stats[1] + 1:
+        stats = (stats[0] + 1, day, stats[2] + 1)
+    elif day > stats[1]:
+        stats = (stats[0] + 1, day, 1)
+    elif not new_day:
+        return stats
+    elif day == stats[1] - stats[2]:
+        # задним числом закрыли разрыв прямо перед серией — серия могла
+        # склеиться с более ранней, проще пересчитать
+        return recompute_user_stats(conn, [user_id])[user_id]
+    else:
+        stats = (stats[0] + 1, stats[1], stats[2])
+    _put_user_stats(conn, user_id, stats)
+    return stats
+
+
+# Трата удалена: обратная операция. Пересчёт нужен, только если исчез
+# последний день серии.
+def record_remove(conn: sqlite3.Connection, user_id: int, day: int, category: str, amount: float, count: int = 1):
+    subtract(conn, user_id, day, category, amount, count)
+    stats = _user_stats(conn, user_id)
+    if stats is None or _has_day(conn, user_id, day):
+        return stats
+    if day == stats[1] or stats[1] - stats[2] < day:
+        return recompute_user_stats(conn, [user_id])[user_id]
+    stats = (stats[0] - 1, stats[1], stats[2])
+    _put_user_stats(conn, user_id, stats)
+    return stats
+
+
+# ---------- Пересборка и сверка ----------
+def _user_ids(conn: sqlite3.Connection) -> List[int]:
+    rows = conn.execute(
+        "SELECT user_id FROM expenses UNION SELECT user_id FROM daily_totals"
+    ).fetchall()
+    return sorted({r[0] for r in rows}.union(archive.archived_users(conn)))
+
+
+def _batches(items: List[int], size: int) -> Iterable[List[int]]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def rebuild(
+    conn: sqlite3.Connection,
+    tz_offset: int,
+    user_ids: Optional[List[int]] = None,
+    with_user_stats: bool = True,
+) -> int:
+    if user_ids is None:
+        user_ids = _user_ids(conn)
+    for batch in _batches(user_ids, USERS_PER_BATCH):
+        with conn:
+            rebuild_users(conn, tz_offset, batch, with_user_stats)
+    return len(user_ids)
+
+
+# Пересборка в уже открытой транзакции вызывающего
+def rebuild_users(conn: sqlite3.Connection, tz_offset: int, user_ids: List[int], with_user_stats: bool = True):
+    marks = ",".join("?" * len(user_ids))
+    conn.execute(f"DELETE FROM daily_totals WHERE user_id IN ({marks})", user_ids)
+    conn.execute(
+        "INSERT INTO daily_totals(user_id, day, category, sum, count) "
+        "SELECT user_id, (created_ts + ?) / 86400, category, SUM(amount), COUNT(*) "
+        f"FROM expenses WHERE user_id IN ({marks}) AND created_ts IS NOT NULL "
+        "GROUP BY 1, 2, 3",
+        (tz_offset, *user_ids),
+    )
+    if with_user_stats:
+        recompute_user_stats(conn, user_ids)
+
+
+def rebuild_user_stats(conn: sqlite3.Connection) -> int:
+    user_ids = sorted(
+        {r[0] for r in conn.execute("SELECT DISTINCT user_id FROM daily_totals")}
+        .union(archive.archived_users(conn))
+    )
+    for batch in _batches(user_ids, USERS_PER_BATCH):
+        with conn:
+            recompute_user_stats(conn, batch)
+    return len(user_ids)
+
+
+# Возвращает список расхождений (user_id, day, category, ожидаемо, в агрегате),
+# где значения — пары (sum, count) или None, если строки нет.
+def verify(conn: sqlite3.Connection, tz_offset: int, user_ids: Optional[List[int]] = None) -> List[Tuple]:
+    if user_ids is None:
+        user_ids = _user_ids(conn)
+    drift = []
+    for batch in _batches(user_ids, USERS_PER_BATCH):
+        marks = ",".join("?" * len(batch))
+        expected = {
+            (r[0], r[1], r[2]): (r[3], r[4])
+            for r in conn.execute(
+                "SELECT user_id, (created_ts + ?) / 86400, category, SUM(amount), COUNT(*) "
+                f"FROM expenses WHERE user_id IN ({marks}) AND created_ts IS NOT NULL GROUP BY 1, 2, 3",
+                (tz_offset, *batch),
+            )
+        }
+        actual = {
+            (r[0], r[1], r[2]): (r[3], r[4])
+            for r in conn.execute(
+                "SELECT user_id, day, category, sum, count "
+                f"FROM daily_totals WHERE user_id IN ({marks})",
+                batch,
+            )
+        }
+        for key in sorted(expected.keys() | actual.keys()):
+            exp, act = expected.get(key), actual.get(key)
+            if exp is None or act is None or exp[1] != act[1] or abs(exp[0] - act[0]) > EPSILON:
+                drift.append((*key, exp, act))
+
+        days_by_user: Dict[int, set] = {}
+        for user_id, day, _ in expected:
+            days_by_user.setdefault(user_id, set()).add(day)
+        for user_id in batch:
+            days_by_user.setdefault(user_id, set()).update(archive.archived_days(conn, user_id))
+        stats_rows = {
+            r[0]: (r[1], r[2], r[3])
+            for r in conn.execute(
+                "SELECT user_id, days_total, last_day, streak "
+                f"FROM user_stats WHERE user_id IN ({marks})",
+                batch,
+            )
+        }
+        for user_id in batch:
+            days = sorted(days_by_user.get(user_id, ()), reverse=True)
+            exp = None
+            if days:
+                streak = 1
+                while streak < len(days) and days[streak - 1] - days[streak] == 1:
+                    streak += 1
+                exp = (len(days), days[0], streak)
+            act = stats_rows.get(user_id)
+            if exp != act:
+                drift.append((user_id, None, "user_stats", exp, act))
+    return drift
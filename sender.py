@@ -0,0 +1,261 @@
+import asyncio
+import html
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter
+from aiogram.methods import SendMessage, TelegramMethod
+
+MAX_TEXT = 4096
+
+
+# ---------- Token bucket ----------
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    # сколько ждать до свободного токена (0 — можно сейчас)
+    def delay(self, now: float) -> float:
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class Outgoing:
+    __slots__ = ("chat_id", "method", "futures", "attempts")
+
+    def __init__(self, chat_id: Optional[int], method: TelegramMethod, future: asyncio.Future):
+        self.chat_id = chat_id
+        self.method = method
+        self.futures: List[asyncio.Future] = [future]
+        self.attempts = 0
+
+
+def _plain_parse_mode(method: SendMessage) -> Optional[str]:
+    return method.parse_mode if isinstance(method.parse_mode, str) else None
+
+
+# Два подряд идущих сообщения в один чат склеиваются в одно, если у них
+# нет ссылок на ответ/entities и клавиатура есть максимум у одного
+# (она остаётся под общим текстом). Простой текст к HTML экранируется.
+def merge(a: TelegramMethod, b: TelegramMethod) -> Optional[SendMessage]:
+    if not (isinstance(a, SendMessage) and isinstance(b, SendMessage)):
+        return None
+    if a.chat_id != b.chat_id or a.message_thread_id != b.message_thread_id:
+        return None
+    if a.entities or b.entities or b.reply_parameters or b.reply_to_message_id:
+        return None
+    if a.reply_markup is not None and b.reply_markup is not None:
+        return None
+    if a.disable_notification != b.disable_notification:
+        return None
+    pa, pb = _plain_parse_mode(a), _plain_parse_mode(b)
+    if {pa, pb} - {None, "HTML"}:
+        return None
+    if pa == pb:
+        ta, tb, mode = a.text, b.text, a.parse_mode
+    else:
+        ta = a.text if pa else html.escape(a.text)
+        tb = b.text if pb else html.escape(b.text)
+        mode = "HTML"
+    text = f"{ta}\n\n{tb}"
+    if len(text) > MAX_TEXT:
+        return None
+    return a.model_copy(update={
+        "text": text,
+        "parse_mode": mode,
+        "reply_markup": a.reply_markup if a.reply_markup is not None else b.reply_markup,
+    })
+
+
+# ---------- Планировщик отправки ----------
+# Хэндлеры кладут готовые методы Bot API (message.answer(...) без await)
+# в submit() и сразу возвращаются. Внутри — очередь на каждый чат (FIFO),
+# token bucket на чат и общий на бота под лимиты Telegram. Пока чат ждёт
+# своего токена, новые сообщения копятся и при отправке склеиваются
+# (подтверждение траты + цитата уходят одним сообщением). RetryAfter
+# ставит чат на паузу, сетевые ошибки повторяются с backoff. Методы без
+# chat_id (answerCallbackQuery) идут сразу, без лимитов и порядка.
+class SendScheduler:
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        chat_rate: float = 1.0,
+        chat_burst: float = 3.0,
+        max_retries: int = 5,
+    ):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._bot: Optional[Bot] = None
+        self._global: Optional[TokenBucket] = None
+        self._queues: Dict[int, Deque[Outgoing]] = {}
+        self._buckets: Dict[int, TokenBucket] = {}
+        # чаты, у которых есть работа: в _ready, на таймере или в отправке
+        self._active: Set[int] = set()
+        self._ready: "asyncio.Queue[Optional[int]]" = asyncio.Queue()
+        self._inflight: Set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.merged = 0
+
+    def start(self, bot: Bot):
+        if self._task is None:
+            self._bot = bot
+            self._global = TokenBucket(self.global_rate, self.global_rate, time.monotonic())
+            self._task = asyncio.create_task(self._run(), name="send-scheduler")
+
+    @property
+    def depth(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    # Дождаться, пока уйдёт всё поставленное, и остановиться
+    async def stop(self, timeout: float = 30.0):
+        if self._task is None:
+            return
+        deadline = time.monotonic() + timeout
+        while (self._active or self._inflight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        self._ready.put_nowait(None)
+        await self._task
+        self._task = None
+        for task in list(self._inflight):
+            task.cancel()
+        for q in self._queues.values():
+            for item in q:
+                self._fail(item, RuntimeError("send scheduler stopped"))
+        self._queues.clear()
+        self._active.clear()
+
+    def submit(self, method: TelegramMethod, chat_id: Optional[int] = None) -> asyncio.Future:
+        if self._task is None:
+            raise RuntimeError("send scheduler is not running")
+        fut = asyncio.get_running_loop().create_future()
+        item = Outgoing(chat_id, method, fut)
+        if chat_id is None:
+            self._spawn(item)
+            return fut
+        q = self._queues.get(chat_id)
+        if q is None:
+            q = self._queues[chat_id] = deque()
+        q.append(item)
+        if chat_id not in self._active:
+            self._active.add(chat_id)
+            self._ready.put_nowait(chat_id)
+        return fut
+
+    def send(self, chat_id: int, text: str, **kwargs: Any) -> asyncio.Future:
+        return self.submit(SendMessage(chat_id=chat_id, text=text, **kwargs), chat_id)
+
+    # ---------- Цикл ----------
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            chat_id = await self._ready.get()
+            if chat_id is None:
+                return
+            now = time.monotonic()
+            bucket = self._buckets.get(chat_id)
+            if bucket is None:
+                bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+            wait = bucket.delay(now)
+            if wait > 0:
+                loop.call_later(wait, self._ready.put_nowait, chat_id)
+                continue
+            wait = self._global.delay(now)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                now = time.monotonic()
+            self._global.take(now)
+            bucket.take(now)
+            q = self._queues[chat_id]
+            item = q.popleft()
+            while q:
+                merged = merge(item.method, q[0].method)
+                if merged is None:
+                    break
+                item.method = merged
+                item.futures.extend(q.popleft().futures)
+                self.merged += 1
+            self._spawn(item)
+
+    def _spawn(self, item: Outgoing):
+        task = asyncio.create_task(self._deliver(item))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _deliver(self, item: Outgoing):
+        delay = 0.0
+        try:
+            result = await self._bot(item.method)
+        except TelegramRetryAfter as e:
+            delay = float(e.retry_after)
+            print(f"[send] flood limit in chat {item.chat_id}, retry in {delay:g}s")
+        except TelegramNetworkError as e:
+            item.attempts += 1
+            if item.attempts > self.max_retries:
+                self._fail(item, e)
+            else:
+                delay = min(30.0, 0.5 * 2 ** (item.attempts - 1))
+        except Exception as e:
+            self._fail(item, e)
+        else:
+            for fut in item.futures:
+                if not fut.done():
+                    fut.set_result(result)
+        if delay and item.chat_id is None:
+            await asyncio.sleep(delay)
+            self._spawn(item)
+            return
+        if item.chat_id is not None:
+            self._after(item, delay)
+
+    # чат освободился: следующее сообщение (или повтор этого — первым в очереди)
+    def _after(self, item: Outgoing, delay: float):
+        chat_id = item.chat_id
+        q = self._queues[chat_id]
+        if delay:
+            q.appendleft(item)
+            asyncio.get_running_loop().call_later(delay, self._ready.put_nowait, chat_id)
+        elif q:
+            self._ready.put_nowait(chat_id)
+        else:
+            del self._queues[chat_id]
+            self._active.discard(chat_id)
+            bucket = self._buckets.get(chat_id)
+            if bucket is not None and bucket.full(time.monotonic()):
+                del self._buckets[chat_id]
+            elif bucket is not None:
+                refill = self.chat_burst / self.chat_rate
+                asyncio.get_running_loop().call_later(refill, self._forget_bucket, chat_id)
+
+    def _forget_bucket(self, chat_id: int):
+        if chat_id not in self._active:
+            self._buckets.pop(chat_id, None)
+
+    @staticmethod
+    def _fail(item: Outgoing, exc: BaseException):
+        print(f"[send] {type(item.method).__name__} to {item.chat_id} failed: {exc!r}")
+        for fut in item.futures:
+            if not fut.done():
+                fut.set_exception(exc)
+                # ошибка уже в логе; хэндлеры future обычно не ждут
+                fut.exception()
@@ -0,0 +1,215 @@
+import asyncio
+import heapq
+import os
+import sqlite3
+from datetime import datetime, tzinfo
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from storage import Storage
+
+_MASK64 = (1 << 64) - 1
+
+
+# Шард пользователя: мультипликативный хэш, чтобы соседние id (и id одного
+# диапазона) расходились по разным файлам. Зависит только от user_id и
+# числа шардов — main.py и manage.py reshard должны считать одинаково.
+def shard_index(user_id: int, shards: int) -> int:
+    return (((user_id * 0x9E3779B97F4A7C15) & _MASK64) >> 32) % shards
+
+
+# finances.db -> finances.shard-0-of-4.db …; число шардов в имени не даёт
+# открыть файлы одной раскладки с другим DB_SHARDS
+def shard_paths(path: str, shards: int) -> List[str]:
+    if shards <= 1:
+        return [path]
+    root, ext = os.path.splitext(path)
+    return [f"{root}.shard-{i}-of-{shards}{ext}" for i in range(shards)]
+
+
+# ключ FSM — "bot:chat:user:thread:destiny" (см. SQLiteStorage._key)
+def fsm_user_id(key: str) -> int:
+    return int(key.split(":", 3)[2])
+
+
+# ---------- Шардированное хранилище ----------
+# Пользователи раскладываются по DB_SHARDS файлам SQLite, у каждого — свой
+# Storage: писатель, читатели, очередь записи и кэш профилей. Пишущие
+# транзакции разных шардов идут параллельно, а не ждут один общий lock.
+# Всё, что касается одного пользователя (траты, отмена, сброс, импорт,
+# статистика, экспорт, профиль, FSM, подписка), уходит в его шард;
+# общее (истечение FSM, страницы дайджестов, сверка агрегатов) опрашивает
+# все шарды. Служебные таблицы без пользователя (digest_runs) живут в шарде 0.
+# Интерфейс совпадает со Storage, main.py выбирает класс по DB_SHARDS.
+class ShardedStorage:
+    def __init__(
+        self,
+        path: str,
+        tz: tzinfo,
+        shards: int,
+        readers: int = 1,
+        profile_cache_size: int = 10000,
+        **opts: Any,
+    ):
+        self.path = path
+        self.tz = tz
+        self.paths = shard_paths(path, shards)
+        per_shard_cache = -(-profile_cache_size // shards)
+        self.shards = [
+            Storage(p, tz, readers=readers, profile_cache_size=per_shard_cache, **opts)
+            for p in self.paths
+        ]
+
+    def shard(self, user_id: int) -> Storage:
+        return self.shards[shard_index(user_id, len(self.shards))]
+
+    async def _each(self, fn: Callable[[Storage], Any]) -> List[Any]:
+        return await asyncio.gather(*(fn(s) for s in self.shards))
+
+    # ---------- Жизненный цикл ----------
+    async def open(self):
+        # старый однофайловый DB_PATH рядом с пустыми шардами — почти наверняка
+        # забыли выполнить manage.py reshard; молча начинать с нуля нельзя
+        if os.path.exists(self.path) and not any(os.path.exists(p) for p in self.paths):
+            raise RuntimeError(
+                f"{self.path} exists but its shards do not; "
+                f"run `python manage.py reshard --to {len(self.shards)}` first"
+            )
+        await self._each(lambda s: s.open())
+
+    async def close(self):
+        await self._each(lambda s: s.close())
+
+    async def warm_up(self, profiles: int = 0) -> int:
+        per_shard = -(-profiles // len(self.shards))
+        return sum(await self._each(lambda s: s.warm_up(per_shard)))
+
+    @property
+    def write_queue_depth(self) -> int:
+        return sum(s.write_queue_depth for s in self.shards)
+
+    @property
+    def cached_profiles(self) -> int:
+        return sum(s.cached_profiles for s in self.shards)
+
+    @property
+    def cached_recent_users(self) -> int:
+        return sum(s.cached_recent_users for s in self.shards)
+
+    @property
+    def recent_cache_bytes(self) -> int:
+        return sum(s.recent_cache_bytes for s in self.shards)
+
+    @property
+    def recent_drift(self) -> Optional[int]:
+        checked = [s.recent_drift for s in self.shards if s.recent_drift is not None]
+        return sum(checked) if checked else None
+
+    def day_of(self, ts: int) -> int:
+        return self.shards[0].day_of(ts)
+
+    def today(self) -> int:
+        return self.shards[0].today()
+
+    # ---------- Запись ----------
+    async def add_expense(self, user_id: int, amount: float, category: str, created_at: datetime):
+        await self.shard(user_id).add_expense(user_id, amount, category, created_at)
+
+    async def add_expenses(self, user_id: int, items: List[Tuple[float, str, datetime]]):
+        await self.shard(user_id).add_expenses(user_id, items)
+
+    async def undo_last(self, user_id: int) -> Optional[sqlite3.Row]:
+        return await self.shard(user_id).undo_last(user_id)
+
+    async def redo_last(self, user_id: int) -> Optional[sqlite3.Row]:
+        return await self.shard(user_id).redo_last(user_id)
+
+    async def reset_user(self, user_id: int):
+        await self.shard(user_id).reset_user(user_id)
+
+    async def restore_reset(self, user_id: int) -> Optional[int]:
+        return await self.shard(user_id).restore_reset(user_id)
+
+    def begin_import(self, user_id: int) -> int:
+        return self.shard(user_id).begin_import(user_id)
+
+    async def stage_import(self, user_id: int, token: int, rows: List[Tuple[float, str, str, int]]):
+        await self.shard(user_id).stage_import(user_id, token, rows)
+
+    async def import_expenses(self, user_id: int, token: int, chunk: int = 5000) -> Tuple[int, int]:
+        return await self.shard(user_id).import_expenses(user_id, token, chunk)
+
+    async def discard_import(self, user_id: int, token: int):
+        await self.shard(user_id).discard_import(user_id, token)
+
+    # ---------- Чтение ----------
+    async def fetch_stats(self, user_id: int, start: datetime, end: datetime):
+        return await self.shard(user_id).fetch_stats(user_id, start, end)
+
+    async def last_expense(self, user_id: int) -> Optional[Tuple[float, str]]:
+        return await self.shard(user_id).last_expense(user_id)
+
+    async def verify_recent(self) -> List[int]:
+        return [u for drift in await self._each(lambda s: s.verify_recent()) for u in drift]
+
+    async def check_recent(self) -> int:
+        return sum(await self._each(lambda s: s.check_recent()))
+
+    async def fetch_daily_columns(self, user_id: int, start_day: int, end_day: int):
+        return await self.shard(user_id).fetch_daily_columns(user_id, start_day, end_day)
+
+    async def export_rows(
+        self,
+        user_id: int,
+        sink: Callable[[List[sqlite3.Row]], None],
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        category: Optional[str] = None,
+    ) -> int:
+        return await self.shard(user_id).export_rows(user_id, sink, start, end, category)
+
+    async def user_profile(self, user_id: int) -> dict:
+        return await self.shard(user_id).user_profile(user_id)
+
+    # ---------- FSM ----------
+    async def fsm_load(self, key: str) -> Optional[Tuple[Optional[str], Optional[str], int]]:
+        return await self.shard(fsm_user_id(key)).fsm_load(key)
+
+    async def fsm_write(self, changes: Dict[str, Optional[Tuple[Optional[str], Optional[str], int]]]):
+        by_shard: Dict[int, Dict[str, Any]] = {}
+        for key, value in changes.items():
+            idx = shard_index(fsm_user_id(key), len(self.shards))
+            by_shard.setdefault(idx, {})[key] = value
+        await asyncio.gather(*(self.shards[i].fsm_write(part) for i, part in by_shard.items()))
+
+    async def fsm_expire(self, before_ts: int, limit: int) -> int:
+        return sum(await self._each(lambda s: s.fsm_expire(before_ts, limit)))
+
+    # ---------- Дайджесты ----------
+    async def get_subscription(self, user_id: int) -> Optional[str]:
+        return await self.shard(user_id).get_subscription(user_id)
+
+    async def set_subscription(self, user_id: int, chat_id: int, period: Optional[str]):
+        await self.shard(user_id).set_subscription(user_id, chat_id, period)
+
+    # каждый шард отдаёт свои limit подписчиков после after_user; слияние
+    # по user_id и первые limit — та же страница, что и у одного файла
+    async def digest_page(
+        self, period: str, prev_from: int, cur_from: int, cur_to: int, after_user: int, limit: int
+    ) -> List[Tuple[int, int, List[Tuple[str, float, float]]]]:
+        pages = await self._each(
+            lambda s: s.digest_page(period, prev_from, cur_from, cur_to, after_user, limit)
+        )
+        return list(heapq.merge(*pages, key=lambda r: r[0]))[:limit]
+
+    async def digest_run(self, run_id: str, period: str) -> Tuple[int, int, int, Optional[int]]:
+        return await self.shards[0].digest_run(run_id, period)
+
+    async def digest_checkpoint(self, run_id: str, last_user_id: int, sent: int, failed: int, finished: bool = False):
+        await self.shards[0].digest_checkpoint(run_id, last_user_id, sent, failed, finished)
+
+    # ---------- Обслуживание ----------
+    async def verify_rollup(self) -> List[Tuple]:
+        return [row for rows in await self._each(lambda s: s.verify_rollup()) for row in rows]
+
+    async def rebuild_rollup(self) -> int:
+        return sum(await self._each(lambda s: s.rebuild_rollup()))
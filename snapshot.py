@@ -0,0 +1,208 @@
+import asyncio
+import collections
+import itertools
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import archive
+
+# окна активности (дней) и дни удержания Dk для отчёта
+ACTIVE_WINDOWS = (1, 7, 30)
+RETENTION_DAYS = (1, 7, 30)
+TOP_CATEGORIES = 10
+
+
+# ---------- Снимок ----------
+# Отчёты по всем пользователям читают не рабочий файл, а его копию,
+# снятую online backup API одним шагом: это одна читающая транзакция, в WAL
+# она не мешает писателю, и копия согласована на момент её начала. Копия —
+# в памяти или файлом в target_dir (пишется во временный и подменяется).
+def take(source: str, target_dir: Optional[str] = None) -> sqlite3.Connection:
+    src = sqlite3.connect(f"file:{source}?mode=ro", uri=True, timeout=30)
+    try:
+        if target_dir is None:
+            dst = sqlite3.connect(":memory:", check_same_thread=False)
+            src.backup(dst)
+            dst.execute("PRAGMA query_only=1")
+            return dst
+        path = os.path.join(target_dir, os.path.basename(source))
+        tmp = sqlite3.connect(path + ".tmp")
+        try:
+            src.backup(tmp)
+            tmp.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            tmp.close()
+        os.replace(path + ".tmp", path)
+        return sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+    finally:
+        src.close()
+
+
+# ---------- Отчёт ----------
+# Все поля аддитивны по шардам (пользователь живёт ровно в одном файле),
+# поэтому отчёты по копиям шардов просто складываются.
+class Report:
+    def __init__(self):
+        self.users = 0
+        self.active: Dict[int, int] = {days: 0 for days in ACTIVE_WINDOWS}
+        # категория -> [сумма, число трат]; за всё время и за 30 дней
+        self.categories: Dict[str, List[float]] = collections.defaultdict(lambda: [0.0, 0])
+        self.categories_30: Dict[str, List[float]] = collections.defaultdict(lambda: [0.0, 0])
+        # Dk -> [пользователей, у которых день first+k уже наступил, из них активных в тот день]
+        self.retention: Dict[int, List[int]] = {k: [0, 0] for k in RETENTION_DAYS}
+
+    def merge(self, other: "Report"):
+        self.users += other.users
+        for days, n in other.active.items():
+            self.active[days] += n
+        for mine, theirs in ((self.categories, other.categories), (self.categories_30, other.categories_30)):
+            for category, (s, n) in theirs.items():
+                mine[category][0] += s
+                mine[category][1] += n
+        for k, (eligible, retained) in other.retention.items():
+            self.retention[k][0] += eligible
+            self.retention[k][1] += retained
+
+
+def build(conn: sqlite3.Connection, today: int) -> Report:
+    report = Report()
+    report.users = conn.execute("SELECT COUNT(*) FROM user_stats").fetchone()[0]
+    for days in ACTIVE_WINDOWS:
+        report.active[days] = conn.execute(
+            "SELECT COUNT(*) FROM user_stats WHERE last_day>?", (today - days,)
+        ).fetchone()[0]
+    for category, s, n in conn.execute(
+        "SELECT category, SUM(sum), SUM(count) FROM ("
+        "SELECT category, sum, count FROM daily_totals "
+        "UNION ALL SELECT category, sum, count FROM monthly_totals"
+        ") GROUP BY category"
+    ):
+        report.categories[category] = [s, n]
+    for category, s, n in conn.execute(
+        "SELECT category, SUM(sum), SUM(count) FROM daily_totals WHERE day>? GROUP BY category",
+        (today - 30,),
+    ):
+        report.categories_30[category] = [s, n]
+    for days in _active_days(conn):
+        first = min(days)
+        for k in RETENTION_DAYS:
+            if first + k <= today:
+                report.retention[k][0] += 1
+                report.retention[k][1] += first + k in days
+    return report
+
+
+# Множество активных дней каждого пользователя: дневные агрегаты по порядку
+# первичного ключа плюс дни из масок архива
+def _active_days(conn: sqlite3.Connection) -> Iterable[Set[int]]:
+    archived: Dict[int, List[int]] = {}
+    for user_id, month, mask in conn.execute("SELECT user_id, month, mask FROM monthly_days"):
+        archived.setdefault(user_id, []).extend(archive.month_days(month, mask))
+    rows = conn.execute("SELECT user_id, day FROM daily_totals GROUP BY user_id, day ORDER BY user_id, day")
+    for user_id, group in itertools.groupby(rows, key=lambda r: r[0]):
+        yield {day for _, day in group}.union(archived.pop(user_id, ()))
+    for days in archived.values():
+        yield set(days)
+
+
+def build_all(sources: List[str], tz_offset: int, target_dir: Optional[str] = None) -> Report:
+    today = (int(time.time()) + tz_offset) // 86400
+    report = Report()
+    for source in sources:
+        conn = take(source, target_dir)
+        try:
+            report.merge(build(conn, today))
+        finally:
+            conn.close()
+    return report
+
+
+def format_report(report: Report, taken_at: float, duration: float) -> str:
+    lines = [
+        f"Snapshot: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(taken_at))} "
+        f"(age {time.time() - taken_at:.0f}s, took {duration:.2f}s)",
+        "",
+        f"Users: {report.users}",
+        "Active: " + ", ".join(f"{days}d {report.active[days]}" for days in ACTIVE_WINDOWS),
+        "Retention: " + ", ".join(
+            f"D{k} {retained / eligible:.1%} ({retained}/{eligible})" if eligible else f"D{k} –"
+            for k, (eligible, retained) in sorted(report.retention.items())
+        ),
+    ]
+    for title, table in (("All time", report.categories), ("Last 30 days", report.categories_30)):
+        lines += ["", f"{title}, top categories:"]
+        top = sorted(table.items(), key=lambda kv: kv[1][0], reverse=True)[:TOP_CATEGORIES]
+        lines += [f"  {category}: {s:,.2f} ({n} expenses)" for category, (s, n) in top] or ["  –"]
+    return "\n".join(lines)
+
+
+# ---------- Кэш отчёта ----------
+# Отчёт строится в отдельном потоке по свежему снимку и отдаётся из кэша,
+# пока снимку не больше max_age. Если задача запущена (start), она
+# обновляет снимок раз в max_age сама; иначе — по первому запросу после
+# устаревания. Параллельные запросы ждут одно и то же обновление.
+class Snapshots:
+    def __init__(self, sources: List[str], tz_offset: int, max_age: float = 3600, target_dir: Optional[str] = None):
+        self.sources = sources
+        self.tz_offset = tz_offset
+        self.max_age = max_age
+        self.target_dir = target_dir
+        self.report: Optional[Report] = None
+        self.taken_at: Optional[float] = None
+        self.duration: Optional[float] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="snapshot")
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def age(self) -> Optional[float]:
+        return None if self.taken_at is None else time.time() - self.taken_at
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop(), name="snapshots")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._executor.shutdown(wait=True)
+
+    # первый снимок — по запросу или через max_age, а не на каждом рестарте
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.max_age)
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[snapshot] refresh failed: {e!r}")
+
+    async def refresh(self) -> Report:
+        async with self._lock:
+            started = time.time()
+            loop = asyncio.get_running_loop()
+            report = await loop.run_in_executor(
+                self._executor, build_all, self.sources, self.tz_offset, self.target_dir
+            )
+            self.report, self.taken_at, self.duration = report, started, time.time() - started
+            print(f"[snapshot] {len(self.sources)} file(s) in {self.duration:.2f}s")
+            return report
+
+    async def get(self) -> Tuple[Report, float, float]:
+        if self.report is None or self.age >= self.max_age:
+            if self._lock.locked():
+                # обновление уже идёт — дождаться его, а не снимать второй раз
+                async with self._lock:
+                    pass
+            if self.report is None or self.age >= self.max_age:
+                await self.refresh()
+        return self.report, self.taken_at, self.duration
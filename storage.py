@@ -0,0 +1,818 @@
+import asyncio
+import heapq
+import itertools
+import sqlite3
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, tzinfo
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import archive
+import journal
+import metrics
+import rollup
+from migrations import migrate
+from profiles import ProfileCache, ProfileEntry
+from recent import RecentCache
+from writequeue import WriteGroup, WriteQueue
+
+EXPORT_CHUNK = 1000
+
+
+# ---------- Асинхронное хранилище ----------
+# Все обращения к SQLite идут через выделенные потоки: один писатель
+# (SQLite всё равно допускает только одну пишущую транзакцию) и несколько
+# читателей. Каждый поток держит своё долгоживущее соединение, а WAL
+# позволяет читателям не ждать писателя. Event loop только ждёт future.
+class Storage:
+    def __init__(
+        self,
+        path: str,
+        tz: tzinfo,
+        readers: int = 2,
+        profile_cache_size: int = 10000,
+        write_max_batch: int = 500,
+        write_max_latency: float = 0.005,
+        write_max_pending: int = 10000,
+        undo_window: float = 24 * 3600,
+        prune_interval: float = 600,
+        recent_cache_bytes: int = 32 << 20,
+        recent_verify_interval: float = 3600,
+    ):
+        self.path = path
+        self.archive_path = archive.archive_path(path)
+        self.tz = tz
+        self._readers_count = readers
+        self._local = threading.local()
+        self._conns: List[sqlite3.Connection] = []
+        self._conns_lock = threading.Lock()
+        self._writer: Optional[ThreadPoolExecutor] = None
+        self._readers: Optional[ThreadPoolExecutor] = None
+        offset = tz.utcoffset(None)
+        self._tz_offset = int(offset.total_seconds()) if offset else 0
+        self.profiles = ProfileCache(profile_cache_size)
+        self.recent = RecentCache(recent_cache_bytes)
+        self.recent_verify_interval = recent_verify_interval
+        # расходящихся записей при последней сверке; None — сверки ещё не было
+        self.recent_drift: Optional[int] = None
+        self._write_opts = (write_max_batch, write_max_latency, write_max_pending)
+        self._writes: Optional[WriteQueue] = None
+        # сколько живут отмены (для /redo) и сброс (для возврата)
+        self.undo_window = undo_window
+        self.prune_interval = prune_interval
+        self._pruner: Optional[asyncio.Task] = None
+        self._import_tokens = itertools.count(1)
+
+    # ---------- Жизненный цикл ----------
+    async def open(self):
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._readers = ThreadPoolExecutor(
+            max_workers=self._readers_count, thread_name_prefix="db-reader"
+        )
+        await self._write(self._init_schema)
+        max_batch, max_latency, max_pending = self._write_opts
+        self._writes = WriteQueue(self._flush_expenses, max_batch, max_latency, max_pending)
+        self._writes.start()
+        self._pruner = asyncio.create_task(self._maintenance_loop(), name="storage-maintenance")
+
+    async def close(self):
+        if self._pruner is not None:
+            self._pruner.cancel()
+            try:
+                await self._pruner
+            except asyncio.CancelledError:
+                pass
+            self._pruner = None
+        if self._writes is not None:
+            await self._writes.stop()
+        for ex in (self._writer, self._readers):
+            if ex is not None:
+                ex.shutdown(wait=True)
+        self._writer = self._readers = None
+        with self._conns_lock:
+            for conn in self._conns:
+                conn.close()
+            self._conns.clear()
+
+    # Прогрев после старта: открыть соединения всех читателей (каждый пинг
+    # ненадолго держит поток, так что следующий уходит в новый) и загрузить в кэш профили до
+    # profiles недавно активных пользователей. Возвращает число профилей.
+    async def warm_up(self, profiles: int = 0) -> int:
+        await asyncio.gather(*(self._read(self._ping) for _ in range(self._readers_count)))
+        # прогревать нечего, если кэш профилей меньше (или выключен)
+        profiles = min(profiles, self.profiles.maxsize)
+        if profiles <= 0:
+            return 0
+        users = await self._read(self._recent_users, profiles)
+        for user_id in users:
+            await self.user_profile(user_id)
+        return len(users)
+
+    @staticmethod
+    def _ping(conn):
+        conn.execute("SELECT 1").fetchone()
+        time.sleep(0.01)
+
+    @staticmethod
+    def _recent_users(conn, limit):
+        return [r[0] for r in conn.execute(
+            "SELECT user_id FROM user_stats ORDER BY last_day DESC LIMIT ?", (limit,)
+        )]
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            factory = metrics.TimedConnection if metrics.timing_enabled() else sqlite3.Connection
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, factory=factory)
+            conn.row_factory = sqlite3.Row
+            # действует только на новой базе; существующую переводит manage.py vacuum
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.execute("ATTACH DATABASE ? AS archive", (self.archive_path,))
+            conn.execute("PRAGMA archive.journal_mode=WAL")
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    def _call(self, fn: Callable, args: Tuple) -> Any:
+        if metrics.timing_enabled():
+            # метка операции для имён запросов: "_fetch_stats" -> "fetch_stats"
+            metrics.set_operation(fn.__name__.lstrip("_"))
+        return fn(self._conn(), *args)
+
+    # После close() исполнителей нет, а run_in_executor(None, …) молча ушёл бы
+    # в пул по умолчанию и открыл новое соединение — поэтому явная ошибка
+    async def _read(self, fn: Callable, *args) -> Any:
+        if self._readers is None:
+            raise RuntimeError(f"storage {self.path} is closed")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, self._call, fn, args)
+
+    async def _write(self, fn: Callable, *args) -> Any:
+        if self._writer is None:
+            raise RuntimeError(f"storage {self.path} is closed")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, self._call, fn, args)
+
+    @property
+    def write_queue_depth(self) -> int:
+        return self._writes.depth if self._writes is not None else 0
+
+    @property
+    def cached_profiles(self) -> int:
+        return len(self.profiles)
+
+    @property
+    def cached_recent_users(self) -> int:
+        return len(self.recent)
+
+    @property
+    def recent_cache_bytes(self) -> int:
+        return self.recent.nbytes
+
+    def _init_schema(self, conn: sqlite3.Connection):
+        migrate(conn, self._tz_offset)
+        archive.init(conn)
+
+    # номер локального дня для unix-времени (LOCAL_TZ — фиксированный сдвиг)
+    def day_of(self, ts: int) -> int:
+        return (ts + self._tz_offset) // 86400
+
+    def today(self) -> int:
+        return self.day_of(int(time.time()))
+
+    # ---------- Запись ----------
+    # Трата уходит в очередь записи; возврат — после коммита пачки
+    async def add_expense(self, user_id: int, amount: float, category: str, created_at: datetime):
+        await self.add_expenses(user_id, [(amount, category, created_at)])
+
+    async def add_expenses(self, user_id: int, items: List[Tuple[float, str, datetime]]):
+        self.profiles.write_started(user_id)
+        self.recent.write_started(user_id)
+        try:
+            fut = await self._writes.enqueue(user_id, items)
+        except BaseException:
+            self.profiles.invalidate(user_id)
+            self.recent.invalidate(user_id)
+            raise
+        await asyncio.shield(fut)
+
+    async def _flush_expenses(self, batch: List[WriteGroup]) -> List[None]:
+        try:
+            stats, expense_id = await self._write(self._insert_batch, batch)
+        except BaseException:
+            for g in batch:
+                self.profiles.invalidate(g.user_id)
+                self.recent.invalidate(g.user_id)
+            raise
+        for g in batch:
+            items = [(self.day_of(int(dt.timestamp())), c, a) for a, c, dt in g.rows]
+            self.profiles.added(g.user_id, items, stats[g.user_id])
+            self.recent.added(g.user_id, [(expense_id + i, day, c, a) for i, (day, c, a) in enumerate(items)])
+            expense_id += len(items)
+        return [None] * len(batch)
+
+    def _insert_batch(self, conn, batch: List[WriteGroup]) -> Tuple[Dict[int, Optional[Tuple]], int]:
+        rows = []
+        deltas: Dict[Tuple[int, int, str], Tuple[float, int]] = {}
+        for g in batch:
+            for amount, category, created_at in g.rows:
+                ts = int(created_at.timestamp())
+                rows.append((g.user_id, amount, category, created_at.isoformat(), ts))
+                key = (g.user_id, self.day_of(ts), category)
+                s, n = deltas.get(key, (0.0, 0))
+                deltas[key] = (s + amount, n + 1)
+        stats = {}
+        with conn:
+            conn.executemany(
+                "INSERT INTO expenses(user_id,amount,category,created_at,created_ts) "
+                "VALUES (?,?,?,?,?)",
+                rows,
+            )
+            # писатель один, id AUTOINCREMENT выдаются подряд в порядке rows;
+            # читать до upsert'ов user_stats — они тоже меняют last_insert_rowid
+            first_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0] - len(rows) + 1
+            # агрегаты обновляем один раз на (пользователь, день, категория)
+            for (user_id, day, category), (amount, count) in sorted(deltas.items()):
+                stats[user_id] = rollup.record_add(conn, user_id, day, category, amount, count)
+        return stats, first_id
+
+    # ---------- Отмена, повтор, сброс ----------
+    # Всё через журнал (см. journal.py); возвращают строку траты или None.
+    # Кэш недавних трат после успеха правится на месте вызывающим методом.
+    async def _journaled(self, user_id: int, fn: Callable, *args) -> Any:
+        await self._writes.barrier(user_id)
+        self.profiles.write_started(user_id)
+        self.recent.write_started(user_id)
+        try:
+            return await self._write(fn, user_id, *args)
+        except BaseException:
+            self.recent.invalidate(user_id)
+            raise
+        finally:
+            self.profiles.invalidate(user_id)
+
+    async def undo_last(self, user_id: int) -> Optional[sqlite3.Row]:
+        row = await self._journaled(user_id, journal.undo, self._tz_offset, int(time.time()))
+        self.recent.removed(user_id, row["id"] if row else None)
+        return row
+
+    async def redo_last(self, user_id: int) -> Optional[sqlite3.Row]:
+        row = await self._journaled(user_id, journal.redo, self._tz_offset)
+        items = [(row["id"], self.day_of(row["created_ts"]), row["category"], row["amount"])] if row else []
+        self.recent.added(user_id, items)
+        return row
+
+    async def reset_user(self, user_id: int):
+        await self._journaled(user_id, journal.reset, int(time.time()))
+        self.recent.cleared(user_id)
+
+    # число возвращённых трат или None, если сброса в окне undo_window не было
+    async def restore_reset(self, user_id: int) -> Optional[int]:
+        since = int(time.time() - self.undo_window)
+        restored = await self._journaled(user_id, journal.restore, self._tz_offset, since)
+        self.recent.invalidate(user_id)
+        return restored
+
+    async def prune_journal(self) -> int:
+        before = int(time.time() - self.undo_window)
+        removed = 0
+        while True:
+            n = await self._write(journal.prune, before)
+            removed += n
+            if n < journal.PRUNE_BATCH:
+                return removed
+            await asyncio.sleep(0)
+
+    # Фоновое обслуживание: чистка журнала раз в prune_interval и сверка кэша
+    # недавних трат с базой раз в recent_verify_interval (чтение на каждого
+    # закэшированного пользователя — не для интерактивных команд)
+    async def _maintenance_loop(self):
+        verified = time.monotonic()
+        while True:
+            await asyncio.sleep(self.prune_interval)
+            try:
+                removed = await self.prune_journal()
+                if removed:
+                    print(f"[journal] pruned {removed} entries")
+            except Exception as e:
+                print(f"[journal] prune failed: {e!r}")
+            if time.monotonic() - verified < self.recent_verify_interval:
+                continue
+            verified = time.monotonic()
+            try:
+                await self.check_recent()
+            except Exception as e:
+                print(f"[recent] verify failed: {e!r}")
+
+    # сверить кэш недавних трат и выбросить расходящиеся записи; число таких
+    async def check_recent(self) -> int:
+        drift = await self.verify_recent()
+        for user_id in drift:
+            self.recent.discard(user_id)
+        if drift:
+            print(f"[recent] {self.path}: dropped {len(drift)} stale entries")
+        self.recent_drift = len(drift)
+        return self.recent_drift
+
+    # ---------- Импорт ----------
+    # Импорт идёт в два шага. Сначала пачки файла складываются во временную
+    # таблицу писателя под номером импорта (stage_import), затем import_expenses
+    # переносит их в expenses порциями по времени траты, каждая — отдельной
+    # короткой транзакцией. Все строки с одним created_ts попадают в одну
+    # порцию, поэтому одинаковые по (created_ts, category, amount) строки
+    # нумеруются внутри неё, и n-я копия пишется, только если таких трат в базе
+    # (включая архив) меньше n: повторная загрузка файла ничего не дублирует, а
+    # настоящие одинаковые траты не склеиваются. Память процесса не зависит от
+    # размера файла — счёт ведёт SQLite.
+    def begin_import(self, user_id: int) -> int:
+        return next(self._import_tokens)
+
+    async def stage_import(self, user_id: int, token: int, rows: List[Tuple[float, str, str, int]]):
+        await self._write(self._stage_rows, token, rows)
+
+    # Перенести отложенные строки импорта token; (добавлено, пропущено как дубликаты)
+    async def import_expenses(self, user_id: int, token: int, chunk: int = 5000) -> Tuple[int, int]:
+        await self._writes.barrier(user_id)
+        self.profiles.write_started(user_id)
+        self.recent.write_started(user_id)
+        added = total = 0
+        after = None
+        try:
+            while True:
+                done = await self._write(self._import_chunk, user_id, token, after, chunk)
+                if done is None:
+                    return added, total - added
+                after, n_added, n_total = done
+                added += n_added
+                total += n_total
+        finally:
+            self.profiles.invalidate(user_id)
+            self.recent.invalidate(user_id)
+            await self.discard_import(user_id, token)
+
+    # выбросить отложенные строки импорта, не записывая их (импорт прерван)
+    async def discard_import(self, user_id: int, token: int):
+        await self._write(self._drop_staged, token)
+
+    @staticmethod
+    def _import_tables(conn):
+        conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS import_staged("
+            "token INTEGER, amount REAL, category TEXT, created_at TEXT, created_ts INTEGER)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS temp.idx_import_staged ON import_staged(token, created_ts)")
+        conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS import_rows("
+            "amount REAL, category TEXT, created_at TEXT, created_ts INTEGER, nth INTEGER)"
+        )
+
+    def _stage_rows(self, conn, token, rows):
+        self._import_tables(conn)
+        with conn:
+            conn.executemany(
+                "INSERT INTO import_staged VALUES (?,?,?,?,?)",
+                ((token, a, c, at, ts) for a, c, at, ts in rows),
+            )
+
+    def _drop_staged(self, conn, token):
+        self._import_tables(conn)
+        with conn:
+            conn.execute("DELETE FROM import_staged WHERE token=?", (token,))
+
+    # Порция — около chunk строк с created_ts в (after, hi]; граница hi берётся
+    # по индексу, так что строки одного момента не разрываются. Дальше всё
+    # делают запросы целиком по порции: нумерация копий, отсев уже записанного
+    # (подсчёт по покрывающему индексу idx_expenses_user_ts), вставка и
+    # агрегаты — один upsert на (день, категория). None — строк не осталось.
+    def _import_chunk(self, conn, user_id, token, after, chunk):
+        self._import_tables(conn)
+        lo = after if after is not None else -(1 << 62)
+        row = conn.execute(
+            "SELECT created_ts FROM import_staged WHERE token=? AND created_ts>? "
+            "ORDER BY created_ts LIMIT 1 OFFSET ?",
+            (token, lo, max(chunk, 1) - 1),
+        ).fetchone()
+        if row is None:
+            row = conn.execute(
+                "SELECT MAX(created_ts) FROM import_staged WHERE token=? AND created_ts>?", (token, lo)
+            ).fetchone()
+        hi = row[0]
+        if hi is None:
+            return None
+        with conn:
+            conn.execute("DELETE FROM import_rows")
+            total = conn.execute(
+                "INSERT INTO import_rows SELECT amount, category, created_at, created_ts, "
+                "ROW_NUMBER() OVER (PARTITION BY created_ts, category, amount) "
+                "FROM import_staged WHERE token=? AND created_ts>? AND created_ts<=?",
+                (token, lo, hi),
+            ).rowcount
+            # в архивных месяцах часть таких же трат уже не в expenses — номер
+            # строки сдвигается на их число (распаковываются только задетые месяцы)
+            archived = set(archive.archived_months(conn, user_id))
+            if archived:
+                stamps = conn.execute("SELECT DISTINCT created_ts FROM import_rows").fetchall()
+                months = {archive.month_of(self.day_of(ts)) for (ts,) in stamps} & archived
+                if months:
+                    counts = archive.row_counts(conn, user_id, sorted(months))
+                    conn.executemany(
+                        "UPDATE import_rows SET nth = nth - ? "
+                        "WHERE created_ts=? AND category=? AND amount=?",
+                        ((n, ts, c, a) for (ts, c, a), n in counts.items() if lo < ts <= hi),
+                    )
+            conn.execute(
+                "DELETE FROM import_rows WHERE nth <= (SELECT COUNT(*) FROM expenses e "
+                "WHERE e.user_id=? AND e.created_ts=import_rows.created_ts "
+                "AND e.category=import_rows.category AND e.amount=import_rows.amount)",
+                (user_id,),
+            )
+            added = conn.execute(
+                "INSERT INTO expenses(user_id,amount,category,created_at,created_ts) "
+                "SELECT ?, amount, category, created_at, created_ts FROM import_rows",
+                (user_id,),
+            ).rowcount
+            if added:
+                conn.execute(
+                    "INSERT INTO daily_totals(user_id, day, category, sum, count) "
+                    "SELECT ?, (created_ts + ?) / 86400, category, SUM(amount), COUNT(*) "
+                    "FROM import_rows WHERE true GROUP BY 2, 3 "
+                    "ON CONFLICT(user_id, day, category) DO UPDATE "
+                    "SET sum=sum+excluded.sum, count=count+excluded.count",
+                    (user_id, self._tz_offset),
+                )
+                # даты импорта произвольные, поэтому серию дней пересчитываем целиком
+                rollup.recompute_user_stats(conn, [user_id])
+            conn.execute("DELETE FROM import_rows")
+            conn.execute(
+                "DELETE FROM import_staged WHERE token=? AND created_ts>? AND created_ts<=?", (token, lo, hi)
+            )
+        return hi, added, total
+
+    # ---------- Чтение ----------
+    # Окна внутри последних RecentCache.window_days дней («Сегодня», «7 дней»)
+    # считаются по кэшу недавних трат без обращения к базе
+    async def fetch_stats(self, user_id: int, start: datetime, end: datetime):
+        await self._writes.barrier(user_id)
+        start_day, end_day = self.day_of(int(start.timestamp())), self.day_of(int(end.timestamp()))
+        today = self.today()
+        if self.recent.enabled and self.recent.window_start(today) <= start_day and end_day <= today + 1:
+            entry = await self._recent(user_id, start_day, today)
+            if entry.since_day <= start_day:
+                sums = self.recent.totals(entry, start_day, end_day)
+                rows = [{"category": c, "total": t} for c, t in sorted(sums.items(), key=lambda kv: -kv[1])]
+                return sum(sums.values()), rows
+        return await self._read(self._fetch_stats, user_id, start, end)
+
+    # (amount, category) траты, которую снимет следующий /undo, или None
+    async def last_expense(self, user_id: int) -> Optional[Tuple[float, str]]:
+        await self._writes.barrier(user_id)
+        last = None
+        if self.recent.enabled:
+            today = self.today()
+            last = (await self._recent(user_id, today, today)).last
+        # после /undo последняя трата неизвестна — её не кэшируем: отвечать за
+        # неё пришлось бы той же развязкой загрузки и записи
+        last = last or await self._read(self._last_expense, user_id)
+        return None if last is None else (last[1], last[2])
+
+    async def _recent(self, user_id: int, start_day: int, today: int):
+        entry = self.recent.get(user_id, start_day, today)
+        if entry is None:
+            token = self.recent.begin_load(user_id)
+            since_day, items, last = await self._read(self._load_recent, user_id, self.recent.window_start(today))
+            entry = self.recent.finish_load(user_id, token, since_day, items, last)
+        return entry
+
+    # Траты с днём >= since_day (по индексу idx_expenses_user_ts); если их
+    # больше capacity — только самые поздние, и покрытие начинается позже
+    def _load_recent(self, conn, user_id, since_day):
+        cap = self.recent.capacity
+        rows = conn.execute(
+            "SELECT id, created_ts, category, amount FROM expenses "
+            "WHERE user_id=? AND created_ts>=? ORDER BY created_ts DESC LIMIT ?",
+            (user_id, since_day * 86400 - self._tz_offset, cap + 1),
+        ).fetchall()
+        items = [(r[0], self.day_of(r[1]), r[2], r[3]) for r in rows]
+        if len(items) > cap:
+            since_day = items[-1][1] + 1
+            items = [i for i in items if i[1] >= since_day]
+        items.sort()
+        return since_day, items, self._last_expense(conn, user_id)
+
+    @staticmethod
+    def _last_expense(conn, user_id):
+        row = conn.execute(
+            "SELECT id, amount, category FROM expenses WHERE user_id=? ORDER BY id DESC LIMIT 1", (user_id,)
+        ).fetchone()
+        return tuple(row) if row else None
+
+    # Сверка кэша недавних трат с базой: user_id, у которых набор трат
+    # с днём >= since_day расходится
+    async def verify_recent(self) -> List[int]:
+        drift = []
+        for user_id in self.recent.user_ids():
+            await self._writes.barrier(user_id)
+            entry = self.recent.get(user_id, 1 << 30, self.today())
+            if entry is None:
+                continue
+            since_day = entry.since_day
+            cached = sorted(i for i in self.recent.items(entry) if i[1] >= since_day)
+            _, items, _ = await self._read(self._load_recent_exact, user_id, since_day)
+            if cached != items:
+                drift.append(user_id)
+        return drift
+
+    def _load_recent_exact(self, conn, user_id, since_day):
+        rows = conn.execute(
+            "SELECT id, created_ts, category, amount FROM expenses WHERE user_id=? AND created_ts>=? ORDER BY id",
+            (user_id, since_day * 86400 - self._tz_offset),
+        ).fetchall()
+        return since_day, [(r[0], self.day_of(r[1]), r[2], r[3]) for r in rows], None
+
+    # границы периода выровнены по локальным дням, поэтому хватает daily_totals:
+    # стоимость зависит от числа дней в окне, а не от числа трат. Месяцы,
+    # ушедшие в архив, берутся из monthly_totals, если окно накрывает их первое число.
+    def _fetch_stats(self, conn, user_id, start, end):
+        start_day, end_day = self.day_of(int(start.timestamp())), self.day_of(int(end.timestamp()))
+        m_from, m_to = archive.months_within(start_day, end_day)
+        rows = conn.execute(
+            "SELECT category, SUM(sum) AS total FROM ("
+            "SELECT category, sum FROM daily_totals WHERE user_id=? AND day>=? AND day<? "
+            "UNION ALL SELECT category, sum FROM monthly_totals WHERE user_id=? AND month>=? AND month<=?"
+            ") GROUP BY category ORDER BY total DESC",
+            (user_id, start_day, end_day, user_id, m_from, m_to),
+        ).fetchall()
+        total = sum((r["total"] or 0) for r in rows)
+        return total, rows
+
+    # Окно daily_totals колонками (день, индекс категории, сумма) для
+    # analytics.build_series; имена категорий — по порядку индексов
+    async def fetch_daily_columns(self, user_id: int, start_day: int, end_day: int):
+        await self._writes.barrier(user_id)
+        return await self._read(self._fetch_daily_columns, user_id, start_day, end_day)
+
+    def _fetch_daily_columns(self, conn, user_id, start_day, end_day):
+        days, cats, sums = array("l"), array("H"), array("d")
+        names: Dict[str, int] = {}
+        cur = conn.cursor()
+        cur.row_factory = None
+        for day, category, total in cur.execute(
+            "SELECT day, category, sum FROM daily_totals WHERE user_id=? AND day>=? AND day<?",
+            (user_id, start_day, end_day),
+        ):
+            idx = names.get(category)
+            if idx is None:
+                idx = names[category] = len(names)
+            days.append(day)
+            cats.append(idx)
+            sums.append(total)
+        # архивные месяцы — одной точкой на первое число (помесячная точность)
+        m_from, m_to = archive.months_within(start_day, end_day)
+        for month, category, total in cur.execute(
+            "SELECT month, category, sum FROM monthly_totals WHERE user_id=? AND month>=? AND month<=?",
+            (user_id, m_from, m_to),
+        ):
+            idx = names.get(category)
+            if idx is None:
+                idx = names[category] = len(names)
+            days.append(archive.month_start(month))
+            cats.append(idx)
+            sums.append(total)
+        return days, cats, sums, list(names)
+
+    # Выгрузка истории: строки отдаются sink пачками по EXPORT_CHUNK прямо
+    # из курсора в потоке-читателе, целиком в памяти история не держится
+    async def export_rows(
+        self,
+        user_id: int,
+        sink: Callable[[List[sqlite3.Row]], None],
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        category: Optional[str] = None,
+    ) -> int:
+        await self._writes.barrier(user_id)
+        return await self._read(self._export_rows, user_id, sink, start, end, category)
+
+    # Если у пользователя есть архив, после горячих строк идут архивные:
+    # они сливаются по времени с горячими строками старше границы архива
+    # (траты задним числом, которые ещё не перенесены)
+    def _export_rows(self, conn, user_id, sink, start, end, category):
+        start_ts = int(start.timestamp()) if start is not None else None
+        end_ts = int(end.timestamp()) if end is not None else None
+        boundary = archive.archive_boundary_ts(conn, user_id, self._tz_offset)
+        sql = "SELECT amount, category, created_at, created_ts FROM expenses WHERE user_id=?"
+        args: List[Any] = [user_id]
+        if start_ts is not None:
+            sql += " AND created_ts>=?"
+            args.append(start_ts)
+        if end_ts is not None:
+            sql += " AND created_ts<?"
+            args.append(end_ts)
+        if category is not None:
+            sql += " AND category=?"
+            args.append(category)
+        hot = sql if boundary is None else sql + f" AND created_ts>={boundary}"
+        count = self._drain(conn.execute(hot + " ORDER BY created_ts DESC", args), sink)
+        if boundary is None or (start_ts is not None and start_ts >= boundary):
+            return count
+        older = conn.execute(sql + f" AND created_ts<{boundary} ORDER BY created_ts DESC", args).fetchall()
+        merged = heapq.merge(
+            older,
+            archive.iter_rows(conn, user_id, self._tz_offset, start_ts, end_ts, category),
+            key=lambda r: r["created_ts"],
+            reverse=True,
+        )
+        chunk = []
+        for row in merged:
+            chunk.append(row)
+            if len(chunk) >= EXPORT_CHUNK:
+                sink(chunk)
+                count += len(chunk)
+                chunk = []
+        if chunk:
+            sink(chunk)
+            count += len(chunk)
+        return count
+
+    @staticmethod
+    def _drain(cur: sqlite3.Cursor, sink: Callable[[List[sqlite3.Row]], None]) -> int:
+        count = 0
+        while True:
+            rows = cur.fetchmany(EXPORT_CHUNK)
+            if not rows:
+                return count
+            sink(rows)
+            count += len(rows)
+
+    async def user_profile(self, user_id: int) -> dict:
+        await self._writes.barrier(user_id)
+        today = self.today()
+        entry = self.profiles.get(user_id, today)
+        if entry is None:
+            token = self.profiles.begin_load(user_id)
+            entry = await self._read(self._load_profile, user_id, today)
+            self.profiles.finish_load(user_id, token, entry)
+        return entry.as_dict()
+
+    # один проход по агрегатам пользователя — дневным и помесячным архивным:
+    # суммы по категориям за всё время и за 30 дней (они всегда в дневных),
+    # плюс счётчики дней из user_stats
+    def _load_profile(self, conn, user_id, today):
+        stats = conn.execute(
+            "SELECT days_total, last_day, streak FROM user_stats WHERE user_id=?", (user_id,)
+        ).fetchone()
+        rows = conn.execute(
+            "SELECT category, SUM(sum) AS s, SUM(s30) AS s30 FROM ("
+            "SELECT category, sum, CASE WHEN day>? THEN sum ELSE 0 END AS s30 "
+            "FROM daily_totals WHERE user_id=? "
+            "UNION ALL SELECT category, sum, 0 FROM monthly_totals WHERE user_id=?"
+            ") GROUP BY category",
+            (today - 30, user_id, user_id),
+        ).fetchall() if stats else []
+        stats = tuple(stats) if stats else None
+        return ProfileEntry(
+            today,
+            {r["category"]: float(r["s"]) for r in rows},
+            float(sum(r["s30"] for r in rows)),
+            stats,
+        )
+
+    # ---------- FSM ----------
+    async def fsm_load(self, key: str) -> Optional[Tuple[Optional[str], Optional[str], int]]:
+        return await self._read(self._fsm_load, key)
+
+    def _fsm_load(self, conn, key):
+        row = conn.execute("SELECT state, data, updated_ts FROM fsm WHERE key=?", (key,)).fetchone()
+        return tuple(row) if row else None
+
+    # changes: ключ -> (state, data, updated_ts) или None — удалить
+    async def fsm_write(self, changes: Dict[str, Optional[Tuple[Optional[str], Optional[str], int]]]):
+        await self._write(self._fsm_write, changes)
+
+    def _fsm_write(self, conn, changes):
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO fsm(key, state, data, updated_ts) VALUES (?,?,?,?)",
+                [(k, *v) for k, v in changes.items() if v is not None],
+            )
+            conn.executemany(
+                "DELETE FROM fsm WHERE key=?",
+                [(k,) for k, v in changes.items() if v is None],
+            )
+
+    async def fsm_expire(self, before_ts: int, limit: int) -> int:
+        return await self._write(self._fsm_expire, before_ts, limit)
+
+    def _fsm_expire(self, conn, before_ts, limit):
+        with conn:
+            return conn.execute(
+                "DELETE FROM fsm WHERE key IN "
+                "(SELECT key FROM fsm WHERE updated_ts<? LIMIT ?)",
+                (before_ts, limit),
+            ).rowcount
+
+    # ---------- Дайджесты ----------
+    async def get_subscription(self, user_id: int) -> Optional[str]:
+        return await self._read(self._get_subscription, user_id)
+
+    def _get_subscription(self, conn, user_id):
+        row = conn.execute("SELECT period FROM subscriptions WHERE user_id=?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    # period=None — отписка
+    async def set_subscription(self, user_id: int, chat_id: int, period: Optional[str]):
+        await self._write(self._set_subscription, user_id, chat_id, period)
+
+    def _set_subscription(self, conn, user_id, chat_id, period):
+        with conn:
+            if period is None:
+                conn.execute("DELETE FROM subscriptions WHERE user_id=?", (user_id,))
+            else:
+                conn.execute(
+                    "INSERT INTO subscriptions(user_id, chat_id, period, created_ts) VALUES (?,?,?,?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET chat_id=excluded.chat_id, period=excluded.period",
+                    (user_id, chat_id, period, int(time.time())),
+                )
+
+    # Страница дайджестов: один агрегат по daily_totals сразу для следующих
+    # limit подписчиков после after_user. Текущее окно [cur_from, cur_to)
+    # и предыдущее [prev_from, cur_from) считаются в одном проходе.
+    # Возвращает [(user_id, chat_id, [(category, cur, prev), ...])] по user_id.
+    async def digest_page(
+        self, period: str, prev_from: int, cur_from: int, cur_to: int, after_user: int, limit: int
+    ) -> List[Tuple[int, int, List[Tuple[str, float, float]]]]:
+        return await self._read(self._digest_page, period, prev_from, cur_from, cur_to, after_user, limit)
+
+    def _digest_page(self, conn, period, prev_from, cur_from, cur_to, after_user, limit):
+        cur = conn.cursor()
+        cur.row_factory = None
+        rows = cur.execute(
+            "WITH page AS (SELECT user_id, chat_id FROM subscriptions "
+            "WHERE period=? AND user_id>? ORDER BY user_id LIMIT ?) "
+            "SELECT p.user_id, p.chat_id, d.category, "
+            "SUM(CASE WHEN d.day>=? THEN d.sum ELSE 0 END), "
+            "SUM(CASE WHEN d.day<? THEN d.sum ELSE 0 END) "
+            "FROM page p LEFT JOIN daily_totals d "
+            "ON d.user_id=p.user_id AND d.day>=? AND d.day<? "
+            "GROUP BY p.user_id, d.category ORDER BY p.user_id",
+            (period, after_user, limit, cur_from, cur_from, prev_from, cur_to),
+        ).fetchall()
+        page: List[Tuple[int, int, List[Tuple[str, float, float]]]] = []
+        for user_id, chat_id, category, cur_sum, prev_sum in rows:
+            if not page or page[-1][0] != user_id:
+                page.append((user_id, chat_id, []))
+            if category is not None:
+                page[-1][2].append((category, cur_sum or 0.0, prev_sum or 0.0))
+        return page
+
+    async def digest_run(self, run_id: str, period: str) -> Tuple[int, int, int, Optional[int]]:
+        return await self._write(self._digest_run, run_id, period)
+
+    # создать запуск, если его ещё нет; (last_user_id, sent, failed, finished_ts)
+    def _digest_run(self, conn, run_id, period):
+        with conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO digest_runs(run_id, period, started_ts) VALUES (?,?,?)",
+                (run_id, period, int(time.time())),
+            )
+            return tuple(conn.execute(
+                "SELECT last_user_id, sent, failed, finished_ts FROM digest_runs WHERE run_id=?", (run_id,)
+            ).fetchone())
+
+    async def digest_checkpoint(self, run_id: str, last_user_id: int, sent: int, failed: int, finished: bool = False):
+        await self._write(self._digest_checkpoint, run_id, last_user_id, sent, failed, finished)
+
+    def _digest_checkpoint(self, conn, run_id, last_user_id, sent, failed, finished):
+        with conn:
+            conn.execute(
+                "UPDATE digest_runs SET last_user_id=?, sent=?, failed=?, finished_ts=? WHERE run_id=?",
+                (last_user_id, sent, failed, int(time.time()) if finished else None, run_id),
+            )
+
+    # ---------- Хранение ----------
+    def retention_cutoff(self, keep_days: int) -> int:
+        return archive.cutoff_day(self.today(), keep_days)
+
+    # перенос старых дней следующих limit пользователей в архив (см. archive.py);
+    # видимые пользователю суммы не меняются, поэтому кэш профилей не трогаем
+    async def archive_slice(self, cutoff: int, after_user: int, limit: int) -> Optional[Tuple[int, int]]:
+        return await self._write(archive.archive_slice, self._tz_offset, cutoff, after_user, limit)
+
+    async def incremental_vacuum(self, pages: int) -> int:
+        return await self._write(archive.incremental_vacuum, pages)
+
+    async def auto_vacuum_incremental(self) -> bool:
+        return await self._read(archive.auto_vacuum_incremental)
+
+    # ---------- Обслуживание ----------
+    async def verify_rollup(self) -> List[Tuple]:
+        return await self._read(rollup.verify, self._tz_offset)
+
+    async def rebuild_rollup(self) -> int:
+        return await self._write(rollup.rebuild, self._tz_offset)
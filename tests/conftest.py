@@ -0,0 +1,51 @@
+import asyncio
+import os
+import sys
+from datetime import timezone
+
+import pytest
+
+# модули бота лежат в корне репозитория; main.py требует BOT_TOKEN при импорте
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "1:test")
+
+from storage import Storage  # noqa: E402
+
+
+# ---------- Общие фикстуры ----------
+# pytest-asyncio в зависимостях нет: у теста свой event loop, а run(coro)
+# выполняет корутину в нём. Хранилища открываются в том же loop — их фоновые
+# задачи живут, пока идёт тест, и закрываются после него.
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.run_until_complete(loop.shutdown_asyncgens())
+    loop.close()
+
+
+@pytest.fixture
+def run(loop):
+    return loop.run_until_complete
+
+
+# make_store(**opts) — открытое Storage в tmp_path; имя файла отличает
+# несколько баз одного теста
+@pytest.fixture
+def make_store(tmp_path, run):
+    stores = []
+
+    def make(name: str = "finances.db", tz=timezone.utc, **opts) -> Storage:
+        store = Storage(str(tmp_path / name), tz, **opts)
+        run(store.open())
+        stores.append(store)
+        return store
+
+    yield make
+    for store in stores:
+        run(store.close())
+
+
+@pytest.fixture
+def store(make_store) -> Storage:
+    return make_store()
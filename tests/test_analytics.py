@@ -0,0 +1,61 @@
+import random
+from array import array
+from datetime import date, datetime, time, timedelta, timezone
+
+import analytics
+
+
+def test_bucket_starts_align_to_weeks_and_months():
+    assert analytics.bucket_starts(date(2024, 1, 3), date(2024, 1, 17), "week") == [
+        date(2024, 1, 1), date(2024, 1, 8), date(2024, 1, 15)]
+    assert analytics.bucket_starts(date(2023, 11, 20), date(2024, 2, 1), "month") == [
+        date(2023, 11, 1), date(2023, 12, 1), date(2024, 1, 1)]
+    assert analytics.auto_granularity(date(2024, 1, 1), date(2024, 2, 1)) == "day"
+    assert analytics.auto_granularity(date(2024, 1, 1), date(2024, 4, 1)) == "week"
+    assert analytics.auto_granularity(date(2023, 1, 1), date(2024, 1, 1)) == "month"
+
+
+def test_series_matches_a_naive_sum_per_bucket():
+    rnd = random.Random(5)
+    start, end = date(2024, 1, 10), date(2024, 4, 20)
+    prev_start = start - (end - start)
+    names = ["a", "b", "c"]
+    rows = [(analytics.day_number(prev_start) + rnd.randrange((end - prev_start).days), rnd.randrange(3),
+             float(rnd.randint(1, 100))) for _ in range(2000)]
+    days, cats, sums = array("l"), array("H"), array("d")
+    for d, c, s in rows:
+        days.append(d)
+        cats.append(c)
+        sums.append(s)
+    series = analytics.build_series(days, cats, sums, names, start, end, "week")
+    starts = series.starts
+    for cat in range(3):
+        expected = []
+        for i, s in enumerate(starts):
+            lo = max(analytics.day_number(s), analytics.day_number(start))
+            hi = analytics.day_number(starts[i + 1]) if i + 1 < len(starts) else analytics.day_number(end)
+            expected.append(sum(v for d, c, v in rows if c == cat and lo <= d < hi))
+        assert list(series.row(cat)) == expected
+        assert series.previous[cat] == sum(v for d, c, v in rows if c == cat and d < analytics.day_number(start))
+    assert sum(series.bucket_totals()) == sum(r[1] for r in series.category_totals())
+
+
+def test_movers_compare_with_the_previous_period():
+    series = analytics.Series(["a", "b", "c"], [date(2024, 1, 1)], array("d", [50.0, 10.0, 0.0]),
+                              array("d", [20.0, 40.0, 5.0]))
+    up, down = series.movers()
+    assert up == [("a", 30.0)]
+    assert down == [("b", -30.0), ("c", -5.0)]
+
+
+def test_daily_columns_include_archived_months(store, run):
+    today = datetime.now(timezone.utc).date()
+    old = datetime.combine(today - timedelta(days=200), time(12), timezone.utc)
+    run(store.add_expenses(1, [(10.0, "Еда", old), (5.0, "Кофе", old), (1.0, "Еда", datetime.now(timezone.utc))]))
+    run(store.archive_slice(store.retention_cutoff(62), 0, 100))
+    start = today - timedelta(days=365)
+    days, cats, sums, names = run(store.fetch_daily_columns(
+        1, analytics.day_number(start), analytics.day_number(today) + 1))
+    series = analytics.build_series(days, cats, sums, names, start, today + timedelta(days=1), "month")
+    totals = {name: total for name, total, _ in series.category_totals()}
+    assert totals == {"Еда": 11.0, "Кофе": 5.0}
@@ -0,0 +1,65 @@
+import pytest
+
+import callbacks
+import main as bot
+
+
+def test_every_action_round_trips_within_telegram_limit():
+    for name, (code, spec) in bot.CODEC.actions.items():
+        if spec is None:
+            values = [None]
+        elif spec is int:
+            values = [0, 7, 10 ** callbacks.MAX_INT_DIGITS - 1]
+        else:
+            values = list(spec)
+        for value in values:
+            data = bot.CODEC.encode(name, value)
+            # callback_data в Telegram ограничен 64 байтами
+            assert len(data.encode()) <= 64
+            assert bot.CODEC.decode(data) == (name, value)
+
+
+def test_legacy_buttons_still_decode():
+    assert bot.CODEC.decode("pick:3") == ("pick", 3)
+    assert bot.CODEC.decode("page:1") == ("page", 1)
+    assert bot.CODEC.decode("menu:add") == ("menu", "add")
+    assert bot.CODEC.decode("stats:7d") == ("stats", "7d")
+    assert bot.CODEC.decode("myreset:confirm") == ("reset", "confirm")
+    assert bot.CODEC.decode("noop") == ("noop", None)
+
+
+@pytest.mark.parametrize("data", [
+    None, "", "1", "1x", "1p", "1p.", "1p.-1", "1p.²", "1p. 3", "1p.1234567",
+    "1m.6", "1m.a", "1n.0", "9p.1", "pick:", "pick:x", "menu:delete", "myreset:", "noop:1", "unknown:1",
+])
+def test_broken_payloads_decode_to_none(data):
+    assert bot.CODEC.decode(data) is None
+
+
+def test_table_prefers_exact_value_then_any_value():
+    codec = callbacks.CallbackCodec({"menu": ("m", ("add", "help")), "pick": ("p", int)})
+    table = callbacks.CallbackTable(codec)
+
+    @table.on("menu", "add")
+    async def add(cb, state, arg):
+        pass
+
+    @table.on("pick")
+    async def pick(cb, state, arg):
+        pass
+
+    assert table.resolve(codec.encode("menu", "add")) == (add, "add")
+    assert table.resolve(codec.encode("pick", 5)) == (pick, 5)
+    # help никем не обрабатывается
+    assert table.resolve(codec.encode("menu", "help")) is None
+    assert table.resolve("garbage") is None
+    with pytest.raises(KeyError):
+        table.on("stats")
+
+
+def test_every_bot_button_has_a_handler():
+    kb = bot.Keyboards()
+    for markup in (kb.main_menu, kb.stats, kb.reset_confirm, kb.reset_restore, *kb.category_pages):
+        for row in markup.inline_keyboard:
+            for button in row:
+                assert bot.CALLBACKS.resolve(button.callback_data) is not None, button.text
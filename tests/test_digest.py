@@ -0,0 +1,89 @@
+import asyncio
+from datetime import date, datetime, time, timezone
+
+from aiogram.exceptions import TelegramForbiddenError
+from aiogram.methods import SendMessage
+
+from digest import DigestScheduler
+
+TODAY = date(2024, 6, 15)
+RENDER = lambda period, start, end, rows: "digest"
+
+
+class Crash(Exception):
+    pass
+
+
+# отправка сразу «доставляет»; после crash_after сводок процесс «падает»,
+# чаты из blocked отвечают «бот заблокирован»
+class FakeSender:
+    def __init__(self, delivered, crash_after=None, blocked=()):
+        self.delivered = delivered
+        self.crash_after = crash_after
+        self.blocked = blocked
+
+    def send(self, chat_id, text, **kwargs):
+        if self.crash_after is not None and len(self.delivered) >= self.crash_after:
+            raise Crash()
+        fut = asyncio.get_running_loop().create_future()
+        if chat_id in self.blocked:
+            fut.set_exception(TelegramForbiddenError(SendMessage(chat_id=chat_id, text=text), "blocked"))
+        else:
+            self.delivered.append(chat_id)
+            fut.set_result(None)
+        return fut
+
+
+def scheduler(store, sender, render=RENDER):
+    return DigestScheduler(store, sender, render, timezone.utc, rate=1000, page_size=7)
+
+
+def subscribe(store, run, users, period="daily"):
+    for user_id in users:
+        run(store.set_subscription(user_id, 1000 + user_id, period))
+
+
+def test_resume_after_crash_mid_page_sends_no_digest_twice(store, run):
+    subscribe(store, run, range(1, 31))
+    delivered = []
+    try:
+        run(scheduler(store, FakeSender(delivered, crash_after=17)).run("daily", TODAY))
+    except Crash:
+        pass
+    run(scheduler(store, FakeSender(delivered)).run("daily", TODAY))
+    assert len(delivered) == len(set(delivered))
+    # 18-я упала уже после своего чекпоинта — она пропадает, а не уходит дважды
+    assert sorted(delivered) == [1000 + u for u in range(1, 31) if u != 18]
+
+
+def test_finished_run_is_not_repeated_and_blocked_chats_unsubscribe(store, run):
+    subscribe(store, run, range(1, 11))
+    delivered = []
+    sent, failed = run(scheduler(store, FakeSender(delivered, blocked={1003})).run("daily", TODAY))
+    assert (sent, failed) == (9, 1)
+    assert run(store.get_subscription(3)) is None
+    assert run(scheduler(store, FakeSender(delivered)).run("daily", TODAY)) == (9, 1)
+    assert len(delivered) == 9
+
+
+def test_page_aggregates_current_and_previous_window(store, run):
+    subscribe(store, run, (1, 2, 3), "weekly")
+    subscribe(store, run, (4,), "daily")
+    week_start = datetime.combine(date(2024, 6, 10), time(12), timezone.utc)
+    run(store.add_expenses(1, [(10.0, "Еда", week_start), (4.0, "Еда", datetime(2024, 6, 5, tzinfo=timezone.utc)),
+                               (3.0, "Кофе", datetime(2024, 6, 16, tzinfo=timezone.utc))]))
+    start, end = DigestScheduler.window("weekly", date(2024, 6, 17))
+    assert (start, end) == (date(2024, 6, 10), date(2024, 6, 17))
+    cur_from, cur_to = store.day_of(int(week_start.timestamp())), store.day_of(int(week_start.timestamp())) + 7
+    page = run(store.digest_page("weekly", cur_from - 7, cur_from, cur_to, 0, 2))
+    assert [(u, c, sorted(rows)) for u, c, rows in page] == [
+        (1, 1001, [("Еда", 10.0, 4.0), ("Кофе", 3.0, 0.0)]), (2, 1002, [])]
+    assert [p[0] for p in run(store.digest_page("weekly", 0, 1, 2, 2, 10))] == [3]
+
+
+def test_render_skips_users_without_text(store, run):
+    subscribe(store, run, range(1, 6))
+    delivered = []
+    render = lambda period, start, end, rows: None
+    assert run(scheduler(store, FakeSender(delivered), render).run("daily", TODAY)) == (0, 0)
+    assert delivered == []
@@ -0,0 +1,48 @@
+import pytest
+
+from entries import AliasIndex, parse_entries
+
+INDEX = AliasIndex([("☕ Кофе", "Кофе"), ("🚕 Такси", "Такси"), ("🛒 Продукты", "Продукты")])
+
+
+def parsed(text):
+    entries = parse_entries(text, INDEX)
+    return None if entries is None else [(e.amount, e.category) for e in entries]
+
+
+def test_several_entries():
+    assert parsed("390 кофе, 1200 продукты; такси 250") == [(390.0, "Кофе"), (1200.0, "Продукты"), (250.0, "Такси")]
+    assert parsed("12,5 кофе") == [(12.5, "Кофе")]
+
+
+@pytest.mark.parametrize("text", [
+    "2 кофе 390",
+    "15 мин назад 200 такси",
+    "1 200 такси",
+    "390 кофе, 2 кофе 390",
+])
+def test_chunk_with_more_than_one_number_is_rejected(text):
+    assert parsed(text) is None
+
+
+def test_aliases_resolve_by_synonym_prefix_and_typo():
+    assert INDEX.resolve("капучино") == "Кофе"
+    assert INDEX.resolve("такс") == "Такси"
+    assert INDEX.resolve("прдукты") == "Продукты"
+    assert INDEX.resolve("Ёжик") is None
+
+
+def test_ambiguous_prefix_is_not_guessed():
+    index = AliasIndex([("Кофе", "Кофе"), ("Коммуналка", "Коммуналка")])
+    assert index.resolve("ко") is None
+    assert index.resolve("коф") == "Кофе"
+
+
+def test_amount_forms_and_unknown_words():
+    assert parsed("250₽ такси\n99 руб.") == [(250.0, "Такси"), (99.0, None)]
+    assert parsed("непонятное 40") == [(40.0, None)]
+
+
+@pytest.mark.parametrize("text", ["", "кофе", "0 кофе", ", ;", "; ".join(["1 кофе"] * 51)])
+def test_messages_that_are_not_entries(text):
+    assert parsed(text) is None
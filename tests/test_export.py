@@ -0,0 +1,67 @@
+import gzip
+import io
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import main as bot
+import storage
+
+DAY = datetime(2024, 3, 10, 12, 0, tzinfo=timezone.utc)
+
+
+def export(store, run, user_id=1, **filters):
+    chunks = []
+    count = run(store.export_rows(user_id, chunks.append, **filters))
+    rows = [(r["amount"], r["category"], r["created_at"]) for chunk in chunks for r in chunk]
+    assert count == len(rows)
+    return rows, [len(c) for c in chunks]
+
+
+def test_rows_stream_in_chunks_newest_first(store, run, monkeypatch):
+    monkeypatch.setattr(storage, "EXPORT_CHUNK", 4)
+    run(store.add_expenses(1, [(float(i), "Еда", DAY + timedelta(hours=i)) for i in range(10)]))
+    run(store.add_expense(2, 99.0, "Еда", DAY))
+    rows, sizes = export(store, run)
+    assert sizes == [4, 4, 2]
+    assert [r[0] for r in rows] == [float(i) for i in range(9, -1, -1)]
+
+
+def test_filters_by_period_and_category(store, run):
+    run(store.add_expenses(1, [(1.0, "Еда", DAY), (2.0, "Кофе", DAY + timedelta(days=1)),
+                               (3.0, "Еда", DAY + timedelta(days=2))]))
+    rows, _ = export(store, run, start=DAY + timedelta(hours=1), end=DAY + timedelta(days=3))
+    assert [r[0] for r in rows] == [3.0, 2.0]
+    rows, _ = export(store, run, category="Еда")
+    assert [r[0] for r in rows] == [3.0, 1.0]
+
+
+def test_archived_rows_merge_into_the_export(store, run):
+    old = datetime.now(timezone.utc) - timedelta(days=200)
+    run(store.add_expenses(1, [(1.0, "Еда", old), (2.0, "Еда", old + timedelta(days=1))]))
+    run(store.archive_slice(store.retention_cutoff(62), 0, 100))
+    # трата задним числом старше границы архива ещё в горячей таблице
+    run(store.add_expense(1, 3.0, "Еда", old + timedelta(hours=12)))
+    run(store.add_expense(1, 4.0, "Еда", datetime.now(timezone.utc)))
+    rows, _ = export(store, run)
+    assert [r[0] for r in rows] == [4.0, 2.0, 3.0, 1.0]
+
+
+def test_export_args():
+    start, end, category, compress = bot.parse_export_args("2024-01-01 2024-01-31 кофе gz")
+    assert (start.date().isoformat(), end.date().isoformat()) == ("2024-01-01", "2024-02-01")
+    assert (category, compress) == ("Кофе", True)
+    assert bot.parse_export_args("") == (None, None, None, False)
+    with pytest.raises(ValueError):
+        bot.parse_export_args("2024-01-01 2024-01-02 2024-01-03")
+    with pytest.raises(ValueError):
+        bot.parse_export_args("Нет такой")
+
+
+def test_csv_sink_writes_gzip_stream(store, run):
+    run(store.add_expense(1, 12.5, "Еда", DAY))
+    buf = io.BytesIO()
+    out = gzip.GzipFile(fileobj=buf, mode="wb")
+    run(store.export_rows(1, bot.csv_sink(out)))
+    out.close()
+    assert gzip.decompress(buf.getvalue()).decode() == f"12.5;Еда;{DAY.isoformat()}\n"
@@ -0,0 +1,81 @@
+import asyncio
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+
+from fsm_storage import SQLiteStorage
+
+
+def key(chat_id=10, user_id=1):
+    return StorageKey(bot_id=1, chat_id=chat_id, user_id=user_id)
+
+
+def test_state_survives_a_restart(make_store, run):
+    store = make_store()
+    fsm = SQLiteStorage(store)
+    run(fsm.set_state(key(), "Add:amount"))
+    run(fsm.set_data(key(), {"amount": 150.0, "note": "кофе"}))
+    run(fsm.close())
+    run(store.close())
+
+    # новый процесс: пустой кэш, та же база
+    fsm = SQLiteStorage(make_store())
+    assert run(fsm.get_state(key())) == "Add:amount"
+    assert run(fsm.get_data(key())) == {"amount": 150.0, "note": "кофе"}
+    assert run(fsm.get_state(key(chat_id=11))) is None
+
+
+def test_hot_keys_are_served_from_cache(store, run, monkeypatch):
+    fsm = SQLiteStorage(store)
+    run(fsm.set_state(key(), "S"))
+    loads = []
+    load = store.fsm_load
+
+    async def counted(k):
+        loads.append(k)
+        return await load(k)
+
+    monkeypatch.setattr(store, "fsm_load", counted)
+    for _ in range(5):
+        assert run(fsm.get_state(key())) == "S"
+    assert loads == []
+    # данные, полученные наружу, — копия: правка не портит кэш
+    run(fsm.get_data(key()))["x"] = 1
+    assert run(fsm.get_data(key())) == {}
+
+
+def test_concurrent_writes_share_one_flush(store, run, monkeypatch):
+    fsm = SQLiteStorage(store)
+    writes = []
+    write = store.fsm_write
+
+    async def counted(changes):
+        writes.append(dict(changes))
+        await write(changes)
+
+    monkeypatch.setattr(store, "fsm_write", counted)
+
+    async def go():
+        # ключи уже в кэше: все записи приходят в одном проходе цикла событий
+        for u in range(20):
+            await fsm.get_state(key(user_id=u))
+        await asyncio.gather(*(fsm.set_state(key(user_id=u), f"S{u}") for u in range(20)))
+        # очищенное состояние удаляет строку
+        await fsm.set_state(key(user_id=0), None)
+
+    run(go())
+    assert len(writes) == 2 and len(writes[0]) == 20
+    assert writes[1] == {SQLiteStorage._key(key(user_id=0)): None}
+    assert run(store.fsm_load(SQLiteStorage._key(key(user_id=0)))) is None
+
+
+def test_sweep_expires_old_states(store, run):
+    fsm = SQLiteStorage(store, ttl=3600)
+    run(fsm.set_state(key(user_id=1), "old"))
+    run(fsm.set_state(key(user_id=2), "fresh"))
+    old = SQLiteStorage._key(key(user_id=1))
+    run(store.fsm_write({old: ("old", None, int(time.time()) - 7200)}))
+    fsm._cache[old] = ("old", {}, time.time() - 7200)
+    assert run(fsm.sweep()) == 1
+    assert run(fsm.get_state(key(user_id=1))) is None
+    assert run(fsm.get_state(key(user_id=2))) == "fresh"
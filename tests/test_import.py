@@ -0,0 +1,144 @@
+import asyncio
+import gzip
+import io
+from datetime import datetime, timezone
+
+import importer
+from storage import Storage
+
+CATEGORIES = {"кофе": "Кофе", "еда": "Еда"}
+
+
+async def import_text(store: Storage, text: str) -> importer.ImportReport:
+    return await importer.import_csv(store, 1, io.BytesIO(text.encode("utf-8")), CATEGORIES, timezone.utc)
+
+
+async def total(store: Storage):
+    rows = await store._read(lambda conn: conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(amount), 0) FROM expenses WHERE user_id=1"
+    ).fetchone())
+    return tuple(rows)
+
+
+def test_identical_rows_in_one_file_are_separate_expenses(store, run):
+    text = "100;Кофе;2024-01-31\n100;Кофе;2024-01-31\n50;Еда;2024-01-31\n"
+
+    async def go():
+        first = await import_text(store, text)
+        assert (first.added, first.duplicates) == (3, 0)
+        assert await total(store) == (3, 250.0)
+        again = await import_text(store, text)
+        assert (again.added, again.duplicates) == (0, 3)
+        # в файле стало на одну копию больше — дописывается ровно она
+        more = await import_text(store, text + "100;Кофе;2024-01-31\n")
+        assert (more.added, more.duplicates) == (1, 3)
+        assert await total(store) == (4, 350.0)
+
+    run(go())
+
+
+def test_identical_rows_split_across_batches(store, run, monkeypatch):
+    monkeypatch.setattr(importer, "IMPORT_BATCH", 1)
+    text = "100;Кофе;2024-01-31\n100;Кофе;2024-01-31\n"
+
+    async def go():
+        assert (await import_text(store, text)).added == 2
+        assert (await import_text(store, text)).added == 0
+        assert await total(store) == (2, 200.0)
+
+    run(go())
+
+
+def test_reimport_of_expenses_saved_under_one_timestamp(store, run):
+    async def go():
+        # несколько трат из одного сообщения пишутся с общим now
+        now = datetime(2024, 1, 31, 12, 0, tzinfo=timezone.utc)
+        await store.add_expenses(1, [(100.0, "Кофе", now), (100.0, "Кофе", now)])
+        report = await import_text(store, "100;Кофе;2024-01-31T12:00:00+00:00\n" * 2)
+        assert (report.added, report.duplicates) == (0, 2)
+        assert await total(store) == (2, 200.0)
+
+    run(go())
+
+
+def test_reimport_after_retention_moved_rows_to_archive(store, run):
+    text = "100;Кофе;2024-01-31T12:00:00+00:00\n" * 2 + "50;Еда;2024-02-01T09:00:00+00:00\n"
+
+    async def go():
+        assert (await import_text(store, text)).added == 3
+        await store.archive_slice(store.retention_cutoff(62), 0, 100)
+        assert await total(store) == (0, 0)
+        report = await import_text(store, text)
+        assert (report.added, report.duplicates) == (0, 3)
+        report = await import_text(store, text + "50;Еда;2024-02-01T09:00:00+00:00\n")
+        assert (report.added, report.duplicates) == (1, 3)
+        stats_total, _ = await store.fetch_stats(1, datetime(2024, 1, 1, tzinfo=timezone.utc),
+                                                 datetime(2024, 3, 1, tzinfo=timezone.utc))
+        assert stats_total == 300.0
+
+    run(go())
+
+
+async def staged(store: Storage) -> int:
+    return await store._write(lambda conn: conn.execute("SELECT COUNT(*) FROM import_staged").fetchone()[0])
+
+
+def test_copies_are_counted_across_chunk_boundaries_and_staging_is_cleared(store, run, monkeypatch):
+    monkeypatch.setattr(importer, "IMPORT_BATCH", 2)
+    # пять копий одного момента больше порции — они не должны разойтись по порциям
+    text = "10;Еда;2024-01-30\n" + "100;Кофе;2024-01-31\n" * 5 + "10;Еда;2024-02-01\n"
+
+    async def go():
+        assert (await import_text(store, text)).added == 7
+        assert await staged(store) == 0
+        report = await import_text(store, "10;Еда;2024-02-01\n" + "100;Кофе;2024-01-31\n" * 6)
+        assert (report.added, report.duplicates) == (1, 6)
+        assert await total(store) == (8, 620.0)
+
+    run(go())
+
+
+def test_cancelled_import_writes_nothing(store, run, monkeypatch):
+    async def go():
+        monkeypatch.setattr(importer, "IMPORT_BATCH", 1)
+        stage = store.stage_import
+        calls = []
+
+        async def stage_then_cancel(user_id, token, rows):
+            calls.append(rows)
+            if len(calls) > 1:
+                raise asyncio.CancelledError
+            await stage(user_id, token, rows)
+
+        monkeypatch.setattr(store, "stage_import", stage_then_cancel)
+        try:
+            await import_text(store, "1;Еда;2024-01-30\n2;Еда;2024-01-31\n")
+        except asyncio.CancelledError:
+            pass
+        assert await total(store) == (0, 0)
+        assert await staged(store) == 0
+
+    run(go())
+
+
+def test_bad_rows_are_reported_and_the_rest_imported(store, run):
+    text = ("amount;category;created_at\n"
+            "100;кофе;2024-01-31\n"
+            "abc;Кофе;2024-01-31\n"
+            "-5;Кофе;2024-01-31\n"
+            "10;Такси;2024-01-31\n"
+            "10;Еда;31.01.2024\n"
+            "10;Еда\n"
+            "\n"
+            "20,5;ЕДА;2024-02-01T10:00:00+03:00\n")
+    report = run(import_text(store, text))
+    assert (report.added, report.duplicates) == (2, 0)
+    assert dict(report.rejected) == {"amount": 2, "category": 1, "date": 1, "format": 1}
+    assert report.examples[0] == (3, "amount")
+    assert run(total(store)) == (2, 120.5)
+
+
+def test_gzip_upload(store, run):
+    data = gzip.compress("7;Еда;2024-01-31\n".encode("utf-8"))
+    report = run(importer.import_csv(store, 1, io.BytesIO(data), CATEGORIES, timezone.utc, compressed=True))
+    assert report.added == 1
@@ -0,0 +1,84 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import journal
+
+NOW = datetime.now(timezone.utc).replace(microsecond=0)
+
+
+def amounts(store, run, user_id=1):
+    return run(store._read(lambda conn: [r[0] for r in conn.execute(
+        "SELECT amount FROM expenses WHERE user_id=? ORDER BY id", (user_id,))]))
+
+
+def test_multi_level_undo_and_redo(store, run):
+    for amount in (1.0, 2.0, 3.0):
+        run(store.add_expense(1, amount, "Еда", NOW))
+    run(store.add_expense(2, 9.0, "Еда", NOW))
+    assert run(store.undo_last(1))["amount"] == 3.0
+    assert run(store.undo_last(1))["amount"] == 2.0
+    assert amounts(store, run) == [1.0]
+    # повтор возвращает траты в обратном порядке и с теми же id
+    first = run(store.redo_last(1))
+    assert first["amount"] == 2.0
+    assert run(store.redo_last(1))["amount"] == 3.0
+    assert run(store.redo_last(1)) is None
+    assert amounts(store, run) == [1.0, 2.0, 3.0]
+    assert amounts(store, run, 2) == [9.0]
+    assert run(store.verify_rollup()) == []
+
+
+def test_new_expense_clears_the_redo_stack(store, run):
+    run(store.add_expense(1, 1.0, "Еда", NOW))
+    run(store.add_expense(1, 2.0, "Еда", NOW))
+    run(store.undo_last(1))
+    run(store.add_expense(1, 5.0, "Кофе", NOW))
+    assert run(store.redo_last(1)) is None
+    assert amounts(store, run) == [1.0, 5.0]
+    assert run(store._read(lambda conn: conn.execute("SELECT COUNT(*) FROM journal").fetchone()[0])) == 0
+
+
+def test_reset_and_restore_bring_back_archived_and_later_rows(store, run):
+    run(store.add_expenses(1, [(10.0, "Еда", NOW - timedelta(days=300)), (20.0, "Еда", NOW)]))
+    run(store.archive_slice(store.retention_cutoff(62), 0, 100))
+    profile = run(store.user_profile(1))
+    run(store.reset_user(1))
+    assert run(store.user_profile(1))["total"] == 0
+    assert amounts(store, run) == []
+    run(store.add_expense(1, 1.0, "Кофе", NOW))
+    # горячая трата и архивная
+    assert run(store.restore_reset(1)) == 2
+    assert run(store.user_profile(1))["total"] == profile["total"] + 1.0
+    assert run(store.restore_reset(1)) is None
+    assert run(store.verify_rollup()) == []
+
+
+def test_restore_window_and_prune(make_store, run):
+    store = make_store(undo_window=60)
+    run(store.add_expense(1, 10.0, "Еда", NOW))
+    run(store.add_expense(1, 5.0, "Еда", NOW))
+    run(store.undo_last(1))
+    run(store.reset_user(1))
+
+    def age(conn):
+        with conn:
+            conn.execute("UPDATE journal SET ts=ts-3600")
+
+    run(store._write(age))
+    # сброс старше окна уже не возвращается
+    assert run(store.restore_reset(1)) is None
+    assert run(store.prune_journal()) == 1
+    left = run(store._read(lambda conn: (
+        conn.execute("SELECT COUNT(*) FROM journal").fetchone()[0],
+        conn.execute("SELECT COUNT(*) FROM expenses_deleted").fetchone()[0],
+    )))
+    assert left == (0, 0)
+
+
+def test_prune_works_in_batches(store, run, monkeypatch):
+    monkeypatch.setattr(journal, "PRUNE_BATCH", 3)
+    run(store.add_expenses(1, [(float(i), "Еда", NOW) for i in range(7)]))
+    for _ in range(7):
+        run(store.undo_last(1))
+    store.undo_window = -1
+    assert run(store.prune_journal()) == 7
@@ -0,0 +1,37 @@
+import main as bot
+
+
+def buttons(markup):
+    return [(b.text, b.callback_data) for row in markup.inline_keyboard for b in row]
+
+
+def test_markups_are_built_once_and_shared():
+    kb = bot.Keyboards()
+    assert not kb.built
+    menu = kb.main_menu
+    assert kb.built
+    assert kb.main_menu is menu and kb.stats is kb.stats
+    assert bot.inline_main_menu() is bot.inline_main_menu()
+    assert bot.categories_kb(1) is bot.categories_kb(1)
+
+
+def test_category_pages_cover_every_option():
+    kb = bot.Keyboards()
+    decoded = [bot.CODEC.decode(data) for page in kb.category_pages for _, data in buttons(page)]
+    picked = [d for d in decoded if d[0] == "pick"]
+    assert picked == [("pick", i) for i in range(len(bot.CATEGORY_OPTIONS))]
+    # неизвестная страница (старая кнопка) — первая
+    assert kb.categories(99) is kb.categories(0)
+
+
+def test_set_categories_rebuilds_pages_and_lookups(monkeypatch):
+    options = [(f"#{i}", f"cat{i}") for i in range(3)]
+    monkeypatch.setattr(bot, "CATEGORY_OPTIONS", list(bot.CATEGORY_OPTIONS))
+    monkeypatch.setattr(bot, "RAW_CATEGORIES", list(bot.RAW_CATEGORIES))
+    monkeypatch.setattr(bot, "LABEL_BY_RAW", dict(bot.LABEL_BY_RAW))
+    kb = bot.Keyboards()
+    kb.set_categories(options)
+    assert bot.RAW_CATEGORIES == ["cat0", "cat1", "cat2"]
+    assert bot.LABEL_BY_RAW["cat2"] == "#2"
+    assert len(kb.category_pages) == 1
+    assert [text for text, _ in buttons(kb.categories())] == ["#0", "#1", "#2"]
@@ -0,0 +1,74 @@
+import asyncio
+
+from lifecycle import Lifecycle
+
+
+def test_drain_waits_for_in_flight_handlers():
+    done = []
+
+    async def handler(event, data):
+        await asyncio.sleep(0.05)
+        done.append(event)
+        return event
+
+    async def go():
+        lifecycle = Lifecycle(drain_timeout=1)
+        middleware = lifecycle.middleware()
+        tasks = [asyncio.create_task(middleware(handler, n, {})) for n in range(3)]
+        await asyncio.sleep(0)
+        assert lifecycle.in_flight == 3
+        assert await lifecycle.drain()
+        assert sorted(done) == [0, 1, 2] and lifecycle.in_flight == 0
+        assert lifecycle.first_update_seconds is not None
+        assert [t.result() for t in tasks] == [0, 1, 2]
+
+    asyncio.run(go())
+
+
+def test_drain_gives_up_after_the_timeout():
+    async def handler(event, data):
+        await asyncio.sleep(10)
+
+    async def go():
+        lifecycle = Lifecycle(drain_timeout=0.05)
+        task = asyncio.create_task(lifecycle.middleware()(handler, None, {}))
+        await asyncio.sleep(0)
+        assert not await lifecycle.drain()
+        assert lifecycle.in_flight == 1 and lifecycle.remaining() == 0
+        task.cancel()
+
+    asyncio.run(go())
+
+
+def test_failing_handler_still_leaves():
+    async def handler(event, data):
+        raise RuntimeError("boom")
+
+    async def go():
+        lifecycle = Lifecycle(drain_timeout=1)
+        try:
+            await lifecycle.middleware()(handler, None, {})
+        except RuntimeError:
+            pass
+        assert lifecycle.in_flight == 0
+        assert await lifecycle.drain()
+
+    asyncio.run(go())
+
+
+def test_drain_cancels_warm_up_and_swallows_its_errors():
+    async def go():
+        lifecycle = Lifecycle(drain_timeout=1)
+
+        async def broken():
+            raise ValueError("no network")
+
+        slow = lifecycle.background(asyncio.sleep(10), "warm-up")
+        failed = lifecycle.background(broken(), "commands")
+        await asyncio.sleep(0)
+        assert failed.done() and failed.exception() is None
+        assert await lifecycle.drain()
+        assert slow.cancelled() and lifecycle.stopping
+        assert not lifecycle._tasks
+
+    asyncio.run(go())
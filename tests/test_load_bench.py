@@ -0,0 +1,43 @@
+import argparse
+import asyncio
+import sqlite3
+
+import main as bot
+import rollup
+from bench import load_bench
+from fsm_storage import SQLiteStorage
+from sender import SendScheduler
+from storage import Storage
+
+
+def test_seed_tops_up_to_the_requested_rows(tmp_path):
+    path = str(tmp_path / "load.db")
+    assert load_bench.seed(path, 300, 5, 30, ["Еда", "Кофе"]) == 300
+    assert load_bench.seed(path, 300, 5, 30, ["Еда", "Кофе"]) == 0
+    assert load_bench.seed(path, 350, 5, 30, ["Еда", "Кофе"]) == 50
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT COUNT(*) FROM expenses").fetchone()[0] == 350
+    assert rollup.verify(conn, 0) == []
+
+
+def test_percentiles():
+    p = load_bench.percentiles([i / 1000 for i in range(1, 101)])
+    assert (p["count"], p["p50_ms"], p["p99_ms"], p["max_ms"]) == (100, 51.0, 100.0, 100.0)
+
+
+def test_harness_drives_the_real_router(tmp_path, monkeypatch):
+    path = str(tmp_path / "load.db")
+    load_bench.seed(path, 200, 5, 30, bot.RAW_CATEGORIES)
+    store = Storage(path, bot.LOCAL_TZ)
+    monkeypatch.setattr(bot, "store", store)
+    monkeypatch.setattr(bot, "fsm_storage", SQLiteStorage(store))
+    monkeypatch.setattr(bot, "sender", SendScheduler(1e6, 1e6, 1e6))
+    args = argparse.Namespace(api_latency_ms=0, users=5, actions=6, concurrency=5,
+                              stats=0.2, me=0.2, export=0.1, undo=0.1)
+    result = asyncio.run(load_bench.run(bot, args))
+    assert result["errors"] == {}
+    assert result["handlers"]["start_cmd"]["count"] == 5
+    added = result["handlers"].get("picked_category", {}).get("count", 0)
+    assert added > 0
+    # ответы ушли через планировщик в FakeSession
+    assert result["api_calls"]["sendMessage"] >= 5
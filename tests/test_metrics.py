@@ -0,0 +1,78 @@
+import sqlite3
+import time
+from datetime import datetime, timezone
+
+import metrics
+
+
+def observed(monkeypatch):
+    seen = []
+    monkeypatch.setattr(metrics, "_observe_query", lambda sql, elapsed: seen.append((metrics.query_name(sql), elapsed)))
+    return seen
+
+
+def slow_conn():
+    conn = sqlite3.connect(":memory:", factory=metrics.TimedConnection)
+    conn.create_function("slow", 1, lambda x: time.sleep(0.01) or x)
+    conn.execute("CREATE TABLE t(x)")
+    conn.executemany("INSERT INTO t VALUES (?)", [(i,) for i in range(5)])
+    return conn
+
+
+def test_cursor_time_includes_row_fetching(monkeypatch):
+    conn = slow_conn()
+    seen = observed(monkeypatch)
+    # шаг execute считает только первую строку, остальные — при выборке
+    assert len(conn.execute("SELECT slow(x) FROM t").fetchall()) == 5
+    rows = list(conn.execute("SELECT slow(x) FROM t"))
+    assert len(rows) == 5
+    cur = conn.execute("SELECT slow(x) FROM t")
+    while cur.fetchmany(2):
+        pass
+    assert [name for name, _ in seen] == ["select t"] * 3
+    assert all(elapsed >= 0.045 for _, elapsed in seen)
+
+
+def test_statements_without_rows_are_recorded_at_once(monkeypatch):
+    conn = slow_conn()
+    seen = observed(monkeypatch)
+    conn.execute("UPDATE t SET x = slow(x)")
+    assert seen and seen[0][0] == "update t" and seen[0][1] >= 0.045
+    # курсор, который бросили недочитанным, пишет замер при закрытии
+    cur = conn.execute("SELECT x FROM t")
+    cur.fetchone()
+    cur.close()
+    assert [name for name, _ in seen] == ["update t", "select t"]
+
+
+def test_histogram_renders_cumulative_buckets():
+    h = metrics.Histogram("h", "doc", ("op",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        h.observe(("a",), value)
+    lines = h.render()
+    assert 'h_bucket{op="a",le="0.1"} 1' in lines
+    assert 'h_bucket{op="a",le="1.0"} 3' in lines
+    assert 'h_bucket{op="a",le="+Inf"} 4' in lines
+    assert 'h_count{op="a"} 4' in lines
+
+
+def test_storage_queries_are_labelled_by_operation(make_store, run, monkeypatch):
+    monkeypatch.setattr(metrics, "ENABLED", True)
+    monkeypatch.setattr(metrics, "QUERY_SECONDS", metrics.Histogram("q", "doc", ("query",)))
+    store = make_store()
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    run(store.add_expense(1, 5.0, "Еда", start))
+    run(store._read(store._fetch_stats, 1, start, datetime(2024, 2, 1, tzinfo=timezone.utc)))
+    names = {labels[0] for labels in metrics.QUERY_SECONDS._series}
+    assert "insert_batch:insert expenses" in names
+    assert any(name.startswith("fetch_stats:select") for name in names)
+
+
+def test_slow_queries_are_counted_and_logged(monkeypatch, capsys):
+    monkeypatch.setattr(metrics, "SLOW_QUERY_SECONDS", 0.02)
+    monkeypatch.setattr(metrics, "SLOW_QUERIES", metrics.Counter("slow", "doc", ("query",)))
+    conn = slow_conn()
+    conn.execute("SELECT slow(x) FROM t").fetchall()
+    conn.execute("SELECT x FROM t").fetchall()
+    assert metrics.SLOW_QUERIES._values == {("-:select t",): 1}
+    assert "[db] slow query" in capsys.readouterr().out
@@ -0,0 +1,90 @@
+import sqlite3
+
+import pytest
+
+import migrations
+import rollup
+
+
+def legacy_db(rows):
+    conn = sqlite3.connect(":memory:")
+    migrations.m001_expenses(conn)
+    conn.executemany("INSERT INTO expenses(user_id, amount, category, created_at) VALUES (1, ?, 'Еда', ?)", rows)
+    conn.commit()
+    return conn
+
+
+def test_naive_dates_use_the_configured_offset():
+    conn = legacy_db([(10.0, "2024-01-31T00:30:00"), (20.0, "2024-01-31T00:30:00+00:00")])
+    migrations.migrate(conn, 3 * 3600)
+    ts = [r[0] for r in conn.execute("SELECT created_ts FROM expenses ORDER BY id")]
+    # наивное 00:30 по UTC+3 — это 21:30 UTC предыдущего дня
+    assert ts == [1706650200, 1706661000]
+    days = [r[0] for r in conn.execute("SELECT day FROM daily_totals")]
+    assert days == [(1706650200 + 3 * 3600) // 86400]
+
+
+def test_unreadable_dates_are_skipped(capsys):
+    conn = legacy_db([(10.0, "вчера"), (20.0, None), (30.0, "2024-01-31")])
+    migrations.migrate(conn, 0)
+    assert "skipped 2 rows" in capsys.readouterr().out
+    rows = conn.execute("SELECT amount, created_ts FROM expenses ORDER BY id").fetchall()
+    assert rows == [(10.0, None), (20.0, None), (30.0, 1706659200)]
+    assert conn.execute("SELECT SUM(sum), SUM(count) FROM daily_totals").fetchone() == (30.0, 1)
+    assert migrations.current_version(conn) == migrations.MIGRATIONS[-1][0]
+
+
+def tables(conn):
+    return {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'index')")}
+
+
+def test_fresh_database_gets_every_version_once(capsys):
+    conn = sqlite3.connect(":memory:")
+    migrations.migrate(conn)
+    applied = [r[0] for r in conn.execute("SELECT version FROM schema_version ORDER BY version")]
+    assert applied == [num for num, *_ in migrations.MIGRATIONS]
+    assert {"expenses", "idx_expenses_user_ts", "daily_totals", "user_stats", "fsm", "subscriptions",
+            "digest_runs", "monthly_totals", "archive_index", "journal", "expenses_deleted"} <= tables(conn)
+    capsys.readouterr()
+    # повторный запуск ничего не делает
+    migrations.migrate(conn)
+    assert capsys.readouterr().out == ""
+    assert conn.execute("SELECT COUNT(*) FROM schema_version").fetchone()[0] == len(migrations.MIGRATIONS)
+
+
+def test_legacy_rows_are_backfilled_into_rollups(monkeypatch):
+    # пачки по две строки: перенос идёт несколькими транзакциями
+    monkeypatch.setattr(migrations, "BATCH_SIZE", 2)
+    conn = legacy_db([(10.0, "2024-01-29T10:00:00"), (20.0, "2024-01-30T10:00:00"),
+                      (5.0, "2024-01-30T11:00:00"), (7.0, "2024-01-31T23:30:00")])
+    migrations.migrate(conn, 3600)
+    assert conn.execute("SELECT COUNT(*) FROM expenses WHERE created_ts IS NULL").fetchone()[0] == 0
+    totals = conn.execute("SELECT day, sum, count FROM daily_totals ORDER BY day").fetchall()
+    day = 1706486400 // 86400
+    assert totals == [(day, 10.0, 1), (day + 1, 25.0, 2), (day + 2, 7.0, 1)]
+    assert conn.execute("SELECT days_total, last_day, streak FROM user_stats").fetchone() == (3, day + 2, 3)
+    assert rollup.verify(conn, 3600) == []
+
+
+def test_interrupted_backfill_resumes(monkeypatch):
+    monkeypatch.setattr(migrations, "BATCH_SIZE", 1)
+    conn = legacy_db([(1.0, "2024-01-29"), (2.0, "2024-01-30"), (3.0, "2024-01-31")])
+    calls = 0
+    real = migrations.iso_to_ts
+
+    def crash_on_second(value, tz_offset=0):
+        nonlocal calls
+        calls += 1
+        if calls == 2:
+            raise KeyboardInterrupt
+        return real(value, tz_offset)
+
+    monkeypatch.setattr(migrations, "iso_to_ts", crash_on_second)
+    with pytest.raises(KeyboardInterrupt):
+        migrations.migrate(conn)
+    # первая пачка уже закоммичена, версия 3 ещё не записана
+    assert migrations.current_version(conn) == 2
+    assert conn.execute("SELECT COUNT(*) FROM expenses WHERE created_ts IS NOT NULL").fetchone()[0] == 1
+    migrations.migrate(conn)
+    assert migrations.current_version(conn) == migrations.MIGRATIONS[-1][0]
+    assert conn.execute("SELECT SUM(count) FROM daily_totals").fetchone()[0] == 3
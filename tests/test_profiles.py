@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta, timezone
+
+from profiles import ProfileCache, ProfileEntry
+
+NOW = datetime.now(timezone.utc).replace(hour=12, minute=0, second=0, microsecond=0)
+
+
+def count_loads(store, monkeypatch):
+    loads = []
+    load = store._load_profile
+
+    def counted(conn, user_id, today):
+        loads.append(user_id)
+        return load(conn, user_id, today)
+
+    monkeypatch.setattr(store, "_load_profile", counted)
+    return loads
+
+
+def test_profile_is_cached_and_updated_in_place(store, run, monkeypatch):
+    loads = count_loads(store, monkeypatch)
+    run(store.add_expense(1, 100.0, "Еда", NOW - timedelta(days=40)))
+    run(store.add_expense(1, 30.0, "Кофе", NOW))
+    first = run(store.user_profile(1))
+    assert first == {"total": 130.0, "top_category": "Еда", "days_total": 2, "streak": 1,
+                     "avg_per_day": 65.0, "avg_30": 1.0}
+    assert run(store.user_profile(1)) == first
+    assert loads == [1]
+
+    # новая трата правит закэшированный профиль без чтения из базы
+    run(store.add_expense(1, 90.0, "Кофе", NOW))
+    profile = run(store.user_profile(1))
+    assert (profile["total"], profile["top_category"], profile["avg_30"]) == (220.0, "Кофе", 4.0)
+    assert loads == [1]
+
+    # отмена сбрасывает запись — следующий /me читает базу
+    run(store.undo_last(1))
+    assert run(store.user_profile(1))["total"] == 130.0
+    assert loads == [1, 1]
+
+
+def test_disabled_cache_always_reads(make_store, run, monkeypatch):
+    store = make_store(profile_cache_size=0)
+    loads = count_loads(store, monkeypatch)
+    run(store.add_expense(1, 10.0, "Еда", NOW))
+    run(store.user_profile(1))
+    run(store.user_profile(1))
+    assert loads == [1, 1]
+    assert store.cached_profiles == 0
+
+
+def test_load_racing_a_write_is_not_cached():
+    cache = ProfileCache(10)
+    token = cache.begin_load(1)
+    cache.write_started(1)
+    cache.finish_load(1, token, ProfileEntry(5, {"Еда": 1.0}, 1.0, (1, 5, 1)))
+    assert cache.get(1, 5) is None
+    cache.invalidate(1)
+    token = cache.begin_load(1)
+    cache.finish_load(1, token, ProfileEntry(5, {"Еда": 2.0}, 2.0, (1, 5, 1)))
+    assert cache.get(1, 5).by_category == {"Еда": 2.0}
+    # снимок вчерашнего дня не отдаётся
+    assert cache.get(1, 6) is None
+
+
+def test_cache_evicts_least_recently_used():
+    cache = ProfileCache(2)
+    for user_id in (1, 2, 3):
+        cache.finish_load(user_id, cache.begin_load(user_id), ProfileEntry(5, {}, 0.0, None))
+    assert len(cache) == 2 and cache.get(1, 5) is None
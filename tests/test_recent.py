@@ -0,0 +1,134 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+NOW = datetime.now(timezone.utc)
+TODAY = datetime(NOW.year, NOW.month, NOW.day, tzinfo=timezone.utc)
+WINDOWS = [(TODAY, TODAY + timedelta(days=1)), (TODAY - timedelta(days=6), TODAY + timedelta(days=1))]
+
+
+def delete_user_rows(conn, user_id):
+    with conn:
+        conn.execute("DELETE FROM expenses WHERE user_id=?", (user_id,))
+
+
+def exact(store, run, user_id, start, end):
+    return run(store._read(store._fetch_stats, user_id, start, end))
+
+
+def assert_matches_database(store, run, user_id):
+    for start, end in WINDOWS:
+        total, rows = run(store.fetch_stats(user_id, start, end))
+        want_total, want_rows = exact(store, run, user_id, start, end)
+        assert total == pytest.approx(want_total)
+        assert {r["category"]: pytest.approx(r["total"]) for r in rows} == \
+            {r["category"]: r["total"] for r in want_rows}
+    assert run(store.verify_recent()) == []
+
+
+def test_warm_windows_are_served_from_memory(store, run, monkeypatch):
+    run(store.add_expenses(1, [(10.0, "Еда", NOW - timedelta(days=3)), (5.0, "Кофе", NOW), (2.5, "Кофе", NOW)]))
+    run(store.fetch_stats(1, *WINDOWS[1]))
+    assert store.cached_recent_users == 1 and store.recent_cache_bytes > 0
+
+    def no_database(*args):
+        raise AssertionError("window must come from the cache")
+
+    monkeypatch.setattr(store, "_fetch_stats", no_database)
+    assert run(store.fetch_stats(1, *WINDOWS[0])) == (7.5, [{"category": "Кофе", "total": 7.5}])
+    total, rows = run(store.fetch_stats(1, *WINDOWS[1]))
+    assert total == 17.5 and [r["category"] for r in rows] == ["Еда", "Кофе"]
+    # за месяц окно шире кэша — читается база
+    with pytest.raises(AssertionError):
+        run(store.fetch_stats(1, TODAY - timedelta(days=30), TODAY + timedelta(days=1)))
+
+
+def test_cache_follows_every_kind_of_write(store, run):
+    run(store.add_expenses(1, [(10.0, "Еда", NOW - timedelta(days=2)), (4.0, "Кофе", NOW)]))
+    assert_matches_database(store, run, 1)
+    run(store.add_expense(1, 3.0, "Дом", NOW - timedelta(days=5)))
+    assert_matches_database(store, run, 1)
+    assert run(store.last_expense(1)) == (3.0, "Дом")
+
+    run(store.undo_last(1))
+    assert_matches_database(store, run, 1)
+    # после отмены последняя трата берётся из базы
+    assert run(store.last_expense(1)) == (4.0, "Кофе")
+    run(store.redo_last(1))
+    assert_matches_database(store, run, 1)
+    assert run(store.last_expense(1)) == (3.0, "Дом")
+
+    run(store.reset_user(1))
+    assert run(store.fetch_stats(1, *WINDOWS[1]))[0] == 0
+    assert run(store.last_expense(1)) is None
+    run(store.restore_reset(1))
+    assert_matches_database(store, run, 1)
+
+    token = store.begin_import(1)
+    run(store.stage_import(1, token, [(8.0, "Еда", NOW.isoformat(), int(NOW.timestamp()))]))
+    run(store.import_expenses(1, token))
+    assert_matches_database(store, run, 1)
+
+
+def test_writes_racing_a_load_do_not_leave_stale_entries(store, run):
+    run(store.add_expense(1, 1.0, "Еда", NOW))
+
+    async def go():
+        await asyncio.gather(
+            store.fetch_stats(1, *WINDOWS[0]),
+            *(store.add_expense(1, 2.0, "Кофе", NOW) for _ in range(5)),
+            store.fetch_stats(1, *WINDOWS[1]),
+        )
+
+    run(go())
+    assert run(store.fetch_stats(1, *WINDOWS[0]))[0] == 11.0
+    assert run(store.verify_recent()) == []
+
+
+def test_users_over_capacity_fall_back_to_the_database(store, run):
+    store.recent.capacity = 3
+    run(store.add_expenses(1, [(1.0, "Еда", NOW - timedelta(days=1))] + [(2.0, "Кофе", NOW)] * 4))
+    # сегодня больше capacity трат — окно не покрыто кэшем, ответ всё равно точный
+    assert run(store.fetch_stats(1, *WINDOWS[0]))[0] == 8.0
+    assert run(store.fetch_stats(1, *WINDOWS[1]))[0] == 9.0
+    assert run(store.verify_recent()) == []
+
+
+def test_zero_budget_disables_the_cache(make_store, run):
+    store = make_store(recent_cache_bytes=0)
+    run(store.add_expenses(1, [(10.0, "Еда", NOW), (5.0, "Кофе", NOW)]))
+    assert run(store.fetch_stats(1, *WINDOWS[0]))[0] == 15.0
+    assert run(store.last_expense(1)) == (5.0, "Кофе")
+    run(store.undo_last(1))
+    assert run(store.fetch_stats(1, *WINDOWS[1]))[0] == 10.0
+    assert store.cached_recent_users == 0 and store.recent_cache_bytes == 0
+
+
+def test_check_recent_drops_entries_that_drifted_from_the_database(store, run):
+    for user_id in (1, 2):
+        run(store.add_expense(user_id, 100.0, "Кофе", NOW))
+        assert run(store.fetch_stats(user_id, *WINDOWS[0]))[0] == 100.0
+    assert store.recent_drift is None
+    assert run(store.check_recent()) == 0
+
+    # запись в обход Storage (другой процесс) — кэш пользователя 2 устарел
+    run(store._write(delete_user_rows, 2))
+    assert run(store.verify_recent()) == [2]
+    assert run(store.check_recent()) == 1
+    assert store.recent_drift == 1
+    assert store.cached_recent_users == 1
+    assert run(store.verify_recent()) == []
+
+
+def test_maintenance_loop_runs_the_check(make_store, run):
+    store = make_store(prune_interval=0.01, recent_verify_interval=0)
+
+    async def wait():
+        for _ in range(100):
+            if store.recent_drift is not None:
+                break
+            await asyncio.sleep(0.01)
+
+    run(wait())
+    assert store.recent_drift == 0
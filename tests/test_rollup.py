@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta, timezone
+
+NOW = datetime.now(timezone.utc).replace(hour=12, minute=0, second=0, microsecond=0)
+
+
+def spend(store, run, user_id, days_ago, amount=10.0, category="Еда"):
+    run(store.add_expense(user_id, amount, category, NOW - timedelta(days=days_ago)))
+
+
+def user_stats(store, run, user_id):
+    return run(store._read(lambda conn: conn.execute(
+        "SELECT days_total, last_day, streak FROM user_stats WHERE user_id=?", (user_id,)
+    ).fetchone()))
+
+
+def test_incremental_rollup_matches_a_rebuild(store, run):
+    for days_ago in (5, 4, 2, 1, 0, 0):
+        spend(store, run, 1, days_ago)
+    # задним числом закрыт разрыв — серия склеивается
+    spend(store, run, 1, 3, 7.0, "Кофе")
+    spend(store, run, 2, 10)
+    assert tuple(user_stats(store, run, 1)) == (6, store.today(), 6)
+    assert run(store.verify_rollup()) == []
+
+    # отмена снимает последние записанные: трату задним числом и одну сегодняшнюю
+    run(store.undo_last(1))
+    run(store.undo_last(1))
+    assert run(store.verify_rollup()) == []
+    assert tuple(user_stats(store, run, 1)) == (5, store.today(), 3)
+
+
+def test_verify_reports_drift_and_rebuild_repairs_it(store, run):
+    for days_ago in (2, 1):
+        spend(store, run, 1, days_ago)
+    day = store.today() - 1
+
+    def corrupt(conn):
+        with conn:
+            conn.execute("UPDATE daily_totals SET sum=sum+1 WHERE user_id=1 AND day=?", (day,))
+            conn.execute("UPDATE user_stats SET streak=1 WHERE user_id=1")
+
+    run(store._write(corrupt))
+    drift = run(store.verify_rollup())
+    assert (1, day, "Еда", (10.0, 1), (11.0, 1)) in drift
+    assert (1, None, "user_stats", (2, day, 2), (2, day, 1)) in drift
+    assert run(store.rebuild_rollup()) == 1
+    assert run(store.verify_rollup()) == []
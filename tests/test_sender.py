@@ -0,0 +1,97 @@
+import asyncio
+import time
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import AnswerCallbackQuery, SendMessage
+
+from sender import SendScheduler, merge
+
+
+class FakeBot:
+    def __init__(self, retry_first=0):
+        self.calls = []
+        self.retry_first = retry_first
+
+    async def __call__(self, method):
+        self.calls.append((time.monotonic(), method))
+        if self.retry_first:
+            self.retry_first -= 1
+            raise TelegramRetryAfter(method, "flood", 1)
+        return len(self.calls)
+
+
+def run_scheduler(sender, bot, go):
+    async def main():
+        sender.start(bot)
+        try:
+            return await go()
+        finally:
+            await sender.stop(timeout=5)
+
+    return asyncio.run(main())
+
+
+def test_queued_messages_of_one_chat_are_merged():
+    bot = FakeBot()
+    sender = SendScheduler(global_rate=100, chat_rate=20, chat_burst=1)
+
+    async def go():
+        first = await sender.send(1, "<b>Записала</b>", parse_mode="HTML")
+        # токен чата потрачен: пока он копится, два сообщения склеиваются
+        return [first, *await asyncio.gather(sender.send(1, "<i>итого</i>", parse_mode="HTML"),
+                                             sender.send(1, "a < b"))]
+
+    results = run_scheduler(sender, bot, go)
+    texts = [m.text for _, m in bot.calls]
+    # простой текст экранируется при склейке с HTML
+    assert texts == ["<b>Записала</b>", "<i>итого</i>\n\na &lt; b"]
+    assert results == [1, 2, 2]
+    assert sender.merged == 1
+
+
+def test_retry_after_pauses_the_chat_and_resends():
+    bot = FakeBot(retry_first=1)
+    sender = SendScheduler(global_rate=100, chat_rate=100, chat_burst=5)
+
+    async def go():
+        return await sender.send(1, "x")
+
+    assert run_scheduler(sender, bot, go) == 2
+    assert bot.calls[1][0] - bot.calls[0][0] >= 0.9
+
+
+def test_callback_answers_skip_the_chat_queues():
+    bot = FakeBot()
+    sender = SendScheduler(global_rate=1, chat_rate=1, chat_burst=1)
+
+    async def go():
+        await sender.send(1, "x")
+        # ведро чата и общее пусты, но ответ на кнопку уходит сразу
+        return await asyncio.wait_for(sender.submit(AnswerCallbackQuery(callback_query_id="1")), 0.5)
+
+    assert run_scheduler(sender, bot, go) == 2
+
+
+def test_global_rate_paces_all_chats():
+    bot = FakeBot()
+    sender = SendScheduler(global_rate=50, chat_rate=100, chat_burst=5)
+
+    async def go():
+        started = time.monotonic()
+        await asyncio.gather(*(sender.send(chat_id, "x") for chat_id in range(60)))
+        return time.monotonic() - started
+
+    # 50 уходят сразу из полного ведра, ещё 10 — по 1/50 с
+    assert run_scheduler(sender, bot, go) >= 0.18
+    assert len(bot.calls) == 60
+
+
+def test_merge_keeps_one_keyboard_and_refuses_two():
+    from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+    kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="ok", callback_data="x")]])
+    a = SendMessage(chat_id=1, text="a")
+    b = SendMessage(chat_id=1, text="b", reply_markup=kb)
+    assert merge(a, b).reply_markup is kb
+    assert merge(b, b) is None
+    assert merge(a, SendMessage(chat_id=2, text="c")) is None
@@ -0,0 +1,87 @@
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import manage
+from sharding import ShardedStorage, shard_index, shard_paths
+
+NOW = datetime.now(timezone.utc).replace(microsecond=0)
+USERS = range(1, 13)
+
+
+def sharded(path, run, shards):
+    store = ShardedStorage(path, timezone.utc, shards)
+    run(store.open())
+    return store
+
+
+def export(store, run, user_id):
+    rows = []
+    run(store.export_rows(user_id, lambda chunk: rows.extend(tuple(r) for r in chunk)))
+    return rows
+
+
+def populate(store, run):
+    for user_id in USERS:
+        run(store.add_expenses(user_id, [
+            (float(user_id), "Еда", NOW - timedelta(days=d)) for d in (0, 1, 120, 121)
+        ]))
+        run(store.set_subscription(user_id, 100 + user_id, "daily"))
+        run(store.fsm_write({f"1:{user_id}:{user_id}::default": ("S", None, int(NOW.timestamp()))}))
+
+
+def test_users_live_in_their_own_shard(tmp_path, run):
+    store = sharded(str(tmp_path / "finances.db"), run, 3)
+    try:
+        populate(store, run)
+        for i, shard in enumerate(store.shards):
+            users = run(shard._read(lambda conn: {r[0] for r in conn.execute("SELECT user_id FROM expenses")}))
+            assert users == {u for u in USERS if shard_index(u, 3) == i}
+        page = run(store.digest_page("daily", 0, 1, 2, 3, 5))
+        assert [p[0] for p in page] == [4, 5, 6, 7, 8]
+        assert run(store.fsm_load("1:5:5::default"))[0] == "S"
+        assert run(store.verify_rollup()) == []
+    finally:
+        run(store.close())
+
+
+def test_reshard_moves_every_row_and_keeps_user_data(tmp_path, run):
+    path = str(tmp_path / "finances.db")
+    single = sharded(path, run, 1)
+    populate(single, run)
+    archived = single.shards[0]
+    run(archived.archive_slice(archived.retention_cutoff(62), 0, 100))
+    before = {u: export(single, run, u) for u in USERS}
+    run(single.close())
+
+    args = manage.build_parser().parse_args(["--db", path, "reshard", "--to", "3"])
+    assert args.func(args) == 0
+    counts = {}
+    for p in shard_paths(path, 3):
+        conn = sqlite3.connect(p)
+        for table in ("expenses", "daily_totals", "subscriptions", "fsm", "monthly_totals", "archive_index"):
+            counts[table] = counts.get(table, 0) + conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        conn.close()
+    assert counts["monthly_totals"] > 0 and counts["expenses"] == 2 * len(USERS)
+    source = sqlite3.connect(path)
+    for table, n in counts.items():
+        assert n == source.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0], table
+    source.close()
+
+    store = sharded(path, run, 3)
+    try:
+        assert {u: export(store, run, u) for u in USERS} == before
+        assert run(store.verify_rollup()) == []
+        assert run(store.get_subscription(7)) == "daily"
+    finally:
+        run(store.close())
+    # повторный запуск не перезаписывает готовые шарды
+    assert args.func(args) == 1
+
+
+def test_single_file_next_to_missing_shards_is_refused(tmp_path, run):
+    path = str(tmp_path / "finances.db")
+    run(sharded(path, run, 1).close())
+    with pytest.raises(RuntimeError, match="reshard"):
+        sharded(path, run, 2)
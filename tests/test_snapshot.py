@@ -0,0 +1,71 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+import snapshot
+from sharding import ShardedStorage
+
+NOW = datetime.now(timezone.utc).replace(hour=12, minute=0, second=0, microsecond=0)
+
+
+def populate(store, run):
+    run(store.add_expenses(1, [(10.0, "Еда", NOW - timedelta(days=10)), (5.0, "Кофе", NOW - timedelta(days=9))]))
+    run(store.add_expense(2, 7.0, "Еда", NOW))
+    run(store.add_expenses(3, [(100.0, "Дом", NOW - timedelta(days=300)), (3.0, "Кофе", NOW)]))
+
+
+def test_report_counts_users_categories_and_retention(store, run, tmp_path):
+    populate(store, run)
+    run(store.archive_slice(store.retention_cutoff(62), 0, 100))
+    report = snapshot.build_all([store.path], 0, str(tmp_path))
+    assert report.users == 3
+    assert report.active == {1: 2, 7: 2, 30: 3}
+    # архивная трата попадает в «за всё время», но не в 30 дней
+    assert dict(report.categories) == {"Еда": [17.0, 2], "Кофе": [8.0, 2], "Дом": [100.0, 1]}
+    assert dict(report.categories_30) == {"Еда": [17.0, 2], "Кофе": [8.0, 2]}
+    # у первого D1 удержан, у третьего первый день в архиве и удержания нет
+    assert report.retention == {1: [2, 1], 7: [2, 0], 30: [1, 0]}
+
+    text = snapshot.format_report(report, time.time(), 0.5)
+    assert "Users: 3" in text and "Active: 1d 2, 7d 2, 30d 3" in text
+    assert "D1 50.0% (1/2)" in text and "Дом: 100.00 (1 expenses)" in text
+
+
+def test_shard_reports_add_up(tmp_path, run, store):
+    populate(store, run)
+    sharded = ShardedStorage(str(tmp_path / "sharded.db"), timezone.utc, 3)
+    run(sharded.open())
+    try:
+        populate(sharded, run)
+        whole = snapshot.build_all([store.path], 0)
+        parts = snapshot.build_all([s.path for s in sharded.shards], 0)
+    finally:
+        run(sharded.close())
+    assert parts.users == whole.users and parts.active == whole.active
+    assert parts.categories == whole.categories and parts.retention == whole.retention
+
+
+def test_concurrent_gets_share_one_refresh(store, run, monkeypatch):
+    populate(store, run)
+    built = []
+    build_all = snapshot.build_all
+
+    def counted(*args):
+        built.append(args)
+        return build_all(*args)
+
+    monkeypatch.setattr(snapshot, "build_all", counted)
+    snapshots = snapshot.Snapshots([store.path], 0, max_age=3600)
+
+    async def go():
+        first, second = await asyncio.gather(snapshots.get(), snapshots.get())
+        assert first[0] is second[0]
+        await snapshots.get()
+        assert len(built) == 1
+        # устаревший снимок снимается заново
+        snapshots.taken_at -= 3600
+        report, _, _ = await snapshots.get()
+        assert len(built) == 2 and report.users == 3
+        await snapshots.stop()
+
+    run(go())
@@ -0,0 +1,28 @@
+from datetime import date
+
+import pytest
+
+import main as bot
+
+TODAY = date(2024, 6, 15)
+
+
+@pytest.mark.parametrize("args", [
+    "1000000d",
+    "99999999w",
+    "100000m",
+    "0001-01-01 9999-12-31",
+    "9999-12-31",
+    "9999-12",
+    "9999",
+    "0001",
+])
+def test_out_of_range_input_is_a_usage_error(args):
+    with pytest.raises(ValueError):
+        bot.parse_stats_args(args, TODAY)
+
+
+def test_regular_ranges_still_parse():
+    assert bot.parse_stats_args("90d week", TODAY) == (date(2024, 3, 18), date(2024, 6, 16), "week")
+    assert bot.parse_stats_args("2024-01 2024-03", TODAY)[:2] == (date(2024, 1, 1), date(2024, 4, 1))
+    assert bot.parse_stats_args("2023", TODAY)[:2] == (date(2023, 1, 1), date(2024, 1, 1))
@@ -0,0 +1,52 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+NOW = datetime(2024, 6, 15, 12, 0, tzinfo=timezone.utc)
+
+
+def thread_name(conn):
+    return threading.current_thread().name
+
+
+def test_sqlite_work_runs_off_the_event_loop(store, run):
+    assert run(store._write(thread_name)).startswith("db-writer")
+    assert run(store._read(thread_name)).startswith("db-reader")
+
+    async def go():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        task = asyncio.create_task(ticker())
+        await store._write(lambda conn: time.sleep(0.1))
+        task.cancel()
+        return ticks
+
+    # пока писатель спит, loop продолжает обслуживать другие задачи
+    assert run(go()) > 5
+
+
+def test_reads_see_own_writes(store, run):
+    async def go():
+        await asyncio.gather(*(store.add_expense(1, 10.0, "Еда", NOW) for _ in range(20)))
+        return await store.fetch_stats(1, datetime(2024, 6, 15, tzinfo=timezone.utc),
+                                       datetime(2024, 6, 16, tzinfo=timezone.utc))
+
+    total, rows = run(go())
+    assert total == 200.0
+    assert [(r["category"], r["total"]) for r in rows] == [("Еда", 200.0)]
+
+
+def test_closed_storage_refuses_queries(make_store, run):
+    store = make_store()
+    run(store.close())
+    with pytest.raises(RuntimeError, match="closed"):
+        run(store._read(thread_name))
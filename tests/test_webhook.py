@@ -0,0 +1,64 @@
+import asyncio
+import json
+
+from aiohttp import web
+
+from webhook import SECRET_HEADER, FrontRouter, route_key
+
+USER = {"id": 42, "is_bot": False, "first_name": "u"}
+
+
+def message(chat_id, user=USER):
+    msg = {"message_id": 1, "date": 0, "chat": {"id": chat_id, "type": "private"}, "from": user}
+    return {"update_id": 1, "message": msg}
+
+
+def test_updates_of_one_chat_share_a_worker():
+    group_message = message(-100500)
+    other_member = message(-100500, {"id": 7, "is_bot": False, "first_name": "v"})
+    callback = {"update_id": 2, "callback_query": {
+        "id": "1", "from": USER, "chat_instance": "1",
+        "message": {"message_id": 1, "date": 0, "chat": {"id": -100500, "type": "group"}},
+    }}
+    assert route_key(group_message) == route_key(other_member) == route_key(callback) == -100500
+    assert route_key(message(42)) == 42
+
+
+def test_updates_without_chat_route_by_sender():
+    inline = {"update_id": 3, "inline_query": {"id": "1", "from": USER, "query": "", "offset": ""}}
+    assert route_key(inline) == 42
+
+
+class FakeRequest:
+    def __init__(self, body, secret="s"):
+        self.headers = {SECRET_HEADER: secret}
+        self._body = body
+
+    async def read(self):
+        return self._body
+
+
+def test_front_forwards_one_chat_in_order_and_rejects_bad_requests():
+    front = FrontRouter(["w0", "w1", "w2"], "s", "internal")
+    forwarded = []
+
+    async def forward(idx, body):
+        update = json.loads(body)
+        forwarded.append((idx, update["update_id"]))
+        # первые апдейты чата «медленнее» — порядок всё равно сохраняется
+        await asyncio.sleep(0.01 * (5 - update["update_id"] % 5))
+        return web.Response(status=200)
+
+    front._forward = forward
+
+    async def go():
+        bodies = [dict(message(7), update_id=i) for i in range(5)]
+        responses = await asyncio.gather(*(front.handle(FakeRequest(json.dumps(b).encode())) for b in bodies))
+        assert [r.status for r in responses] == [200] * 5
+        assert (await front.handle(FakeRequest(b"{}", secret="wrong"))).status == 401
+        assert (await front.handle(FakeRequest(b"not json"))).status == 400
+
+    asyncio.run(go())
+    assert forwarded == [(7 % 3, i) for i in range(5)]
+    # простаивающий чат не держит запись о блокировке
+    assert front._chat_locks == {}
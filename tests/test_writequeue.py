@@ -0,0 +1,96 @@
+import asyncio
+from datetime import datetime, timezone
+
+from writequeue import WriteQueue
+
+
+def test_barrier_waits_for_pending_writes():
+    committed = []
+
+    async def flush(batch):
+        await asyncio.sleep(0.01)
+        committed.extend(g.user_id for g in batch)
+        return [len(g.rows) for g in batch]
+
+    async def go():
+        queue = WriteQueue(flush, max_batch=10, max_latency=0.005)
+        queue.start()
+        futs = [await queue.enqueue(user_id, [user_id]) for user_id in (1, 2, 1)]
+        await queue.barrier(1)
+        assert committed.count(1) == 2
+        assert [await f for f in futs] == [1, 1, 1]
+        await queue.stop()
+
+    asyncio.run(go())
+
+
+def test_barrier_does_not_hang_when_flush_is_cancelled():
+    async def flush(batch):
+        raise asyncio.CancelledError
+
+    async def go():
+        queue = WriteQueue(flush, max_batch=10, max_latency=0)
+        queue.start()
+        fut = await queue.enqueue(1, ["row"])
+        await asyncio.wait_for(queue.barrier(1), 1)
+        assert fut.cancelled()
+
+    asyncio.run(go())
+
+
+def test_cancelling_the_writer_cancels_queued_writes():
+    async def flush(batch):
+        return [None] * len(batch)
+
+    async def go():
+        queue = WriteQueue(flush, max_batch=10, max_latency=10)
+        queue.start()
+        await asyncio.sleep(0)
+        # писатель отменён раньше, чем забрал группы из очереди
+        first = await queue.enqueue(1, ["a"])
+        second = await queue.enqueue(2, ["b"])
+        queue._task.cancel()
+        await asyncio.wait_for(asyncio.gather(queue.barrier(1), queue.barrier(2)), 1)
+        assert first.cancelled() and second.cancelled()
+
+    asyncio.run(go())
+
+
+def test_max_batch_splits_groups_into_transactions():
+    batches = []
+
+    async def flush(batch):
+        batches.append([g.user_id for g in batch])
+        return [None] * len(batch)
+
+    async def go():
+        queue = WriteQueue(flush, max_batch=3, max_latency=0.01)
+        queue.start()
+        await asyncio.gather(*(queue.submit(user_id, ["row"]) for user_id in range(7)))
+        await queue.stop()
+
+    asyncio.run(go())
+    assert batches == [[0, 1, 2], [3, 4, 5], [6]]
+
+
+def test_concurrent_expenses_share_one_commit(make_store, run, monkeypatch):
+    store = make_store(write_max_batch=100, write_max_latency=0.05)
+    commits = []
+    insert = store._insert_batch
+
+    def counted(conn, batch):
+        commits.append(sum(len(g.rows) for g in batch))
+        return insert(conn, batch)
+
+    monkeypatch.setattr(store, "_insert_batch", counted)
+    now = datetime.now(timezone.utc)
+
+    async def go():
+        await asyncio.gather(*(store.add_expense(user_id % 5, 1.0, "Еда", now) for user_id in range(50)))
+
+    run(go())
+    assert commits == [50]
+    # у каждой траты свой id, выданный подряд внутри пачки
+    ids = run(store._read(lambda conn: [r[0] for r in conn.execute("SELECT id FROM expenses ORDER BY id")]))
+    assert ids == list(range(1, 51))
+    assert run(store.verify_rollup()) == []
@@ -0,0 +1,158 @@
+import asyncio
+import json
+import multiprocessing
+import secrets
+import signal
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiohttp import ClientConnectionError, ClientSession, ClientTimeout, web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+# ---------- Ключ маршрутизации ----------
+# Все апдейты одного чата должны попадать в один воркер: на этом держатся
+# кэши FSM и профилей внутри процесса и порядок сообщений в чате.
+def route_key(update: Dict[str, Any]) -> int:
+    for name, obj in update.items():
+        if name == "update_id" or not isinstance(obj, dict):
+            continue
+        chat = obj.get("chat") or (obj.get("message") or {}).get("chat")
+        if chat and "id" in chat:
+            return int(chat["id"])
+        user = obj.get("from") or obj.get("user")
+        if user and "id" in user:
+            return int(user["id"])
+    return int(update.get("update_id", 0))
+
+
+# ---------- Один процесс ----------
+def build_app(dp: Dispatcher, bot: Bot, path: str, secret: str) -> web.Application:
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def wait_for_signal():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    await stop.wait()
+
+
+# По сигналу сначала закрывается порт (Telegram повторит недоставленное),
+# затем on_stop дожидается уже принятых апдейтов, и только потом cleanup
+# закрывает приложение вместе с сессией бота
+async def serve(
+    app: web.Application, host: str, port: int, on_stop: Optional[Callable[[], Awaitable[Any]]] = None
+):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        print(f"[webhook] listening on http://{host}:{port}")
+        await wait_for_signal()
+        await site.stop()
+        if on_stop is not None:
+            await on_stop()
+    finally:
+        await runner.cleanup()
+
+
+# ---------- Фронт и воркеры ----------
+# Фронт принимает POST от Telegram, проверяет секрет и пересылает тело
+# воркеру chat_id % N по локальному HTTP. Апдейты одного чата пересылаются
+# строго по очереди, поэтому их порядок сохраняется; разные чаты — параллельно.
+class FrontRouter:
+    def __init__(self, worker_urls: List[str], secret: str, internal_secret: str):
+        self.worker_urls = worker_urls
+        self.secret = secret
+        self.internal_secret = internal_secret
+        # chat_id -> [lock, число ждущих]; запись удаляется, когда чат простаивает
+        self._chat_locks: Dict[int, list] = {}
+        self._session: Optional[ClientSession] = None
+
+    async def _on_startup(self, app: web.Application):
+        self._session = ClientSession(timeout=ClientTimeout(total=30))
+
+    async def _on_cleanup(self, app: web.Application):
+        if self._session is not None:
+            await self._session.close()
+
+    def register(self, app: web.Application, path: str):
+        app.router.add_post(path, self.handle)
+        app.on_startup.append(self._on_startup)
+        app.on_cleanup.append(self._on_cleanup)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not secrets.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            return web.Response(status=401, text="Unauthorized")
+        body = await request.read()
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return web.Response(status=400, text="Bad update")
+        key = route_key(update)
+        slot = self._chat_locks.setdefault(key, [asyncio.Lock(), 0])
+        slot[1] += 1
+        try:
+            async with slot[0]:
+                return await self._forward_with_retry(key % len(self.worker_urls), body)
+        finally:
+            slot[1] -= 1
+            if not slot[1]:
+                del self._chat_locks[key]
+
+    async def _forward_with_retry(self, idx: int, body: bytes) -> web.Response:
+        for attempt in range(10):
+            try:
+                return await self._forward(idx, body)
+            except ClientConnectionError:
+                # воркер ещё стартует или перезапускается
+                await asyncio.sleep(0.2 * (attempt + 1))
+        return web.Response(status=503, text="Worker unavailable")
+
+    async def _forward(self, idx: int, body: bytes) -> web.Response:
+        async with self._session.post(
+            self.worker_urls[idx],
+            data=body,
+            headers={SECRET_HEADER: self.internal_secret, "Content-Type": "application/json"},
+        ) as resp:
+            await resp.read()
+            return web.Response(status=resp.status)
+
+
+async def serve_front(
+    workers: int,
+    worker_target: Callable[[int, int, str], None],
+    host: str,
+    port: int,
+    path: str,
+    secret: str,
+):
+    internal_secret = secrets.token_urlsafe(32)
+    ports = [port + 1 + i for i in range(workers)]
+    ctx = multiprocessing.get_context("spawn")
+    procs = [
+        ctx.Process(target=worker_target, args=(i, p, internal_secret), name=f"bot-worker-{i}")
+        for i, p in enumerate(ports)
+    ]
+    for proc in procs:
+        proc.start()
+    app = web.Application()
+    FrontRouter([f"http://127.0.0.1:{p}{path}" for p in ports], secret, internal_secret).register(app, path)
+    try:
+        await serve(app, host, port)
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            await asyncio.to_thread(proc.join, 30)
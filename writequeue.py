@@ -0,0 +1,141 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+
+# ---------- Очередь записи с групповым коммитом ----------
+# Хэндлер кладёт группу строк одного пользователя в очередь и ждёт future,
+# который разрешится после коммита. Единственная задача-писатель собирает
+# группы в пачку (до max_batch строк или max_latency секунд — что раньше)
+# и отдаёт её flush-функции, которая пишет всё одной транзакцией.
+class WriteGroup:
+    __slots__ = ("user_id", "rows", "future")
+
+    def __init__(self, user_id: int, rows: List[Any], future: asyncio.Future):
+        self.user_id = user_id
+        self.rows = rows
+        self.future = future
+
+
+class WriteQueue:
+    def __init__(
+        self,
+        flush: Callable[[List[WriteGroup]], Awaitable[List[Any]]],
+        max_batch: int = 500,
+        max_latency: float = 0.005,
+        max_pending: int = 10000,
+    ):
+        self._flush = flush
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self._queue: "asyncio.Queue[Optional[WriteGroup]]" = asyncio.Queue(maxsize=max_pending)
+        self._pending: Dict[int, Set[asyncio.Future]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="write-queue")
+
+    # Дописать всё, что уже в очереди, и остановить писателя
+    async def stop(self):
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    # Поставить строки в очередь; при переполнении ждём (backpressure).
+    # Все строки группы попадают в одну транзакцию. Возвращает future
+    # коммита; если enqueue упал, в очередь ничего не попало.
+    async def enqueue(self, user_id: int, rows: List[Any]) -> asyncio.Future:
+        if self._task is None:
+            raise RuntimeError("write queue is not running")
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.setdefault(user_id, set()).add(fut)
+        fut.add_done_callback(lambda f, u=user_id: self._forget(u, f))
+        try:
+            await self._queue.put(WriteGroup(user_id, rows, fut))
+        except BaseException:
+            fut.cancel()
+            raise
+        return fut
+
+    async def submit(self, user_id: int, rows: List[Any]) -> Any:
+        fut = await self.enqueue(user_id, rows)
+        # отмена ожидающего не должна отменять уже поставленную запись
+        return await asyncio.shield(fut)
+
+    def _forget(self, user_id: int, fut: asyncio.Future):
+        futs = self._pending.get(user_id)
+        if futs is not None:
+            futs.discard(fut)
+            if not futs:
+                del self._pending[user_id]
+
+    # read-your-writes: дождаться, пока все отложенные записи пользователя
+    # станут видны в базе
+    async def barrier(self, user_id: int):
+        futs = self._pending.get(user_id)
+        if futs:
+            await asyncio.wait(list(futs))
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        batch: List[WriteGroup] = []
+        try:
+            while not stopping:
+                group = await self._queue.get()
+                if group is None:
+                    break
+                batch = [group]
+                size = len(group.rows)
+                deadline = loop.time() + self.max_latency
+                while size < self.max_batch:
+                    try:
+                        group = self._queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        timeout = deadline - loop.time()
+                        if timeout <= 0:
+                            break
+                        try:
+                            group = await asyncio.wait_for(self._queue.get(), timeout)
+                        except asyncio.TimeoutError:
+                            break
+                    if group is None:
+                        stopping = True
+                        break
+                    batch.append(group)
+                    size += len(group.rows)
+                await self._commit(batch)
+        finally:
+            # писателя отменили: future собранной пачки и всего, что осталось
+            # в очереди, отменяются, иначе barrier() и submit() ждали бы вечно
+            for g in batch:
+                if not g.future.done():
+                    g.future.cancel()
+            while not self._queue.empty():
+                group = self._queue.get_nowait()
+                if group is not None and not group.future.done():
+                    group.future.cancel()
+
+    async def _commit(self, batch: List[WriteGroup]):
+        try:
+            results = await self._flush(batch)
+        except Exception as e:
+            for g in batch:
+                if not g.future.done():
+                    g.future.set_exception(e)
+        else:
+            for g, result in zip(batch, results):
+                if not g.future.done():
+                    g.future.set_result(result)
+        finally:
+            # BaseException (CancelledError) из flush: future без результата
+            # отменяются, чтобы barrier() не ждал их вечно
+            for g in batch:
+                if not g.future.done():
+                    g.future.cancel()